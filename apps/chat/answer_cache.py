@@ -0,0 +1,159 @@
+#apps/chat/answer_cache.py
+"""
+In-process cache of assistant answers placed in front of the agent.
+
+A question hits the cache when its normalized text matches exactly or when its embedding
+(``semantic.embed_texts``) is at least ``CHAT_ANSWER_CACHE_THRESHOLD`` similar to a cached
+question with the same numbers in it ("barcos en 1850" never answers "barcos en 1851").
+Entries belong to the user who asked (``owner``) and are never served to anyone else. Only
+answers of first turns are stored, since later answers may draw on the user's conversation.
+They are looked up for first turns and for questions without references to the previous
+conversation ("¿y en 1851?", "eso", "los mismos", "¿qué te pregunté antes?"...).
+
+Entries are evicted by LRU (``CHAT_ANSWER_CACHE_SIZE``) and TTL (``CHAT_ANSWER_CACHE_TTL``).
+The live ``Message.weight`` of the candidates is read with one query on every hit, so liked
+answers are preferred and disliked or deleted ones are dropped, whichever worker saw the vote.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+from django.conf import settings
+
+from .semantic import EMBEDDING_DIM, embed_texts, normalize_text
+
+NUMBER_RE = re.compile(r"\d+")
+# Palabras que sólo tienen sentido con el contexto de la conversación.
+CONTEXT_WORDS = frozenset("""
+    eso esos esas este esta estos estas ese esa aquel aquella aquellos aquellas ello ellos ellas
+    mismo mismos misma mismas anterior anteriores tambien ademas entonces otro otros otra otras
+    dicho dichos dicha dichas
+    me mi mis nos nuestro nuestra nuestros nuestras te antes conversacion pregunte dije
+    it that those these them they same previous above also again another
+    my me our we you earlier before conversation asked said
+""".split())
+CONTEXT_PREFIXES = ("y ", "and ", "pero ", "but ")
+
+
+def is_context_free(text: str) -> bool:
+    """ True when the question can be answered without the previous turns of the chat. """
+    normalized = normalize_text(text)
+    if not normalized or normalized.startswith(CONTEXT_PREFIXES):
+        return False
+    return not CONTEXT_WORDS.intersection(normalized.split())
+
+
+@dataclass
+class CachedAnswer:
+    message_uid: object
+    text_message: str
+    image: Optional[str]
+
+
+class AnswerCache:
+    """ LRU + TTL answer cache; exact lookups by normalized text, near-duplicates by cosine similarity. """
+
+    def __init__(self, max_entries: int, ttl: float, threshold: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        # (owner, pregunta) -> (slot, answer, numbers, expires_at); el orden es el de uso (LRU).
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._vectors = np.zeros((self.max_entries, EMBEDDING_DIM), dtype=np.float32)
+        self._slot_keys: List[Optional[tuple]] = [None] * self.max_entries
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, key: tuple):
+        slot = self._entries.pop(key)[0]
+        self._vectors[slot] = 0.0
+        self._slot_keys[slot] = None
+        self._free_slots.append(slot)
+
+    def _candidates(self, key: tuple, numbers: tuple, vector: np.ndarray) -> List[tuple]:
+        keys = [key] if key in self._entries else []
+        if self.threshold < 1.0 and self._entries:
+            scores = self._vectors @ vector
+            slots = np.flatnonzero(scores >= self.threshold)
+            for slot in slots[np.argsort(-scores[slots])]:
+                candidate = self._slot_keys[slot]
+                # Sólo respuestas del mismo usuario: nunca se sirve lo que preguntó otro.
+                if candidate != key and candidate[0] == key[0] and self._entries[candidate][2] == numbers:
+                    keys.append(candidate)
+        # TTL perezoso: sólo se miran las entradas candidatas.
+        now = time.monotonic()
+        for expired in [k for k in keys if self._entries[k][3] <= now]:
+            self._evict(expired)
+            keys.remove(expired)
+        return keys
+
+    def get(self, owner, question: str, weights_loader) -> Optional[CachedAnswer]:
+        """
+        Returns the best answer cached for ``owner`` for ``question`` or None.
+        ``weights_loader(message_uids)`` must return ``{uid: weight}`` for the answers that still exist.
+        """
+        text = normalize_text(question)
+        if not text or not self.max_entries:
+            return None
+        vector = embed_texts([text])[0]
+        numbers = tuple(NUMBER_RE.findall(text))
+        key = (owner, text)
+        with self._lock:
+            keys = self._candidates(key, numbers, vector)
+            answers = [self._entries[k][1] for k in keys]
+        if not answers:
+            return None
+
+        weights = weights_loader([answer.message_uid for answer in answers])
+        best_key, best_answer, best_weight = None, None, None
+        with self._lock:
+            for candidate, answer in zip(keys, answers):
+                weight = weights.get(answer.message_uid, 0)
+                weight = 1 if weight is None else weight  # weight es nullable; None cuenta como neutro.
+                if weight <= 0:  # Borrada o con "no me gusta": no se vuelve a servir.
+                    if candidate in self._entries and self._entries[candidate][1] is answer:
+                        self._evict(candidate)
+                    continue
+                # Los candidatos vienen ordenados por similitud: sólo un mayor peso los adelanta.
+                if best_weight is None or weight > best_weight:
+                    best_key, best_answer, best_weight = candidate, answer, weight
+            if best_key in self._entries:
+                self._entries.move_to_end(best_key)
+        return best_answer
+
+    def put(self, owner, question: str, answer: CachedAnswer):
+        text = normalize_text(question)
+        if not text or not self.max_entries:
+            return
+        vector = embed_texts([text])[0]
+        key = (owner, text)
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            while len(self._entries) >= self.max_entries:
+                self._evict(next(iter(self._entries)))
+            slot = self._free_slots.pop()
+            self._vectors[slot] = vector
+            self._slot_keys[slot] = key
+            self._entries[key] = (slot, answer, tuple(NUMBER_RE.findall(text)), time.monotonic() + self.ttl)
+
+
+answer_cache = AnswerCache(
+    max_entries=getattr(settings, "CHAT_ANSWER_CACHE_SIZE", 2048),
+    ttl=getattr(settings, "CHAT_ANSWER_CACHE_TTL", 6 * 60 * 60),
+    threshold=getattr(settings, "CHAT_ANSWER_CACHE_THRESHOLD", 0.9),
+)
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.chat'
+
+    def ready(self):
+        from apps.chat import signals  # noqa: F401 (registra los receivers)
+        from apps.chat.search import install_search_index
+        post_migrate.connect(install_search_index, sender=self)
@@ -0,0 +1,169 @@
+#apps/chat/benchmarks.py
+"""
+Micro-benchmarks of the hot code paths, run by ``python manage.py run_benchmarks``.
+
+Every case seeds its own data in the (test) database, warms up, and is timed for a number
+of rounds; results are machine-readable (``BenchmarkResult.as_dict``) and ``compare``
+reports the change of the median against a previous run.
+"""
+import base64
+import statistics
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from django.contrib.auth import get_user_model
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from apps.utils.enums import RolType
+from .models import Chat, Message
+
+HISTORY_SIZES = (10, 100, 1000)
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    rounds: int
+    items: int  # unidades de trabajo por ronda (mensajes, chats, peticiones...)
+    min: float
+    median: float
+    p95: float
+    mean: float
+    items_per_second: float
+    skipped: Optional[str] = None
+    params: Dict[str, object] = field(default_factory=dict)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class Case:
+    name: str
+    setup: Callable[[], Callable[[], object]]  # prepara los datos y devuelve la función a medir
+    items: int = 1
+    params: Dict[str, object] = field(default_factory=dict)
+    settings: Dict[str, object] = field(default_factory=dict)  # ajustes activos durante el caso
+
+
+def measure(case: Case, rounds: int, warmup: int = 2) -> BenchmarkResult:
+    with override_settings(**case.settings):
+        try:
+            run = case.setup()
+        except ImportError as e:  # Módulo no importable en este árbol: se informa en lugar de fallar.
+            return BenchmarkResult(case.name, 0, case.items, 0, 0, 0, 0, 0, skipped=f"{e.__class__.__name__}: {e}", params=case.params)
+        for _ in range(warmup):
+            run()
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+    timings.sort()
+    median = statistics.median(timings)
+    return BenchmarkResult(
+        name=case.name,
+        rounds=rounds,
+        items=case.items,
+        min=timings[0],
+        median=median,
+        p95=timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))],
+        mean=statistics.fmean(timings),
+        items_per_second=case.items / median if median > 0 else 0.0,
+        params=case.params,
+    )
+
+
+def compare(current: Dict[str, dict], previous: Dict[str, dict], threshold: float) -> List[dict]:
+    """ One row per case present in both runs; ``regression`` when the median grew more than ``threshold``. """
+    rows = []
+    for name, result in current.items():
+        before = previous.get(name)
+        if not before or result.get("skipped") or before.get("skipped") or not before.get("median"):
+            continue
+        change = result["median"] / before["median"] - 1
+        rows.append({"name": name, "previous": before["median"], "current": result["median"],
+                     "change": change, "regression": change > threshold})
+    return rows
+
+
+def seed_chat(user, messages: int, title: str = "Benchmark") -> Chat:
+    chat = Chat.objects.create(registered_by=user, title=title)
+    created = Message.objects.bulk_create(
+        Message(
+            chat_room=chat,
+            rol=RolType.user if index % 2 == 0 else RolType.assistant,
+            text_message=(f"¿Qué barcos llegaron a La Habana en {1800 + index % 100}?" if index % 2 == 0
+                          else "Llegaron 12 goletas y 3 bergantines procedentes de Cádiz y Veracruz. " * 3),
+        )
+        for index in range(messages)
+    )
+    Chat.record_new_messages(chat.pk, created)
+    return chat
+
+
+def build_cases(image_bytes: int = 500_000) -> List[Case]:
+    from rest_framework.test import APIClient
+
+    user, _ = get_user_model().objects.get_or_create(username="benchmark", defaults={"email": "benchmark@example.com"})
+    cases = []
+
+    for size in HISTORY_SIZES:
+        def history_setup(size=size):
+            from apps.chat.langchain_setup import load_langchain_history_from_db
+            chat = seed_chat(user, size, title=f"history-{size}")
+            return lambda: load_langchain_history_from_db(chat)
+        cases.append(Case(f"history_load_{size}", history_setup, items=size, params={"messages": size}))
+
+    def message_serializer_setup():
+        from apps.chat.serializers import MessageSerializer
+        messages = list(Message.objects.filter(chat_room=seed_chat(user, 1000, title="serializer")))
+        return lambda: MessageSerializer(messages, many=True).data
+    cases.append(Case("message_serializer_1000", message_serializer_setup, items=1000))
+
+    def chat_serializer_setup():
+        from apps.chat.serializers import ChatSerializer
+        Chat.objects.bulk_create(Chat(registered_by=user, title=f"Chat {index}") for index in range(200))
+        chats = list(Chat.objects.filter(registered_by=user).select_related("registered_by")[:200])
+        return lambda: ChatSerializer(chats, many=True).data
+    cases.append(Case("chat_serializer_200", chat_serializer_setup, items=200))
+
+    def client():
+        api_client = APIClient()
+        api_client.force_authenticate(user=user)
+        return api_client
+
+    # Las vistas se miden sin la caché de respuestas (run_benchmarks la desactiva) y, aparte, con
+    # ella: tras el calentamiento, los casos *_cached sólo miden aciertos.
+    cached = {"RESPONSE_CACHE_ENABLED": True}
+
+    def chat_list_setup():
+        api_client = client()
+        return lambda: api_client.get(reverse("chats-list"))
+    cases.append(Case("chat_list_view", chat_list_setup))
+    cases.append(Case("chat_list_view_cached", chat_list_setup, settings=cached))
+
+    def message_history_setup():
+        api_client = client()
+        url = reverse("chat-messages", kwargs={"pk": seed_chat(user, 100, title="history-view").uid})
+        return lambda: api_client.get(url)
+    cases.append(Case("message_history_view_100", message_history_setup, params={"messages": 100}))
+    cases.append(Case("message_history_view_100_cached", message_history_setup, params={"messages": 100}, settings=cached))
+
+    def image_save_setup():
+        from apps.chat.emulators import fake_png
+        from apps.chat.tools import save_base64_image
+        data_uri = "data:image/png;base64," + base64.b64encode(fake_png(image_bytes)).decode()
+        return lambda: save_base64_image(data_uri)
+    cases.append(Case("mas_image_decode_save", image_save_setup, params={"image_bytes": image_bytes}))
+
+    def formatted_messages_setup():
+        from apps.utils.managers import Formatted_Messages_Manager
+        manager = Formatted_Messages_Manager()
+        chat = seed_chat(user, 100, title="formatted")
+        return lambda: manager.create_formated_message(chat)
+    cases.append(Case("formatted_messages_100", formatted_messages_setup, items=100, params={"messages": 100}))
+
+    return cases
@@ -0,0 +1,110 @@
+#apps/chat/callbacks.py
+import json
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .cancellation import check_cancelled
+from .metrics import record_llm_call, record_step, record_tool_call
+from .tracing import current_span, set_current_span, start_span
+
+
+def _token_usage(response):
+    """ (prompt, completion) tokens from an LLMResult: ``llm_output`` or the messages' usage_metadata. """
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+    prompt = completion = 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            prompt += metadata.get("input_tokens", 0)
+            completion += metadata.get("output_tokens", 0)
+    return prompt, completion
+
+
+class TurnMetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Times every LLM and tool run of a turn and records token usage (see apps/chat/metrics.py).
+    Each LLM call (one per agent iteration) and tool run is also a tracing span; the tool span
+    is made current so the MAS request nests under it.
+    Create one per turn and pass it as ``config={"callbacks": [handler]}``.
+    """
+
+    def __init__(self):
+        # run_id -> (inicio, span, span anterior, nombre de la herramienta)
+        self._started = {}
+        self.iterations = 0
+
+    def _llm_started(self, run_id):
+        self.iterations += 1
+        self._started[run_id] = (time.perf_counter(), start_span("llm", iteration=self.iterations), None, None)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._llm_started(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._llm_started(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_tokens, completion_tokens = _token_usage(response)
+        self._finished(run_id, "llm", prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        record_llm_call(prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finished(run_id, "llm", error=str(error)[:200])
+        record_llm_call(error=True)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get("name") or "unknown"
+        previous = current_span()
+        tool_span = start_span(f"tool:{name}")
+        if tool_span is not None:
+            set_current_span(tool_span)
+        self._started[run_id] = (time.perf_counter(), tool_span, previous, name)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        # query_historical_data_system no lanza: devuelve su error dentro del JSON.
+        try:
+            ok = not json.loads(output).get("error")
+        except (TypeError, ValueError, AttributeError):
+            ok = True
+        self._tool_finished(run_id, ok=ok)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._tool_finished(run_id, ok=False)
+
+    def _tool_finished(self, run_id, ok):
+        name = self._finished(run_id, "tool", ok=ok)
+        if name is not None:
+            record_tool_call(name, ok=ok)
+
+    def _finished(self, run_id, step, **attrs):
+        """ Records the step duration, closes its span and returns the tool name (if any). """
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return None
+        started_at, run_span, previous, name = started
+        record_step(step, time.perf_counter() - started_at)
+        if run_span is not None:
+            run_span.set(**attrs)
+            run_span.end()
+            if step == "tool":
+                set_current_span(previous)
+        return name
+
+
+class CancellationCallbackHandler(BaseCallbackHandler):
+    """ Stops the agent before its next LLM or tool call once the turn is cancelled (apps/chat/cancellation.py). """
+
+    # Sin raise_error LangChain registraría la excepción y seguiría con la llamada.
+    raise_error = True
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        check_cancelled("llm")
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        check_cancelled("llm")
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        check_cancelled("tool")
@@ -0,0 +1,167 @@
+#apps/chat/cancellation.py
+"""
+Cancellation of an assistant turn whose client went away.
+
+Under ASGI, ``CancelOnDisconnect`` (wrapped around the application in core/asgi.py) gives
+every HTTP request a ``TurnCancellation``. Once the request body has been read, it watches
+the connection and cancels the request when the server reports ``http.disconnect``. A
+streamed turn (``?stream=1``) is also cancelled when its response is closed before the turn
+ends, so this part works under WSGI too.
+
+The turn checks the cancellation at a few points and raises ``TurnCancelled`` there:
+
+- before and after waiting for an LLM limiter slot;
+- before each LLM call and each tool call (``callbacks.CancellationCallbackHandler``);
+- while the agent waits for a tool (``ParallelToolsAgentExecutor``);
+- before the MAS request and between chunks of a streamed MAS answer.
+
+Cancelling also runs the callbacks registered with ``on_cancel``. The MAS tool registers one
+that closes the MAS response, so a streamed MAS answer stops right away. An LLM call that is
+already in progress runs to its end, because the LLM client cannot be interrupted.
+``MessageCreateAV`` keeps the user message and saves the assistant turn with
+``status="aborted"``.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+CLIENT_DISCONNECTED = "client_disconnected"
+STREAM_CLOSED = "stream_closed"
+# Código de nginx para "el cliente cerró la petición": sólo lo ven los logs y las métricas.
+CLIENT_CLOSED_REQUEST = 499
+
+_current_cancellation = contextvars.ContextVar("chat_turn_cancellation", default=None)
+
+
+class TurnCancelled(Exception):
+    """ The client of the turn went away; ``stage`` is the checkpoint that noticed it. """
+
+    def __init__(self, stage: str, reason: str = CLIENT_DISCONNECTED):
+        super().__init__(f"Turn cancelled at {stage} ({reason}).")
+        self.stage = stage
+        self.reason = reason
+
+
+class TurnCancellation:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._callbacks = []
+        self.reason = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = CLIENT_DISCONNECTED):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        logger.info(f"Turn cancelled ({reason}).")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:  # Un callback roto no impide ejecutar los demás.
+                logger.warning(f"Cancellation callback failed: {e}", exc_info=True)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """ Runs ``callback`` on cancel (right away if it already happened); returns a function to unregister it. """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        callback()
+        return lambda: None
+
+    def _discard(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self, stage: str):
+        if self.cancelled:
+            raise TurnCancelled(stage, self.reason)
+
+
+def current_cancellation() -> Optional[TurnCancellation]:
+    return _current_cancellation.get()
+
+
+def set_current_cancellation(cancellation: Optional[TurnCancellation]) -> contextvars.Token:
+    return _current_cancellation.set(cancellation)
+
+
+def reset_current_cancellation(token: contextvars.Token):
+    _current_cancellation.reset(token)
+
+
+def check_cancelled(stage: str):
+    """ Raises ``TurnCancelled`` if the current request was cancelled. """
+    cancellation = _current_cancellation.get()
+    if cancellation is not None:
+        cancellation.raise_if_cancelled(stage)
+
+
+def on_cancel(callback: Callable[[], None]) -> Callable[[], None]:
+    """ ``on_cancel`` of the current request's cancellation (a no-op outside one). """
+    cancellation = _current_cancellation.get()
+    if cancellation is None:
+        return lambda: None
+    return cancellation.on_cancel(callback)
+
+
+class CancelOnDisconnect:
+    """ ASGI middleware: cancels the request's ``TurnCancellation`` when the client disconnects. """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        cancellation = TurnCancellation()
+        body_read = asyncio.Event()
+        disconnected = asyncio.Event()
+
+        async def app_receive():
+            if body_read.is_set():
+                # Tras el cuerpo sólo queda la desconexión, que la escucha el vigilante.
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+                cancellation.cancel(CLIENT_DISCONNECTED)
+            elif not message.get("more_body", False):
+                body_read.set()
+            return message
+
+        async def watch():
+            await body_read.wait()
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    cancellation.cancel(CLIENT_DISCONNECTED)
+                    return
+
+        # Las vistas síncronas corren en hilos de sync_to_async, que copian este contexto.
+        token = set_current_cancellation(cancellation)
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await self.app(scope, app_receive, send)
+        finally:
+            watcher.cancel()
+            reset_current_cancellation(token)
@@ -0,0 +1,286 @@
+#apps/chat/emulators.py
+"""
+Offline stand-ins for OpenAI and the MAS, for deterministic load tests (see locustfile.py).
+
+- ``FakeOpenAI``: ``POST /v1/chat/completions`` compatible with the OpenAI SDK / ChatOpenAI.
+  A turn with tools and a data question (a year or a maritime word) gets a ``tool_calls``
+  answer; a turn after a tool result or without tools gets a text answer. ``stream: true``
+  is answered with server-sent events.
+- ``FakeMAS``: ``POST /api/query`` returning ``text_response`` and, for a share of the
+  queries, a base64 PNG of the configured size. A request that accepts
+  ``application/x-ndjson`` or ``text/event-stream`` gets the answer streamed in that format
+  (``stream_format``: ``ndjson``, ``sse`` or ``off`` for a single-shot MAS).
+
+Latencies are drawn from a seeded distribution (``fixed:0.4``, ``uniform:0.2,1.5``,
+``normal:0.8,0.2``, ``lognormal:-0.5,0.6``) and can be changed while running with
+``POST /_control`` (``{"latency": "fixed:8", "image_ratio": 1.0, "image_bytes": 2000000, "stream_format": "off"}``),
+which is how the Locust scenarios simulate a MAS slowdown.
+Run both with ``python manage.py run_emulators``.
+"""
+import base64
+import json
+import logging
+import math
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DATA_QUERY_RE = re.compile(
+    r"\b(1[5-9]\d\d|barcos?|buques?|goletas?|capitan(es)?|puertos?|viajes?|llegad[ao]s?|ships?|vessels?|captains?|ports?|voyages?)\b",
+    re.IGNORECASE,
+)
+
+
+class LatencyDistribution:
+    """ ``kind:params`` spec, e.g. ``lognormal:-0.5,0.6`` (seconds, never negative). """
+
+    KINDS = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+
+    def __init__(self, spec: str, seed=None):
+        kind, _, params = spec.partition(":")
+        values = [float(value) for value in params.split(",") if value.strip()] if params else [0.0]
+        if kind not in self.KINDS or len(values) != self.KINDS[kind]:
+            raise ValueError(f"Invalid latency spec '{spec}' (use fixed:s, uniform:a,b, normal:mu,sigma or lognormal:mu,sigma).")
+        self.spec = spec
+        self.kind = kind
+        self.values = values
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == "fixed":
+                value = self.values[0]
+            elif self.kind == "uniform":
+                value = self._random.uniform(*self.values)
+            elif self.kind == "normal":
+                value = self._random.gauss(*self.values)
+            else:
+                value = self._random.lognormvariate(*self.values)
+        return max(0.0, value)
+
+
+def fake_png(size: int, seed: int = 0) -> bytes:
+    """ A valid 1x1 PNG padded with an ancillary chunk up to about ``size`` bytes. """
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+    pixels = chunk(b"IDAT", zlib.compress(b"\x00\x1f\x4e\x79"))
+    end = chunk(b"IEND", b"")
+    padding = max(0, size - len(header) - len(pixels) - len(end) - 12)
+    return header + chunk(b"paDd", random.Random(seed).randbytes(padding)) + pixels + end
+
+
+def approx_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / 4))
+
+
+class EmulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, latency: str, seed=None, **options):
+        super().__init__(address, handler)
+        self.seed = seed
+        self.latency = LatencyDistribution(latency, seed)
+        self.options = options
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def control(self, changes: dict):
+        if "latency" in changes:
+            self.latency = LatencyDistribution(changes["latency"], self.seed)
+        for key in self.options:
+            if key in changes:
+                self.options[key] = type(self.options[key])(changes[key])
+
+    def state(self) -> dict:
+        return {"latency": self.latency.spec, "requests": self.requests, **self.options}
+
+
+class EmulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return {}
+
+    def send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/_control":
+            return self.send_json(self.server.state())
+        self.send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        payload = self.read_json()
+        if self.path.rstrip("/") == "/_control":
+            try:
+                self.server.control(payload)
+            except (TypeError, ValueError) as e:
+                return self.send_json({"error": str(e)}, status=400)
+            return self.send_json(self.server.state())
+        self.server.requests += 1
+        self.handle_query(payload)
+
+    def handle_query(self, payload: dict):
+        """ Answers a POST outside ``/_control``; each emulator overrides it for its API. """
+        self.send_json({"error": "not found"}, status=404)
+
+
+class FakeOpenAIHandler(EmulatorHandler):
+    def handle_query(self, payload: dict):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self.send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+        messages = payload.get("messages") or []
+        last = messages[-1] if messages else {}
+        user_text = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        if isinstance(user_text, list):  # Contenido multimodal: sólo las partes de texto.
+            user_text = " ".join(part.get("text", "") for part in user_text if isinstance(part, dict))
+        prompt_tokens = sum(approx_tokens(str(m.get("content") or "")) for m in messages)
+
+        message = {"role": "assistant", "content": None}
+        tools = payload.get("tools") or []
+        if tools and last.get("role") == "user" and DATA_QUERY_RE.search(user_text):
+            message["tool_calls"] = [{
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": tools[0]["function"]["name"], "arguments": json.dumps({"user_query": user_text})},
+            }]
+            finish_reason = "tool_calls"
+        else:
+            if last.get("role") == "tool":
+                text = f"Según los datos históricos: {str(last.get('content'))[:200]}"
+            else:
+                text = f"Respuesta simulada a: {user_text[:200]}"
+            message["content"] = text
+            finish_reason = "stop"
+        completion_tokens = approx_tokens(message["content"] or json.dumps(message.get("tool_calls")))
+
+        delay = self.server.latency.sample()
+        completion = {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake-gpt"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+        if payload.get("stream"):
+            return self.stream(completion, delay)
+        time.sleep(delay)
+        self.send_json(completion)
+
+    def stream(self, completion: dict, delay: float):
+        """ Server-sent events: the first chunk after half the latency, the rest spread over the other half. """
+        choice = completion["choices"][0]
+        message = choice["message"]
+        base = {key: completion[key] for key in ("id", "created", "model")}
+        base["object"] = "chat.completion.chunk"
+        if message.get("tool_calls"):
+            deltas = [{"role": "assistant", "tool_calls": [{"index": 0, **message["tool_calls"][0]}]}]
+        else:
+            words = re.findall(r"\S+\s*", message["content"])
+            deltas = [{"role": "assistant", "content": ""}] + [{"content": word} for word in words]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        time.sleep(delay / 2)
+        for delta in deltas:
+            chunk = {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None, "logprobs": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(delay / 2 / len(deltas))
+        final = {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"], "logprobs": None}],
+                 "usage": completion["usage"]}
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+        self.wfile.flush()
+
+
+class FakeMASHandler(EmulatorHandler):
+    def handle_query(self, payload: dict):
+        if self.path.rstrip("/") != "/api/query":
+            return self.send_json({"error": f"Unknown path {self.path}"}, status=404)
+        query = str(payload.get("query") or "")
+        options = self.server.options
+        # Determinista por consulta: la misma pregunta siempre trae (o no) imagen.
+        rng = random.Random(f"{self.server.seed}:{query}")
+        response = {"text_response": f"Resultado simulado para '{query[:200]}': {rng.randint(1, 500)} registros.",
+                    "image_response": None, "error": None}
+        if rng.random() < options["image_ratio"]:
+            image = fake_png(options["image_bytes"], seed=rng.randint(0, 2 ** 31))
+            response["image_response"] = "data:image/png;base64," + base64.b64encode(image).decode()
+        delay = self.server.latency.sample()
+        accept = self.headers.get("Accept", "")
+        stream_format = options["stream_format"]
+        if stream_format == "sse" and "text/event-stream" in accept:
+            return self.stream(response, delay, "text/event-stream", lambda chunk: f"data: {json.dumps(chunk)}\n\n")
+        if stream_format == "ndjson" and "application/x-ndjson" in accept:
+            return self.stream(response, delay, "application/x-ndjson", lambda chunk: json.dumps(chunk) + "\n")
+        time.sleep(delay)
+        self.send_json(response)
+
+    def stream(self, response: dict, delay: float, content_type: str, encode):
+        """ Streaming protocol of the MAS: ``text`` deltas spread over the latency, then ``image`` and ``done``. """
+        words = re.findall(r"\S+\s*", response["text_response"])
+        chunks = [{"type": "text", "delta": word} for word in words]
+        if response["image_response"]:
+            chunks.append({"type": "image", "image_response": response["image_response"]})
+        chunks.append({"type": "done"})
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for chunk in chunks:
+            time.sleep(delay / len(chunks))
+            self.wfile.write(encode(chunk).encode())
+            self.wfile.flush()
+
+
+def make_llm_server(host="127.0.0.1", port=0, latency="lognormal:-0.7,0.5", seed=0) -> EmulatorServer:
+    return EmulatorServer((host, port), FakeOpenAIHandler, latency=latency, seed=seed)
+
+
+def make_mas_server(host="127.0.0.1", port=0, latency="lognormal:0.0,0.4", seed=0,
+                    image_ratio=0.3, image_bytes=200_000, stream_format="ndjson") -> EmulatorServer:
+    if stream_format not in ("ndjson", "sse", "off"):
+        raise ValueError(f"Invalid stream format '{stream_format}' (use ndjson, sse or off).")
+    return EmulatorServer((host, port), FakeMASHandler, latency=latency, seed=seed,
+                          image_ratio=float(image_ratio), image_bytes=int(image_bytes), stream_format=stream_format)
+
+
+def serve_in_thread(server: EmulatorServer) -> threading.Thread:
+    thread = threading.Thread(target=server.serve_forever, name=f"emulator-{server.server_address[1]}", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,101 @@
+#apps/chat/executor.py
+"""
+``AgentExecutor`` that runs the tool calls of one model step concurrently.
+
+When the model asks for several MAS lookups at once (e.g. comparing two ports), the sync
+path submits every call to a shared thread pool and waits for them in order, so the step
+takes as long as the slowest lookup. The async path already uses ``asyncio.gather``; both
+give each call ``tool_timeout`` seconds and turn a timeout into an error observation.
+Imported lazily by ``langchain_setup.build_agent_executor`` (it needs LangChain).
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentStep
+
+from .cancellation import current_cancellation
+
+logger = logging.getLogger(__name__)
+
+_tool_pool = None
+_tool_pool_lock = threading.Lock()
+
+
+def get_tool_pool() -> ThreadPoolExecutor:
+    """ Process-wide pool of the tool calls (created on first use, after the gunicorn fork). """
+    global _tool_pool
+    if _tool_pool is None:
+        with _tool_pool_lock:
+            if _tool_pool is None:
+                _tool_pool = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "CHAT_TOOL_MAX_WORKERS", 16), thread_name_prefix="agent-tool",
+                )
+    return _tool_pool
+
+
+def timeout_observation(tool: str, timeout: float) -> str:
+    """ Same JSON shape as ``query_historical_data_system`` so the agent and the view handle it alike. """
+    return json.dumps({
+        "error": f"La herramienta {tool} no respondió en {timeout:.0f} s.",
+        "text_response": "Información no disponible (timeout).",
+        "image_path": None,
+    })
+
+
+class ParallelToolsAgentExecutor(AgentExecutor):
+    tool_timeout: float = 75.0
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        # Devuelve un Future: la herramienta arranca ya y _iter_next_step espera los resultados en orden.
+        future = get_tool_pool().submit(
+            contextvars.copy_context().run, super()._perform_agent_action,
+            name_to_tool_map, color_mapping, agent_action, run_manager,
+        )
+        future.action = agent_action
+        future.deadline = time.monotonic() + self.tool_timeout
+        return future
+
+    def _iter_next_step(self, *args, **kwargs):
+        # Recorrer el paso entero lanza todas las herramientas antes de esperar a la primera.
+        for item in list(super()._iter_next_step(*args, **kwargs)):
+            yield self._tool_result(item) if isinstance(item, Future) else item
+
+    def _tool_result(self, future: Future) -> AgentStep:
+        cancellation = current_cancellation()
+        try:
+            if cancellation is not None:
+                # Si el cliente se va, el turno no espera a la herramienta: su hilo termina solo y se descarta.
+                woken = threading.Event()
+                future.add_done_callback(lambda _: woken.set())
+                unregister = cancellation.on_cancel(woken.set)
+                try:
+                    woken.wait(max(0.0, future.deadline - time.monotonic()))
+                finally:
+                    unregister()
+                # Sólo una cancelación real corta el turno; si venció el plazo se trata como timeout abajo.
+                if not future.done() and cancellation.cancelled:
+                    future.cancel()
+                    cancellation.raise_if_cancelled("tool")
+            return future.result(timeout=max(0.0, future.deadline - time.monotonic()))
+        except (FutureTimeoutError, CancelledError):
+            future.cancel()  # Si aún no arrancó (pool lleno), no llega a ocupar un hilo.
+            logger.warning(f"Tool {future.action.tool} timed out after {self.tool_timeout:.0f}s; continuing without it.")
+            return AgentStep(action=future.action, observation=timeout_observation(future.action.tool, self.tool_timeout))
+
+    async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        try:
+            return await asyncio.wait_for(
+                super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager),
+                timeout=self.tool_timeout,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Tool {agent_action.tool} timed out after {self.tool_timeout:.0f}s; continuing without it.")
+            return AgentStep(action=agent_action, observation=timeout_observation(agent_action.tool, self.tool_timeout))
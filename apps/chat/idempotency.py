@@ -0,0 +1,173 @@
+#apps/chat/idempotency.py
+"""
+Idempotent message posts: a retried ``POST /api/chats/<uid>/messages/`` never runs the agent twice.
+
+The first request with an ``Idempotency-Key`` claims it in the cache (``cache.add``) and runs
+the turn. A retry with the same key follows one of two paths:
+
+- While the first request still runs, the retry waits for it (up to ``CHAT_IDEMPOTENCY_WAIT``
+  seconds) and gets the same response.
+- Once the first request is done, the retry gets the stored response for
+  ``CHAT_IDEMPOTENCY_TTL`` seconds.
+
+The turn runs in a transaction opened here (the view has no ``ATOMIC_REQUESTS`` transaction),
+and its response is stored only once that transaction commits: a retry never gets the uid of
+a message that was rolled back, or one that ``GET`` cannot see yet. If the transaction rolls
+back, the key is freed.
+
+Replays carry ``Idempotent-Replayed: true``. A key reused with another text gets a 422.
+Errors worth retrying (429 and 5xx) and turns cancelled because the client went away (499)
+are not stored, so a retry runs the turn again.
+
+A post without a key is keyed by its text: the same question sent twice to the same chat
+within ``CHAT_DUPLICATE_WINDOW`` seconds (a double click, a client retry) gets the first
+answer instead of a second turn.
+
+Claims and results live in the ``default`` cache, which must be shared (``CACHE_URL``) for
+a retry that lands on another worker to see them. Waiters in the same worker are woken up
+by an event; the others poll the cache.
+"""
+import hashlib
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from .cancellation import CLIENT_CLOSED_REQUEST
+from .semantic import normalize_text
+
+logger = logging.getLogger(__name__)
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADER = "Idempotent-Replayed"
+# Cabeceras de la respuesta original que se repiten al reproducirla.
+REPLAYED_HEADERS = ("X-Answer-Cache", "X-Trace-Id", "Retry-After")
+POLL_SECONDS = 0.25
+
+IN_FLIGHT = "in_flight"
+DONE = "done"
+
+
+class IdempotencyStore:
+    """ Claims and results of the posts, in the ``default`` cache plus local events for waiters. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = {}
+
+    @staticmethod
+    def _cache_key(key: str) -> str:
+        return f"idempotency:{key}"
+
+    def claim(self, key: str, fingerprint: str) -> Optional[dict]:
+        """ ``None`` when this request now owns ``key``; otherwise the record of the request that does. """
+        in_flight_ttl = getattr(settings, "CHAT_IDEMPOTENCY_IN_FLIGHT_TTL", 300)
+        record = {"state": IN_FLIGHT, "fingerprint": fingerprint}
+        if cache.add(self._cache_key(key), record, timeout=in_flight_ttl):
+            with self._lock:
+                self._events[key] = threading.Event()
+            return None
+        return cache.get(self._cache_key(key)) or self.claim(key, fingerprint)
+
+    def complete(self, key: str, fingerprint: str, response, ttl: int):
+        """ Stores the final response (or frees the key if it is worth retrying) and wakes the waiters. """
+        try:
+            if response is None or response.status_code in (status.HTTP_429_TOO_MANY_REQUESTS, CLIENT_CLOSED_REQUEST) \
+                    or response.status_code >= 500:
+                cache.delete(self._cache_key(key))
+            else:
+                cache.set(self._cache_key(key), {
+                    "state": DONE,
+                    "fingerprint": fingerprint,
+                    "status": response.status_code,
+                    "data": response.data,
+                    "headers": {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)},
+                }, timeout=ttl)
+        finally:
+            with self._lock:
+                event = self._events.pop(key, None)
+            if event is not None:
+                event.set()
+
+    def wait(self, key: str, timeout: float) -> Optional[dict]:
+        """ The record once it is done; ``None`` if it was freed (or expired) or ``timeout`` ran out. """
+        deadline = time.monotonic() + timeout
+        while True:
+            record = cache.get(self._cache_key(key))
+            if record is None or record["state"] == DONE:
+                return record
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return record
+            with self._lock:
+                event = self._events.get(key)
+            if event is not None:
+                event.wait(min(remaining, 5.0))
+            else:
+                time.sleep(min(remaining, POLL_SECONDS))
+
+
+idempotency_store = IdempotencyStore()
+
+
+def replay(record: dict) -> Response:
+    response = Response(record["data"], status=record["status"], headers=record["headers"])
+    response[REPLAYED_HEADER] = "true"
+    return response
+
+
+def run_once(request, chat_uid, turn: Callable[[], Response]) -> Response:
+    """
+    Runs ``turn`` unless an identical post (same ``Idempotency-Key``, or same text within
+    ``CHAT_DUPLICATE_WINDOW``) already ran or is running; then returns that post's response.
+    """
+    text = request.data.get("text_message") if hasattr(request.data, "get") else None
+    fingerprint = hashlib.sha1(normalize_text(text if isinstance(text, str) else "").encode()).hexdigest()
+    explicit_key = request.headers.get(HEADER)
+    if explicit_key is not None:
+        if not explicit_key or len(explicit_key) > MAX_KEY_LENGTH:
+            return Response({"error": f"{HEADER} must have between 1 and {MAX_KEY_LENGTH} characters."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        key = f"{request.user.pk}:{chat_uid}:key:{hashlib.sha1(explicit_key.encode()).hexdigest()}"
+        ttl = getattr(settings, "CHAT_IDEMPOTENCY_TTL", 86400)
+    else:
+        ttl = getattr(settings, "CHAT_DUPLICATE_WINDOW", 10)
+        if ttl <= 0 or not isinstance(text, str) or not text.strip():
+            return turn()
+        # Mismo texto normalizado en el mismo chat: doble clic o reintento sin clave.
+        key = f"{request.user.pk}:{chat_uid}:text:{fingerprint}"
+
+    while True:
+        record = idempotency_store.claim(key, fingerprint)
+        if record is None:
+            response, committed = None, []
+            try:
+                with transaction.atomic():
+                    response = turn()
+                    transaction.on_commit(lambda: committed.append(True))
+                return response
+            finally:
+                # Sin confirmar (rollback, o una transacción exterior aún abierta) no se guarda nada.
+                idempotency_store.complete(key, fingerprint, response if committed else None, ttl)
+
+        if record["fingerprint"] != fingerprint:
+            return Response({"error": f"{HEADER} was already used with a different message."},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if record["state"] == IN_FLIGHT:
+            logger.info(f"Post to chat {chat_uid} is a retry of a turn in flight; waiting for it.")
+            wait = getattr(settings, "CHAT_IDEMPOTENCY_WAIT", 120)
+            record = idempotency_store.wait(key, wait)
+            if record is None:
+                continue  # La petición original falló sin guardar respuesta: este reintento la ejecuta.
+            if record["state"] == IN_FLIGHT:
+                return Response({"error": "La petición original sigue en curso."}, status=status.HTTP_409_CONFLICT,
+                                headers={"Retry-After": str(max(1, int(wait // 4)))})
+        logger.info(f"Replaying the stored response of a duplicate post to chat {chat_uid}.")
+        return replay(record)
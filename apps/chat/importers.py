@@ -0,0 +1,245 @@
+#apps/chat/importers.py
+from datetime import timedelta, timezone as dt_timezone
+import uuid
+from typing import Any, Dict, Iterable, List
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from apps.utils.enums import RolType
+from .models import Chat, Message
+from .response_cache import bump_user
+from .semantic import index_user_messages
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 20
+VALID_ROLES = frozenset(RolType.__members__)
+TITLE_MAX_LENGTH = Chat._meta.get_field("title").max_length
+IMAGE_MAX_LENGTH = Message._meta.get_field("image").max_length
+PASSTHROUGH_FIELD_TYPES = ("CharField", "TextField", "IntegerField", "BooleanField")
+
+
+def _parse_timestamp(value, errors, where):
+    if value in (None, ""):
+        return None
+    try:
+        parsed = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:  # Bien formada pero imposible, p. ej. 2024-02-30T00:00:00.
+        parsed = None
+    if parsed is None:
+        errors.append(f"{where}: invalid created_at '{value}'.")
+        return None
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def bulk_insert_rows(model, rows: List[Dict[str, Any]], batch_size: int = DEFAULT_BATCH_SIZE):
+    """
+    Inserts plain ``{attname: value}`` rows batch by batch (``executemany`` on SQLite,
+    multi-row ``VALUES`` elsewhere).
+
+    Unlike ``bulk_create`` it neither instantiates models nor runs ``pre_save``, so the
+    given ``created_at``/``updated_at`` are kept (``auto_now_add`` would overwrite them).
+    Missing columns take the field default, prepared once per call.
+    """
+    if not rows:
+        return 0
+    connection = connections[router.db_for_write(model)]
+    fields = model._meta.concrete_fields
+    given = rows[0].keys()
+    defaults = {
+        field.attname: field.get_db_prep_save(field.get_default(), connection)
+        for field in fields if field.attname not in given
+    }
+    # Texto y enteros van tal cual; el resto (uuid, fechas, FKs...) se adapta al backend.
+    adapted = [
+        field for field in fields
+        if field.attname in given and field.get_internal_type() not in PASSTHROUGH_FIELD_TYPES
+    ]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    row_placeholder = "(" + ", ".join(["%s"] * len(fields)) + ")"
+    if connection.vendor != "sqlite":
+        # executemany en psycopg2 es un round trip por fila: mejor INSERT multi-fila.
+        batch_size = min(batch_size, connection.ops.bulk_batch_size(fields, rows) or batch_size)
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            params = []
+            for row in rows[start:start + batch_size]:
+                values = dict(defaults)
+                values.update(row)
+                for field in adapted:
+                    values[field.attname] = field.get_db_prep_save(values[field.attname], connection)
+                params.append([values[field.attname] for field in fields])
+            if connection.vendor == "sqlite":
+                cursor.executemany(f"INSERT INTO {table} ({columns}) VALUES {row_placeholder}", params)
+            else:
+                values_sql = ", ".join([row_placeholder] * len(params))
+                cursor.execute(
+                    f"INSERT INTO {table} ({columns}) VALUES {values_sql}",
+                    [value for row_params in params for value in row_params],
+                )
+    return len(rows)
+
+
+class ConversationImporter:
+    """
+    Bulk imports chats with their messages for a single user.
+
+    Every record is one chat::
+
+        {"title": "...", "description": "...", "created_at": "2024-01-01T10:00:00Z",
+         "messages": [{"rol": "user", "text_message": "...", "created_at": "..."}, ...]}
+
+    Records are validated in Python and written in batches with ``bulk_insert_rows``; no
+    model instance is built per message. Messages keep
+    the given ``created_at`` (sorted per chat); a message without one is placed right
+    after the latest message seen before it in the input.
+    """
+
+    def __init__(self, user, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.chat_count = 0
+        self.message_count = 0
+        self.chat_uids: List[str] = []
+
+    def validate_record(self, record: Any, number: int, now):
+        """ Returns (chat row, message rows, errors) for one NDJSON record without touching the DB. """
+        errors: List[str] = []
+        where = f"record {number}"
+        if not isinstance(record, dict):
+            return None, [], [f"{where}: expected a JSON object."]
+
+        title = record.get("title")
+        if title is not None and (not isinstance(title, str) or len(title) > TITLE_MAX_LENGTH):
+            errors.append(f"{where}: title must be a string of at most {TITLE_MAX_LENGTH} characters.")
+        description = record.get("description")
+        if description is not None and not isinstance(description, str):
+            errors.append(f"{where}: description must be a string.")
+
+        raw_messages = record.get("messages", [])
+        if not isinstance(raw_messages, list):
+            errors.append(f"{where}: messages must be a list.")
+            raw_messages = []
+
+        chat_created_at = _parse_timestamp(record.get("created_at"), errors, where)
+        parsed_messages = []
+        for index, raw in enumerate(raw_messages):
+            message_where = f"{where}, message {index}"
+            if not isinstance(raw, dict):
+                errors.append(f"{message_where}: expected a JSON object.")
+                continue
+            text_message = raw.get("text_message")
+            if not isinstance(text_message, str) or not text_message:
+                errors.append(f"{message_where}: text_message is required.")
+            rol = raw.get("rol")
+            if rol not in VALID_ROLES:
+                errors.append(f"{message_where}: rol must be one of {sorted(VALID_ROLES)}.")
+            image = raw.get("image")
+            if image is not None and (not isinstance(image, str) or len(image) > IMAGE_MAX_LENGTH):
+                errors.append(f"{message_where}: image must be a path of at most {IMAGE_MAX_LENGTH} characters.")
+            weight = raw.get("weight", 1)
+            if weight is not None and (isinstance(weight, bool) or not isinstance(weight, int)):
+                errors.append(f"{message_where}: weight must be an integer.")
+            created_at = _parse_timestamp(raw.get("created_at"), errors, message_where)
+            parsed_messages.append((created_at, index, text_message, rol, image, weight))
+
+        if errors:
+            return None, [], errors
+
+        # Sin marca de tiempo: se coloca justo después del mensaje más reciente visto hasta ahora.
+        first_known = next((m[0] for m in parsed_messages if m[0] is not None), None)
+        cursor = chat_created_at or first_known or now
+        timed_messages = []
+        for created_at, index, text_message, rol, image, weight in parsed_messages:
+            if created_at is None:
+                created_at = cursor + timedelta(microseconds=1) if timed_messages else cursor
+            cursor = max(cursor, created_at)
+            timed_messages.append((created_at, index, text_message, rol, image, weight))
+        timed_messages.sort(key=lambda m: (m[0], m[1]))
+
+        chat_uid = uuid.uuid4()
+        chat_created_at = chat_created_at or (timed_messages[0][0] if timed_messages else now)
+        chat = {
+            "uid": chat_uid,
+            "title": title,
+            "description": description,
+            "registered_by_id": self.user.pk,
+            "created_at": chat_created_at,
+            "updated_at": timed_messages[-1][0] if timed_messages else chat_created_at,
+            "last_message_at": timed_messages[-1][0] if timed_messages else chat_created_at,
+            "message_count": len(timed_messages),
+            "last_message_preview": Chat.preview_of(timed_messages[-1][2]) if timed_messages else "",
+        }
+        messages = [
+            {
+                "uid": uuid.uuid4(),
+                "chat_room_id": chat_uid,
+                "text_message": text_message,
+                "rol": rol,
+                "image": image,
+                "weight": weight,
+                "created_at": created_at,
+                "updated_at": created_at,
+            }
+            for created_at, _, text_message, rol, image, weight in timed_messages
+        ]
+        return chat, messages, []
+
+    def _write_batch(self, chats: List[Dict[str, Any]], messages: List[Dict[str, Any]]):
+        bulk_insert_rows(Chat, chats, self.batch_size)
+        bulk_insert_rows(Message, messages, self.batch_size)
+        # Las inserciones en bloque no disparan post_save: el índice semántico se alimenta aquí.
+        questions = [(row["uid"], row["text_message"]) for row in messages if row["rol"] == RolType.user]
+        transaction.on_commit(lambda user_id=self.user.pk, items=questions: index_user_messages(user_id, items))
+
+        self.chat_count += len(chats)
+        self.message_count += len(messages)
+        self.chat_uids.extend(str(chat["uid"]) for chat in chats)
+
+    def run(self, records: Iterable[Any]) -> Dict[str, Any]:
+        """
+        Validates and writes ``records`` batch by batch inside one transaction, then
+        invalidates the user's cached responses. Raises ValidationError (nothing is
+        written) if any record is invalid.
+        """
+        now = timezone.now()
+        errors: List[str] = []
+        chats: List[Dict[str, Any]] = []
+        messages: List[Dict[str, Any]] = []
+        with transaction.atomic():
+            for number, record in enumerate(records, start=1):
+                chat, chat_messages, record_errors = self.validate_record(record, number, now)
+                if record_errors:
+                    errors.extend(record_errors)
+                    if len(errors) >= MAX_REPORTED_ERRORS:
+                        break
+                    continue
+                if errors:
+                    continue  # Solo se sigue validando para informar todos los errores.
+                chats.append(chat)
+                messages.extend(chat_messages)
+                if len(messages) >= self.batch_size or len(chats) >= self.batch_size:
+                    self._write_batch(chats, messages)
+                    chats, messages = [], []
+
+            if errors:
+                raise ValidationError(errors[:MAX_REPORTED_ERRORS])
+            if chats:
+                self._write_batch(chats, messages)
+            # Los chats nuevos cambian el listado del usuario (al confirmar).
+            bump_user(self.user.pk)
+
+        return self.summary()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "chats": self.chat_count,
+            "messages": self.message_count,
+            "chat_uids": self.chat_uids,
+        }
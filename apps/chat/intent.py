@@ -0,0 +1,220 @@
+#apps/chat/intent.py
+"""
+Local intent pre-classifier in front of the tools agent.
+
+Greetings and small talk are answered with one plain LLM completion (no tool schema), and
+explicit historical-data questions call the MAS tool right away so the LLM is only asked to
+phrase its result. Both save the agent's tool-decision round trip. Anything else, or any
+case without enough confidence, still goes through the agent.
+
+The decision is made by rules first and then by a nearest-centroid model over the local
+embeddings of ``semantic.embed_texts``. The centroids start from a few seed phrases and are
+retrained from the message history with ``python manage.py train_intent_model``.
+"""
+import itertools
+import logging
+import os
+import re
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from apps.utils.enums import IntentType
+from .answer_cache import is_context_free
+from .semantic import EMBEDDING_DIM, embed_texts, normalize_text
+
+logger = logging.getLogger(__name__)
+
+GREETING_RE = re.compile(
+    r"^(hola|hey|hi|hello|buen(os|as)( (dias|tardes|noches))?|saludos|que tal|como (estas|esta|te va)"
+    r"|gracias|muchas gracias|thanks|thank you|adios|chao|hasta (luego|pronto|manana)|bye|ok|vale|perfecto|genial)\b"
+)
+DATA_WORDS = frozenset("""
+    barco barcos buque buques goleta goletas bergantin bergantines fragata fragatas navio navios vapor vapores
+    embarcacion embarcaciones capitan capitanes puerto puertos viaje viajes travesia travesias llegada llegadas
+    llego llegaron salida salidas salio salieron zarpo zarparon tripulacion carga cargamento bandera banderas
+    ship ships vessel vessels captain captains port ports voyage voyages arrival arrivals departure departures cargo
+""".split())
+DATA_REQUEST_WORDS = frozenset("""
+    que cual cuales cuantos cuantas cuando donde quien quienes como muestra muestrame dame lista listar
+    grafica grafico genera compara what which how when where who show list plot chart compare count
+""".split())
+YEAR_RE = re.compile(r"\b1[5-9]\d\d\b")
+MAX_CHITCHAT_WORDS = 6
+
+SEED_EXAMPLES = {
+    IntentType.chitchat: [
+        "hola", "buenos dias", "buenas tardes como estas", "gracias por tu ayuda", "adios hasta luego",
+        "quien eres", "que puedes hacer", "hello there", "thanks a lot", "how are you",
+    ],
+    IntentType.data_query: [
+        "que barcos llegaron a la habana en 1850", "cuantos viajes hizo el capitan", "muestrame un grafico de llegadas por puerto",
+        "lista de buques con bandera inglesa", "que carga traian las goletas", "which ships arrived in 1850",
+        "how many voyages did the captain make", "plot arrivals per port",
+    ],
+}
+LABELS = (IntentType.chitchat, IntentType.data_query)
+
+
+def model_path() -> str:
+    return str(getattr(settings, "CHAT_INTENT_MODEL_PATH", os.path.join(settings.BASE_DIR, "var", "intent_model.npz")))
+
+
+def has_data_words(words) -> bool:
+    return bool(DATA_WORDS.intersection(words)) or bool(YEAR_RE.search(" ".join(words)))
+
+
+def rule_intent(text: str) -> Optional[str]:
+    """ Confident rule-based decision, or None when the rules do not apply. """
+    words = normalize_text(text).split()
+    data_words = has_data_words(words)
+    if not data_words and words and len(words) <= MAX_CHITCHAT_WORDS and GREETING_RE.match(" ".join(words)):
+        return IntentType.chitchat
+    if data_words and DATA_REQUEST_WORDS.intersection(words):
+        return IntentType.data_query
+    return None
+
+
+class IntentClassifier:
+    """ Rules + nearest-centroid model; answers ``IntentType.agent`` whenever it is not sure. """
+
+    def __init__(self, min_margin: float):
+        self.min_margin = min_margin
+        self._centroids: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fit(examples: Iterable[Tuple[str, str]], batch_size: int = 2048) -> Tuple[np.ndarray, Dict[str, int]]:
+        """ Returns the L2 normalised centroid of every label in ``LABELS`` and the example counts. """
+        sums = np.zeros((len(LABELS), EMBEDDING_DIM), dtype=np.float64)
+        counts = {label: 0 for label in LABELS}
+        batch = []
+
+        def flush():
+            vectors = embed_texts([text for text, _ in batch])
+            rows = np.asarray([LABELS.index(label) for _, label in batch])
+            np.add.at(sums, rows, vectors)
+
+        seeds = [(text, label) for label in LABELS for text in SEED_EXAMPLES[label]]
+        for text, label in itertools.chain(seeds, examples):
+            batch.append((text, label))
+            counts[label] += 1
+            if len(batch) >= batch_size:
+                flush()
+                batch = []
+        if batch:
+            flush()
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        return (sums / np.where(norms > 0, norms, 1.0)).astype(np.float32), counts
+
+    def load(self):
+        """ Loads the trained centroids, falling back to the seed examples. """
+        try:
+            with np.load(model_path()) as data:
+                centroids = data["centroids"]
+        except (FileNotFoundError, KeyError, ValueError):
+            centroids, _ = self.fit([])
+        with self._lock:
+            self._centroids = centroids
+
+    def save(self, centroids: np.ndarray):
+        os.makedirs(os.path.dirname(model_path()), exist_ok=True)
+        with open(model_path(), "wb") as handle:
+            np.savez(handle, centroids=centroids)
+        with self._lock:
+            self._centroids = centroids
+
+    def model_intent(self, text: str) -> Optional[str]:
+        """
+        Nearest centroid with a minimum margin. The model only confirms what the vocabulary
+        allows: a data query needs a maritime word or a year, small talk must have none
+        (hashed trigrams alone would send "capital de Francia" next to "capitanes").
+        """
+        if self._centroids is None:
+            self.load()
+        scores = self._centroids @ embed_texts([text])[0]
+        best, second = np.argsort(-scores)[:2]
+        if scores[best] - scores[second] < self.min_margin:
+            return None
+        if (LABELS[best] == IntentType.data_query) != has_data_words(normalize_text(text).split()):
+            return None
+        return LABELS[best]
+
+    def classify(self, text: str, has_history: bool = False) -> str:
+        intent = rule_intent(text) or self.model_intent(text)
+        # Una consulta de datos que depende del contexto ("¿y en 1851?") necesita al agente para reescribirla.
+        if intent == IntentType.data_query and has_history and not is_context_free(text):
+            return IntentType.agent
+        return intent or IntentType.agent
+
+
+def history_examples(rows: Iterable[Tuple[object, str, str, Optional[str]]]):
+    """
+    Labels user questions from ``(chat_uid, rol, text, image)`` rows ordered by chat and date:
+    the rules label what they can, and a question answered with a chart is a data query.
+    """
+    pending = None
+    for chat_uid, rol, text, image in rows:
+        if rol == "user":
+            if pending and pending[2]:
+                yield pending[1], pending[2]
+            pending = (chat_uid, text, rule_intent(text))
+        elif rol == "assistant" and pending and pending[0] == chat_uid:
+            label = pending[2] or (IntentType.data_query if image else None)
+            if label:
+                yield pending[1], label
+            pending = None
+    if pending and pending[2]:
+        yield pending[1], pending[2]
+
+
+class IntentRouter:
+    """
+    Drop-in replacement for the tools ``AgentExecutor``: same ``invoke`` input and output
+    (``output`` + ``intermediate_steps``), plus the ``intent`` that was used.
+    """
+
+    def __init__(self, agent_executor, llm, data_tool, chat_prompt, answer_prompt, classifier: IntentClassifier):
+        self.agent_executor = agent_executor
+        self.llm = llm
+        self.data_tool = data_tool
+        self.chat_prompt = chat_prompt
+        self.answer_prompt = answer_prompt
+        self.classifier = classifier
+
+    def invoke(self, inputs: dict, config=None) -> dict:
+        history = inputs.get("chat_history") or []
+        user_input = inputs["user_input"]
+        text = getattr(user_input, "content", user_input)
+
+        intent = IntentType.agent
+        if getattr(settings, "CHAT_INTENT_ROUTING_ENABLED", True):
+            try:
+                intent = self.classifier.classify(text, has_history=bool(history))
+            except Exception as e:  # El clasificador nunca debe tumbar el turno.
+                logger.error(f"Intent classification failed, falling back to the agent: {e}", exc_info=True)
+        logger.info(f"Intent for turn: {intent}")
+
+        if intent == IntentType.chitchat:
+            reply = self.llm.invoke(self.chat_prompt.format_messages(chat_history=history, user_input=text), config)
+            return {"output": reply.content, "intermediate_steps": [], "intent": intent}
+
+        if intent == IntentType.data_query:
+            from langchain_core.agents import AgentAction
+            tool_input = {"user_query": text}
+            observation = self.data_tool.invoke(tool_input, config)
+            reply = self.llm.invoke(
+                self.answer_prompt.format_messages(chat_history=history, user_input=text, tool_result=observation),
+                config,
+            )
+            action = AgentAction(tool=self.data_tool.name, tool_input=tool_input, log="Routed by intent classifier.")
+            return {"output": reply.content, "intermediate_steps": [(action, observation)], "intent": intent}
+
+        result = self.agent_executor.invoke(inputs, config)
+        result["intent"] = IntentType.agent
+        return result
+
+
+intent_classifier = IntentClassifier(min_margin=getattr(settings, "CHAT_INTENT_MIN_MARGIN", 0.15))
@@ -1,50 +1,187 @@
 #apps/chat/langchain_setup.py
-from apps.chat.tools import query_historical_data_system
-from langchain_openai import ChatOpenAI
+"""
+LangChain agent of the assistant, built lazily.
+
+Importing this module is cheap: the LangChain/OpenAI/tiktoken stack is only imported the
+first time the agent is used (or by ``warm_up()`` when a worker boots, see core/wsgi.py),
+so ``manage.py migrate``, tests and other commands never pay for it.
+"""
+import logging
+import threading
+import time
+
 from django.conf import settings
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.agents import create_openai_tools_agent
-from langchain.agents import AgentExecutor
 from apps.chat.models import Message
-from langchain.schema import AIMessage, HumanMessage
-# LLM (el mismo que antes)
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3, api_key=settings.API_KEY_OPEN_AI)
-
-# Lista de herramientas - ¡Ahora solo incluye la herramienta del MAS!
-tools = [query_historical_data_system]
-
-# Prompt del Agente (Ajustado)
-# Instruye al agente sobre su rol y la herramienta disponible
-agent_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system",
-         "You are a helpful assistant. You have access to one tool: 'query_historical_data_system'.\n" # <--- Mencionar la herramienta única
-         "**IMPORTANT INSTRUCTION:**\n"
-         "**Always respond in the user language.**\n"
-         "**ONLY use the 'query_historical_data_system' tool IF the user's query is DIRECTLY and SPECIFICALLY about historical maritime data (like ships, captains, ports, dates, voyages, analysis, or visualization based on these data).**\n" # <--- MUCHO ÉNFASIS en ONLY y DIRECTLY/SPECIFICALLY
-         "**FOR ANYTHING ELSE (greetings, general questions, chit-chat, unrelated topics), ANSWER DIRECTLY without using ANY tool.**\n" # <--- ENFASIS EN ANSWER DIRECTLY FOR ANYTHING ELSE
-         "The tool returns JSON with 'text_response', 'image_path', and 'error'. If error is not null, inform the user. If image_path is present, say a graphic was generated. Otherwise, use text_response.\n"
-         "Your response should be concise and user-friendly.\n"
-         ),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "{user_input}"),
-        MessagesPlaceholder(variable_name="agent_scratchpad"),
-    ]
-)
-
-# Creación del Agente y Ejecutor (Igual que antes)
-agent = create_openai_tools_agent(llm, tools, agent_prompt)
-agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True,return_intermediate_steps=True)
+from apps.utils.enums import MessageStatus
+from apps.chat.transcripts import read_history
+
+logger = logging.getLogger(__name__)
+
+LLM_MODEL = "gpt-4o-mini"
+
+_agent_executor = None
+_agent_lock = threading.Lock()
+
+
+def build_agent_executor():
+    """ Builds the LLM, prompts, tools agent and intent router (imports the whole LangChain stack). """
+    from langchain_openai import ChatOpenAI
+    from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain.agents import create_openai_tools_agent
+    from apps.chat.executor import ParallelToolsAgentExecutor
+    from apps.chat.tools import query_historical_data_system
+    from apps.chat.intent import IntentRouter, intent_classifier
+
+    # LLM (el mismo que antes)
+    llm = ChatOpenAI(
+        model=LLM_MODEL,
+        temperature=0.3,
+        api_key=settings.API_KEY_OPEN_AI,
+        base_url=getattr(settings, "OPENAI_BASE_URL", None),
+        # Los reintentos del SDK multiplican la carga en un RateLimitError; el limitador hace de cola.
+        max_retries=getattr(settings, "CHAT_LLM_MAX_RETRIES", 1),
+    )
+
+    # Lista de herramientas - ¡Ahora solo incluye la herramienta del MAS!
+    tools = [query_historical_data_system]
+
+    # Prompt del Agente (Ajustado)
+    # Instruye al agente sobre su rol y la herramienta disponible
+    agent_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system",
+             "You are a helpful assistant. You have access to one tool: 'query_historical_data_system'.\n" # <--- Mencionar la herramienta única
+             "**IMPORTANT INSTRUCTION:**\n"
+             "**Always respond in the user language.**\n"
+             "**ONLY use the 'query_historical_data_system' tool IF the user's query is DIRECTLY and SPECIFICALLY about historical maritime data (like ships, captains, ports, dates, voyages, analysis, or visualization based on these data).**\n" # <--- MUCHO ÉNFASIS en ONLY y DIRECTLY/SPECIFICALLY
+             "**FOR ANYTHING ELSE (greetings, general questions, chit-chat, unrelated topics), ANSWER DIRECTLY without using ANY tool.**\n" # <--- ENFASIS EN ANSWER DIRECTLY FOR ANYTHING ELSE
+             "The tool returns JSON with 'text_response', 'image_path', and 'error'. If error is not null, inform the user. If image_path is present, say a graphic was generated. Otherwise, use text_response.\n"
+             "If the question needs several independent lookups (e.g. comparing two ports or periods), call the tool once per lookup in the same step; the calls run in parallel.\n"
+             "Your response should be concise and user-friendly.\n"
+             ),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{user_input}"),
+            MessagesPlaceholder(variable_name="agent_scratchpad"),
+        ]
+    )
+
+    # Prompts de las rutas directas del clasificador de intención (apps/chat/intent.py):
+    # saludos/charla sin herramientas, y consultas de datos en las que el MAS ya se llamó.
+    chat_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system",
+             "You are a helpful assistant for a historical maritime data system.\n"
+             "**Always respond in the user language.**\n"
+             "Your response should be concise and user-friendly.\n"
+             ),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{user_input}"),
+        ]
+    )
+    answer_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system",
+             "You are a helpful assistant for a historical maritime data system.\n"
+             "**Always respond in the user language.**\n"
+             "The data system was already queried with the user's question and returned this JSON with 'text_response', 'image_path', and 'error':\n"
+             "{tool_result}\n"
+             "If error is not null, inform the user. If image_path is present, say a graphic was generated. Otherwise, use text_response.\n"
+             "Your response should be concise and user-friendly.\n"
+             ),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{user_input}"),
+        ]
+    )
+
+    # Creación del Agente y Ejecutor (Igual que antes)
+    agent = create_openai_tools_agent(llm, tools, agent_prompt)
+    # Varias llamadas a herramientas del mismo paso (p. ej. comparar dos puertos) corren en paralelo.
+    tools_agent_executor = ParallelToolsAgentExecutor(
+        agent=agent, tools=tools, return_intermediate_steps=True,
+        verbose=getattr(settings, "CHAT_AGENT_VERBOSE", False),  # imprime cada paso en stdout: sólo para depurar
+        tool_timeout=getattr(settings, "CHAT_TOOL_TIMEOUT", 75),
+    )
+    # Mismo invoke()/salida que el AgentExecutor, pero los turnos claros se saltan la decisión de herramienta.
+    return IntentRouter(
+        agent_executor=tools_agent_executor,
+        llm=llm,
+        data_tool=query_historical_data_system,
+        chat_prompt=chat_prompt,
+        answer_prompt=answer_prompt,
+        classifier=intent_classifier,
+    )
+
+
+def get_agent_executor():
+    """ Returns the process-wide agent, building it once (thread-safe) on first use. """
+    global _agent_executor
+    if _agent_executor is None:
+        with _agent_lock:
+            if _agent_executor is None:
+                started = time.perf_counter()
+                _agent_executor = build_agent_executor()
+                logger.info(f"LangChain agent built in {time.perf_counter() - started:.2f}s.")
+    return _agent_executor
+
+
+class LazyAgentExecutor:
+    """
+    Stand-in for the agent executor that builds the real one on the first ``invoke``.
+    A build failure (missing API key, broken install...) surfaces as NotImplementedError,
+    which the views already turn into a 503.
+    """
+
+    def invoke(self, *args, **kwargs):
+        try:
+            executor = get_agent_executor()
+        except Exception as e:
+            logger.error(f"Failed to build the LangChain agent: {e}", exc_info=True)
+            raise NotImplementedError(f"LangChain agent is not available: {e}") from e
+        return executor.invoke(*args, **kwargs)
+
+
+agent_executor = LazyAgentExecutor()
+
+
+def warm_up():
+    """
+    Builds the agent and loads the tokenizer encodings ahead of the first request.
+    Meant for worker boot; failures are logged and left for the first request to report.
+    """
+    started = time.perf_counter()
+    try:
+        get_agent_executor()
+    except Exception as e:
+        logger.error(f"Agent warm-up failed: {e}", exc_info=True)
+        return False
+    try:
+        import tiktoken
+        tiktoken.encoding_for_model(LLM_MODEL)
+    except Exception as e:  # Sin red no se pueden descargar las codificaciones; no es fatal.
+        logger.warning(f"Could not preload tiktoken encodings for {LLM_MODEL}: {e}")
+    logger.info(f"Agent warm-up finished in {time.perf_counter() - started:.2f}s.")
+    return True
+
 
 def load_langchain_history_from_db(chat):
     """
     Loads chat history from the database and formats it for LangChain.
     """
-    messages = Message.objects.filter(chat_room=chat, is_active=True).order_by('created_at')
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    # Una sola fila si el chat tiene transcripción (apps/chat/transcripts.py).
+    # Los turnos abortados (el cliente se fue) no tienen respuesta real: el agente no los ve.
+    entries = read_history(chat)
+    if entries is not None:
+        messages = [(entry["rol"], entry["text_message"]) for entry in entries
+                    if entry.get("status") != MessageStatus.aborted]
+    else:
+        messages = Message.objects.filter(chat_room=chat, is_active=True).exclude(status=MessageStatus.aborted) \
+            .order_by('created_at').values_list('rol', 'text_message')
     chat_history = []
-    for message in messages:
-        if message.rol == 'user':
-            chat_history.append(HumanMessage(content=message.text_message))
-        elif message.rol == 'assistant':
-            chat_history.append(AIMessage(content=message.text_message))
+    for rol, text_message in messages:
+        if rol == 'user':
+            chat_history.append(HumanMessage(content=text_message))
+        elif rol == 'assistant':
+            chat_history.append(AIMessage(content=text_message))
     return chat_history
\ No newline at end of file
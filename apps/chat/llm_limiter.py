@@ -0,0 +1,155 @@
+#apps/chat/llm_limiter.py
+"""
+Outbound LLM limiter: a concurrency cap plus a token bucket, with a bounded wait queue.
+
+Calls wait in the queue (at most ``CHAT_LLM_MAX_WAIT`` seconds) for a free slot and a token.
+When the queue is full ``Throttled`` is raised right away (and after ``CHAT_LLM_MAX_WAIT`` for
+calls already queued), so the API answers ``429`` with ``Retry-After`` instead of piling
+requests onto OpenAI and timing out.
+
+The bucket is per process; with ``CHAT_LLM_SHARED_RATE`` the rate is also enforced across
+processes through a per-second counter in the Django cache (use a shared cache backend).
+"""
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.2
+
+
+class LLMLimiter:
+    """ Process-wide limiter; ``stats()`` exposes queue depth, in-flight calls and wait times. """
+
+    def __init__(self, max_concurrency: int, max_queue: int, max_wait: float, rate: float, burst: int,
+                 shared_rate: bool = False):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.rate = rate
+        self.burst = burst
+        self.shared_rate = shared_rate
+        self._cond = threading.Condition()
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_wait = 0.0
+        self.max_observed_wait = 0.0
+        self.avg_duration = 0.0
+
+    def _refill(self, now: float):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _token_wait(self, now: float) -> float:
+        """ Seconds until a token is available (0 if one is available now). """
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        if self._tokens >= 1:
+            if self.shared_rate and not self._take_shared_token():
+                return 1.0 - (time.time() % 1.0)
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def _take_shared_token(self) -> bool:
+        key = f"llm-limiter:{int(time.time())}"
+        cache.add(key, 0, timeout=5)
+        try:
+            return cache.incr(key) <= max(1, math.floor(self.rate))
+        except ValueError:  # La clave expiró entre add e incr.
+            return True
+
+    def retry_after(self) -> int:
+        """ Seconds a rejected client should wait: the queue ahead of it drained at the observed pace. """
+        per_call = self.avg_duration or 1.0
+        drain = (self.waiting + 1) * per_call / max(self.max_concurrency, 1)
+        if self.rate > 0:
+            drain = max(drain, (self.waiting + 1) / self.rate)
+        return max(1, math.ceil(drain))
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        wait = self.retry_after()
+        logger.warning(f"LLM limiter rejected a call ({reason}); in_flight={self.in_flight} waiting={self.waiting} retry_after={wait}s")
+        raise Throttled(wait=wait, detail="El asistente IA está saturado. Inténtalo de nuevo en unos segundos.")
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        with self._cond:
+            # Cola llena: sólo se rechaza si de verdad habría que esperar.
+            if self.waiting >= self.max_queue and (self.waiting or self.in_flight >= self.max_concurrency):
+                self._reject("queue full")
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    token_wait = 0.0 if self.in_flight >= self.max_concurrency else self._token_wait(now)
+                    if self.in_flight < self.max_concurrency and token_wait == 0.0:
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._reject("wait timeout")
+                    self._cond.wait(min(remaining, token_wait) if token_wait else remaining)
+                if self.rate > 0:
+                    self._tokens -= 1
+                self.in_flight += 1
+                self.admitted += 1
+            finally:
+                self.waiting -= 1
+            waited = time.monotonic() - started
+            self.avg_wait += EWMA_ALPHA * (waited - self.avg_wait)
+            self.max_observed_wait = max(self.max_observed_wait, waited)
+        return started
+
+    def release(self, duration: float):
+        with self._cond:
+            self.in_flight -= 1
+            self.avg_duration += EWMA_ALPHA * (duration - self.avg_duration)
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        """ ``with llm_limiter.slot() as waited: ...`` around one outbound LLM call (or agent turn). """
+        started = time.monotonic()
+        waited = started - self.acquire()
+        try:
+            yield waited
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "admitted_total": self.admitted,
+                "rejected_total": self.rejected,
+                "avg_wait_seconds": round(self.avg_wait, 4),
+                "max_wait_seconds": round(self.max_observed_wait, 4),
+                "avg_call_seconds": round(self.avg_duration, 4),
+            }
+
+
+llm_limiter = LLMLimiter(
+    max_concurrency=getattr(settings, "CHAT_LLM_MAX_CONCURRENCY", 8),
+    max_queue=getattr(settings, "CHAT_LLM_MAX_QUEUE", 32),
+    max_wait=getattr(settings, "CHAT_LLM_MAX_WAIT", 20),
+    rate=getattr(settings, "CHAT_LLM_RATE", 2.0),
+    burst=getattr(settings, "CHAT_LLM_BURST", 10),
+    shared_rate=getattr(settings, "CHAT_LLM_SHARED_RATE", False),
+)
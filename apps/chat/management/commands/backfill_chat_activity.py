@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.chat.models import Chat
+from apps.chat.response_cache import bump_user
+
+
+class Command(BaseCommand):
+    help = "Fill last_message_at, message_count and last_message_preview of existing chats from their messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Chats updated per UPDATE statement.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = 0
+        batch = []
+        owners = set()
+        chats = Chat.objects.order_by("pk").values_list("pk", "registered_by_id")
+        for chat_id, owner_id in chats.iterator(chunk_size=options["batch_size"]):
+            batch.append(chat_id)
+            owners.add(owner_id)
+            if len(batch) >= options["batch_size"]:
+                total += Chat.refresh_activity(Chat.objects.filter(pk__in=batch))
+                batch = []
+        if batch:
+            total += Chat.refresh_activity(Chat.objects.filter(pk__in=batch))
+        # El orden y las vistas previas del listado cambian: las respuestas cacheadas de los dueños caducan.
+        for owner_id in owners:
+            bump_user(owner_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated the activity of {total} chats in {time.perf_counter() - started:.2f}s."
+        ))
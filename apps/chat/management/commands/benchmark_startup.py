@@ -0,0 +1,63 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Se ejecuta en un proceso nuevo para medir un arranque en frío real.
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+setup_done = time.perf_counter()
+import apps.chat.views
+views_done = time.perf_counter()
+langchain_loaded = any(name.startswith(("langchain", "openai", "tiktoken")) for name in sys.modules)
+from django.test import Client
+Client(HTTP_HOST="localhost").get("/api/chats/")
+first_request_done = time.perf_counter()
+warmed = None
+if "--warm-up" in sys.argv:
+    from apps.chat.langchain_setup import warm_up
+    warmed = warm_up()
+warm_up_done = time.perf_counter()
+print(json.dumps({
+    "django_setup": setup_done - started,
+    "import_views": views_done - setup_done,
+    "first_request": first_request_done - views_done,
+    "warm_up": warm_up_done - first_request_done,
+    "total": warm_up_done - started,
+    "langchain_loaded_by_import": langchain_loaded,
+    "warm_up_ok": warmed,
+}))
+"""
+PHASES = ("django_setup", "import_views", "first_request", "warm_up", "total")
+
+
+class Command(BaseCommand):
+    help = "Measure cold start: import time, first request latency and agent warm-up, in fresh processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=3)
+        parser.add_argument("--warm-up", action="store_true", help="Also build the agent (needs API_KEY_OPEN_AI).")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "core.settings"))
+        argv = [sys.executable, "-c", STARTUP_SCRIPT] + (["--warm-up"] if options["warm_up"] else [])
+        samples = []
+        for _ in range(options["runs"]):
+            completed = subprocess.run(argv, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+            if completed.returncode != 0:
+                raise CommandError(f"Startup probe failed:\n{completed.stderr[-2000:]}")
+            samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+        for phase in PHASES:
+            values = [sample[phase] * 1000 for sample in samples]
+            self.stdout.write(f"{phase:<14} median {statistics.median(values):8.1f} ms   max {max(values):8.1f} ms")
+        self.stdout.write(f"LangChain imported by `import apps.chat.views`: {samples[0]['langchain_loaded_by_import']}")
+        if options["warm_up"]:
+            self.stdout.write(f"Warm-up succeeded: {samples[0]['warm_up_ok']}")
@@ -0,0 +1,42 @@
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ParseError, ValidationError
+
+from apps.chat.importers import DEFAULT_BATCH_SIZE, ConversationImporter
+from apps.utils.parsers import iter_ndjson
+
+
+class Command(BaseCommand):
+    help = "Bulk import chats and messages from a NDJSON file (one chat per line) for a user."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="NDJSON file to import, or '-' to read from stdin.")
+        parser.add_argument("--user", required=True, help="Username that will own the imported chats.")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options["user"])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist.")
+
+        importer = ConversationImporter(user=user, batch_size=options["batch_size"])
+        stream = sys.stdin if options["path"] == "-" else open(options["path"], encoding="utf-8")
+        started = time.perf_counter()
+        try:
+            summary = importer.run(iter_ndjson(stream))
+        except (ParseError, ValidationError) as e:
+            raise CommandError(str(e.detail))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        elapsed = time.perf_counter() - started
+
+        rate = summary["messages"] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['chats']} chats and {summary['messages']} messages "
+            f"in {elapsed:.2f}s ({rate:,.0f} messages/s)."
+        ))
@@ -0,0 +1,45 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from apps.chat.models import Message
+from apps.chat.semantic import semantic_index
+from apps.utils.enums import RolType
+
+
+class Command(BaseCommand):
+    help = "Rebuild the local semantic index shards (drops soft-deleted messages from them)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Only rebuild the shard of this username.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    @staticmethod
+    def batches(questions, batch_size):
+        batch = []
+        for item in questions.iterator(chunk_size=batch_size):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.all()
+        if options["user"]:
+            users = users.filter(username=options["user"])
+
+        started = time.perf_counter()
+        total = 0
+        for user in users.iterator():
+            questions = Message.objects.filter(
+                chat_room__registered_by=user, chat_room__is_active=True, is_active=True, rol=RolType.user,
+            ).order_by("created_at").values_list("uid", "text_message")
+            # El shard nuevo se escribe aparte: las búsquedas siguen usando el anterior hasta el cambio.
+            total += semantic_index.rebuild(user.pk, self.batches(questions, options["batch_size"]))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {total} questions in {time.perf_counter() - started:.2f}s."
+        ))
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.chat.models import Chat, ChatTranscript
+from apps.chat.transcripts import check_transcript, rebuild_transcript
+
+
+class Command(BaseCommand):
+    help = "Check the chat transcripts against the messages table and rebuild the ones that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chat", action="append", default=[], help="Only this chat uid (repeatable).")
+        parser.add_argument("--check", action="store_true", help="Only report drift; exit with an error if any.")
+        parser.add_argument("--all", action="store_true",
+                            help="Rebuild every active chat, also the ones without a transcript.")
+
+    def handle(self, *args, **options):
+        if options["all"]:
+            chat_ids = Chat.objects.filter(is_active=True)
+        else:
+            chat_ids = ChatTranscript.objects.all()
+        if options["chat"]:
+            chat_ids = chat_ids.filter(pk__in=options["chat"]) if options["all"] else chat_ids.filter(chat_id__in=options["chat"])
+        chat_ids = chat_ids.values_list("pk", flat=True)
+
+        started = time.perf_counter()
+        checked, drifted, rebuilt = 0, [], 0
+        for chat_id in chat_ids.iterator():
+            checked += 1
+            if options["all"] and not options["check"]:
+                rebuild_transcript(chat_id)
+                rebuilt += 1
+                continue
+            if check_transcript(chat_id):
+                continue
+            drifted.append(chat_id)
+            self.stdout.write(self.style.WARNING(f"Transcript of chat {chat_id} drifted from its messages."))
+            if not options["check"]:
+                rebuild_transcript(chat_id)
+                rebuilt += 1
+
+        summary = f"Checked {checked} chats: {len(drifted)} drifted, {rebuilt} rebuilt in {time.perf_counter() - started:.2f}s."
+        if options["check"] and drifted:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
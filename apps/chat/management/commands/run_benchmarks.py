@@ -0,0 +1,100 @@
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from apps.chat.benchmarks import build_cases, compare, measure
+from apps.utils.test_runner import IsolatedStorageTestRunner
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the micro-benchmarks of the hot paths on a freshly seeded test database "
+        "(SQLite or PostgreSQL, whatever DATABASE_URL points at) and write the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=30)
+        parser.add_argument("--only", nargs="*", help="Run only the cases whose name starts with these prefixes.")
+        parser.add_argument("--output", help="Write the results to this JSON file.")
+        parser.add_argument("--compare", help="Previous results file to compare the medians with.")
+        parser.add_argument("--threshold", type=float, default=0.15, help="Median slowdown that counts as a regression.")
+        parser.add_argument("--image-bytes", type=int, default=500_000)
+
+    def handle(self, *args, **options):
+        previous = None
+        if options["compare"]:
+            try:
+                with open(options["compare"]) as handle:
+                    previous = json.load(handle)["results"]
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Could not read {options['compare']}: {e}")
+
+        # Base de datos de test: nunca se siembran datos en la base real.
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        media_root = tempfile.mkdtemp(prefix="bench-media-")
+        # Índices y cachés en disco fuera de var/; la caché de respuestas sólo en los casos *_cached.
+        storage_dir = tempfile.mkdtemp(prefix="bench-storage-")
+        try:
+            with override_settings(MEDIA_ROOT=media_root, CHAT_TRACING_ENABLED=False, RESPONSE_CACHE_ENABLED=False,
+                                   **IsolatedStorageTestRunner.storage_settings(storage_dir)):
+                results = {}
+                for case in build_cases(image_bytes=options["image_bytes"]):
+                    if options["only"] and not any(case.name.startswith(prefix) for prefix in options["only"]):
+                        continue
+                    result = measure(case, rounds=options["rounds"])
+                    results[case.name] = result.as_dict()
+                    self.print_result(result)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+            shutil.rmtree(storage_dir, ignore_errors=True)
+
+        report = {"meta": self.metadata(), "results": results}
+        if options["output"]:
+            with open(options["output"], "w") as handle:
+                json.dump(report, handle, indent=2, sort_keys=True)
+            self.stdout.write(f"Results written to {options['output']}.")
+
+        if previous is not None:
+            rows = compare(results, previous, options["threshold"])
+            self.stdout.write(f"\n{'case':<28} {'previous':>12} {'current':>12} {'change':>8}")
+            for row in rows:
+                line = f"{row['name']:<28} {row['previous'] * 1000:>10.3f}ms {row['current'] * 1000:>10.3f}ms {row['change']:>+8.1%}"
+                self.stdout.write(self.style.ERROR(line) if row["regression"] else line)
+            regressions = [row["name"] for row in rows if row["regression"]]
+            if regressions:
+                raise CommandError(f"Regressions over {options['threshold']:.0%}: {', '.join(regressions)}")
+
+    def print_result(self, result):
+        if result.skipped:
+            self.stdout.write(self.style.WARNING(f"{result.name:<28} skipped ({result.skipped})"))
+            return
+        self.stdout.write(
+            f"{result.name:<28} median {result.median * 1000:>9.3f}ms  p95 {result.p95 * 1000:>9.3f}ms  "
+            f"{result.items_per_second:>12.1f} items/s"
+        )
+
+    def metadata(self) -> dict:
+        try:
+            revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+                                      capture_output=True, text=True, timeout=5).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            revision = None
+        return {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": revision,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "database": connection.vendor,
+        }
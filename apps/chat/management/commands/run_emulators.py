@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.chat.emulators import LatencyDistribution, make_llm_server, make_mas_server, serve_in_thread
+
+
+class Command(BaseCommand):
+    help = "Run the offline OpenAI-compatible and MAS emulators used by the load tests."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--llm-port", type=int, default=8010)
+        parser.add_argument("--mas-port", type=int, default=8011)
+        parser.add_argument("--llm-latency", default="lognormal:-0.7,0.5", help="Latency of each completion (kind:params).")
+        parser.add_argument("--mas-latency", default="lognormal:0.0,0.4", help="Latency of each MAS query (kind:params).")
+        parser.add_argument("--image-ratio", type=float, default=0.3, help="Share of MAS answers with an image.")
+        parser.add_argument("--image-bytes", type=int, default=200_000, help="Size of the generated PNG images.")
+        parser.add_argument("--mas-stream-format", choices=("ndjson", "sse", "off"), default="ndjson",
+                            help="How the MAS streams its answers to clients that accept it (off = single-shot JSON).")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            LatencyDistribution(options["llm_latency"])
+            LatencyDistribution(options["mas_latency"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        llm = make_llm_server(options["host"], options["llm_port"], options["llm_latency"], options["seed"])
+        mas = make_mas_server(options["host"], options["mas_port"], options["mas_latency"], options["seed"],
+                              image_ratio=options["image_ratio"], image_bytes=options["image_bytes"],
+                              stream_format=options["mas_stream_format"])
+        serve_in_thread(llm)
+        serve_in_thread(mas)
+        self.stdout.write(self.style.SUCCESS(
+            f"Fake OpenAI on {llm.url}/v1 and fake MAS on {mas.url}/api/query.\n"
+            f"Start the API with OPENAI_BASE_URL={llm.url}/v1 MAS_API_URL={mas.url} API_KEY_OPEN_AI=sk-fake"
+        ))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            llm.shutdown()
+            mas.shutdown()
@@ -0,0 +1,51 @@
+import os
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Run the API under gunicorn with the production worker model (see core/gunicorn_conf.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bind", help="Address to bind (SERVER_BIND, default 0.0.0.0:8000).")
+        parser.add_argument("--workers", type=int, help="Worker processes (SERVER_WORKERS).")
+        parser.add_argument("--threads", type=int, help="Threads per worker (WORKER_THREADS).")
+        parser.add_argument("--max-requests", type=int, help="Recycle a worker after this many requests (SERVER_MAX_REQUESTS).")
+        parser.add_argument("--graceful-timeout", type=int, help="Seconds in-flight requests get on shutdown (SERVER_GRACEFUL_TIMEOUT).")
+        parser.add_argument("--asgi", action="store_true", help="Serve core.asgi with uvicorn workers (SERVER_ASGI).")
+        parser.add_argument("--check-config", action="store_true", help="Print the resolved gunicorn settings and exit.")
+
+    def handle(self, *args, **options):
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            raise CommandError("gunicorn is not installed (pip install -r requirements.txt).")
+        if options["asgi"]:
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                raise CommandError("--asgi needs uvicorn (pip install -r requirements.txt).")
+
+        # La configuración lee las variables de entorno; las opciones sólo las sobrescriben.
+        env = os.environ.copy()
+        for option, variable in (("bind", "SERVER_BIND"), ("workers", "SERVER_WORKERS"), ("threads", "WORKER_THREADS"),
+                                 ("max_requests", "SERVER_MAX_REQUESTS"), ("graceful_timeout", "SERVER_GRACEFUL_TIMEOUT")):
+            if options[option] is not None:
+                env[variable] = str(options[option])
+        if options["asgi"]:
+            env["SERVER_ASGI"] = "1"
+        env.setdefault("DJANGO_SETTINGS_MODULE", os.environ.get("DJANGO_SETTINGS_MODULE", "core.settings"))
+        if options["threads"] is not None and options["threads"] != getattr(settings, "WORKER_THREADS", 8):
+            self.stderr.write(self.style.WARNING(
+                f"--threads {options['threads']} also resizes the bulkheads (WORKER_THREADS) in the workers."
+            ))
+
+        argv = [sys.executable, "-m", "gunicorn", "-c", "python:core.gunicorn_conf"]
+        if options["check_config"]:
+            argv.append("--print-config")
+        self.stdout.write(" ".join(argv[1:]))
+        sys.stdout.flush()
+        os.chdir(settings.BASE_DIR)
+        os.execve(sys.executable, argv, env)
@@ -0,0 +1,68 @@
+from collections import defaultdict
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.chat.tracing import read_spans, trace_file
+
+BAR_WIDTH = 40
+
+
+class Command(BaseCommand):
+    help = "Print the span breakdown of a traced turn (or list the latest traces)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("trace_id", nargs="?", help="Trace id (X-Trace-Id response header).")
+        parser.add_argument("--file", default=None, help="Spans file (defaults to CHAT_TRACE_FILE).")
+        parser.add_argument("--last", type=int, default=20, help="Traces to list when no trace id is given.")
+
+    def handle(self, *args, **options):
+        path = options["file"] or trace_file()
+        if not options["trace_id"]:
+            self.list_traces(path, options["last"])
+            return
+
+        spans = list(read_spans(path, options["trace_id"]))
+        if not spans:
+            raise CommandError(f"Trace {options['trace_id']} not found in {path}.")
+        ids = {item["span_id"] for item in spans}
+        children = defaultdict(list)
+        for item in spans:
+            # Las raíces son los spans sin padre local (el padre puede ser el cliente).
+            children[item["parent_id"] if item["parent_id"] in ids else None].append(item)
+        roots = sorted(children[None], key=lambda item: item["start"])
+        origin = min(item["start"] for item in spans)
+        total_ms = max(item["start"] * 1000 + item["duration_ms"] for item in spans) - origin * 1000
+
+        self.stdout.write(f"Trace {options['trace_id']}  {total_ms:.1f} ms  "
+                          f"({datetime.fromtimestamp(origin).isoformat(timespec='seconds')})")
+        for root in roots:
+            self.print_span(root, children, origin, total_ms, depth=0)
+
+    def print_span(self, item, children, origin, total_ms, depth):
+        offset_ms = (item["start"] - origin) * 1000
+        scale = BAR_WIDTH / total_ms if total_ms > 0 else 0
+        bar = " " * int(offset_ms * scale) + "█" * max(1, round(item["duration_ms"] * scale))
+        attrs = " ".join(f"{key}={value}" for key, value in item.get("attrs", {}).items())
+        label = "  " * depth + item["name"]
+        self.stdout.write(f"{label:<36} {item['duration_ms']:>10.1f} ms  {bar:<{BAR_WIDTH}}  {attrs}".rstrip())
+        for child in sorted(children[item["span_id"]], key=lambda child: child["start"]):
+            self.print_span(child, children, origin, total_ms, depth + 1)
+
+    def list_traces(self, path, last):
+        traces = {}
+        for item in read_spans(path):
+            trace = traces.setdefault(item["trace_id"], {"start": item["start"], "spans": 0, "root": None})
+            trace["start"] = min(trace["start"], item["start"])
+            trace["spans"] += 1
+            if trace["root"] is None or item["duration_ms"] > trace["root"]["duration_ms"]:
+                trace["root"] = item
+        if not traces:
+            self.stdout.write(f"No traces in {path}.")
+            return
+        for trace_id, trace in sorted(traces.items(), key=lambda pair: pair[1]["start"])[-last:]:
+            root = trace["root"]
+            self.stdout.write(
+                f"{trace_id}  {datetime.fromtimestamp(trace['start']).isoformat(timespec='seconds')}  "
+                f"{root['duration_ms']:>10.1f} ms  {trace['spans']:>3} spans  {root['name']} {root.get('attrs', {}).get('status_code', '')}"
+            )
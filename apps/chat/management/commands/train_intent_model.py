@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.chat.intent import history_examples, intent_classifier, model_path
+from apps.chat.models import Message
+
+
+class Command(BaseCommand):
+    help = "Retrain the local intent pre-classifier from the message history."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2048)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rows = (
+            Message.objects.filter(is_active=True, chat_room__is_active=True)
+            .order_by("chat_room_id", "created_at")
+            .values_list("chat_room_id", "rol", "text_message", "image")
+        )
+        centroids, counts = intent_classifier.fit(
+            history_examples(rows.iterator(chunk_size=options["batch_size"])),
+            batch_size=options["batch_size"],
+        )
+        intent_classifier.save(centroids)
+        self.stdout.write(self.style.SUCCESS(
+            f"Trained intent model on {sum(counts.values())} examples "
+            f"({', '.join(f'{label}: {count}' for label, count in counts.items())}) "
+            f"in {time.perf_counter() - started:.2f}s -> {model_path()}"
+        ))
@@ -0,0 +1,220 @@
+#apps/chat/metrics.py
+"""
+In-process metrics of the assistant turns, rendered in the Prometheus text format.
+
+``record_step`` feeds the ``chat_step_duration_seconds`` histogram (llm, tool, mas_request,
+image_decode, db_write, turn...) and, while a turn is being tracked (``start_turn``), the
+per-turn ``TurnStats`` that are stored with the assistant ``Message``. Values are per
+process: scrape every worker, or aggregate with ``sum by``.
+"""
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+from .tracing import span
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    "chat_step_duration_seconds": ("histogram", "Duration of each step of an assistant turn."),
+    "chat_llm_calls_total": ("counter", "LLM calls made by assistant turns."),
+    "chat_llm_errors_total": ("counter", "LLM calls that raised an error."),
+    "chat_llm_tokens_total": ("counter", "LLM tokens used, by type (prompt/completion)."),
+    "chat_tool_calls_total": ("counter", "Tool calls, by tool and status."),
+    "chat_turns_total": ("counter", "Assistant turns, by route (agent/chitchat/data_query/cache) and status."),
+    "chat_turns_cancelled_total": ("counter", "Assistant turns cancelled because the client went away, by stage and reason."),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class MetricsRegistry:
+    """ Thread-safe counters and fixed-bucket histograms keyed by (name, labels). """
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], list] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            # [conteo por bucket..., suma, total]
+            histogram = self._histograms.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+        lines = []
+        for name in sorted({name for name, _ in counters} | {name for name, _ in histograms}):
+            kind, help_text = METRIC_HELP.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', repr(bound)))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]!r}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + ("\n" if lines else "")
+
+
+def render_gauges(name: str, help_text: str, samples: Iterable[Tuple[Dict[str, object], float]]) -> str:
+    """ Prometheus text for a gauge computed at scrape time (limiter queue, bulkheads...). """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        if value is not None and math.isfinite(value):
+            lines.append(f"{name}{_format_labels(_labels(labels))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class TurnStats:
+    """ Timings and usage of one assistant turn; stored as ``Message.stats``. """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()  # las herramientas de un paso corren en paralelo (apps/chat/executor.py)
+        self.steps: Dict[str, float] = {}
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.tool_calls: Dict[str, int] = {}
+        self.route: Optional[str] = None
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                "route": self.route,
+                "total_seconds": round(time.perf_counter() - self.started, 4),
+                "steps": {step: round(seconds, 4) for step, seconds in self.steps.items()},
+                "llm_calls": self.llm_calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "tool_calls": dict(self.tool_calls),
+            }
+
+
+_current_turn: "contextvars.ContextVar[Optional[TurnStats]]" = contextvars.ContextVar("chat_turn_stats", default=None)
+
+
+def start_turn():
+    """ Starts tracking a turn in this context; returns the token for ``finish_turn``. """
+    return _current_turn.set(TurnStats())
+
+
+def current_turn() -> Optional[TurnStats]:
+    return _current_turn.get()
+
+
+def finish_turn(token, status: str = "ok"):
+    turn = _current_turn.get()
+    _current_turn.reset(token)
+    if turn is None:
+        return
+    registry.observe("chat_step_duration_seconds", time.perf_counter() - turn.started, step="turn")
+    registry.inc("chat_turns_total", route=turn.route or "none", status=status)
+
+
+def turn_status(status_code: Optional[int]) -> str:
+    """ ``chat_turns_total`` status label of a ``MessageCreateAV.post`` response. """
+    if status_code is None or status_code >= 500 and status_code != 503:
+        return "error"
+    if status_code in (429, 503):
+        return "throttled" if status_code == 429 else "unavailable"
+    if status_code == 499:  # El cliente se fue: ver apps/chat/cancellation.py.
+        return "cancelled"
+    return "ok" if status_code < 400 else "rejected"
+
+
+def record_step(step: str, seconds: float):
+    registry.observe("chat_step_duration_seconds", seconds, step=step)
+    turn = _current_turn.get()
+    if turn is not None:
+        with turn.lock:
+            turn.steps[step] = turn.steps.get(step, 0.0) + seconds
+
+
+@contextmanager
+def timed(step: str):
+    """ ``with timed("db_write"): ...`` records the block duration as ``step`` (and traces it as a span). """
+    started = time.perf_counter()
+    try:
+        with span(step):
+            yield
+    finally:
+        record_step(step, time.perf_counter() - started)
+
+
+def record_llm_call(prompt_tokens: int = 0, completion_tokens: int = 0, error: bool = False):
+    registry.inc("chat_llm_calls_total")
+    if error:
+        registry.inc("chat_llm_errors_total")
+    if prompt_tokens:
+        registry.inc("chat_llm_tokens_total", prompt_tokens, type="prompt")
+    if completion_tokens:
+        registry.inc("chat_llm_tokens_total", completion_tokens, type="completion")
+    turn = _current_turn.get()
+    if turn is not None:
+        with turn.lock:
+            turn.llm_calls += 1
+            turn.prompt_tokens += prompt_tokens
+            turn.completion_tokens += completion_tokens
+
+
+def record_cancellation(stage: str, reason: str):
+    registry.inc("chat_turns_cancelled_total", stage=stage, reason=reason)
+
+
+def record_tool_call(tool: str, ok: bool = True):
+    registry.inc("chat_tool_calls_total", tool=tool, status="ok" if ok else "error")
+    turn = _current_turn.get()
+    if turn is not None:
+        with turn.lock:
+            turn.tool_calls[tool] = turn.tool_calls.get(tool, 0) + 1
@@ -1,9 +1,12 @@
 #apps/chat/models.py
 
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Coalesce, Greatest, Substr
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _ 
 from apps.utils.models import BaseModel
-from apps.utils.enums import RolType
+from apps.utils.enums import MessageStatus, RolType
 from django.contrib.auth import get_user_model
 
 # Create your models here.
@@ -27,15 +30,76 @@ class Chat(BaseModel):
         on_delete=models.CASCADE,
         related_name="registered_chats",
     )
+    # Mantenido por triggers en PostgreSQL (ver apps/chat/search.py); sin uso en SQLite (FTS5).
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Actividad desnormalizada para la barra lateral: la mantiene la escritura de mensajes (record_new_messages).
+    last_message_at = models.DateTimeField(_("Last message at"), default=timezone.now,
+                                           help_text=_("Creation date of the latest active message (or of the chat)"))
+    message_count = models.PositiveIntegerField(_("Message count"), default=0,
+                                                help_text=_("Number of active messages"))
+    last_message_preview = models.CharField(_("Last message preview"), max_length=255, blank=True, default="",
+                                            help_text=_("Beginning of the latest active message"))
 
     class Meta:
         verbose_name = _("Chat")
         verbose_name_plural = _("Chats")
         ordering = ["-created_at"]
+        indexes = [
+            # Listado por actividad reciente (ChatViewSet.list): filtro y orden salen del índice.
+            models.Index(
+                "registered_by", models.F("last_message_at").desc(), models.F("created_at").desc(),
+                name="chat_recent_activity_idx", condition=models.Q(is_active=True),
+            ),
+        ]
+
+    PREVIEW_LENGTH = 120
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def preview_of(cls, text: str) -> str:
+        return (text or "")[:cls.PREVIEW_LENGTH]
+
+    @classmethod
+    def record_new_messages(cls, chat_id, messages):
+        """
+        Adds just inserted ``messages`` to the chat's activity columns in one UPDATE with
+        ``F()`` expressions, so concurrent turns of the same chat do not lose counts.
+        """
+        messages = [message for message in messages if message.is_active]
+        if not messages:
+            return
+        last = max(messages, key=lambda message: message.created_at)
+        cls.objects.filter(pk=chat_id).update(
+            message_count=models.F("message_count") + len(messages),
+            last_message_at=Greatest("last_message_at", models.Value(last.created_at)),
+            # Las expresiones ven la fila anterior: sólo el mensaje más reciente cambia la vista previa.
+            last_message_preview=models.Case(
+                models.When(last_message_at__lte=last.created_at, then=models.Value(cls.preview_of(last.text_message))),
+                default=models.F("last_message_preview"),
+            ),
+        )
+
+    @classmethod
+    def refresh_activity(cls, chats):
+        """
+        Recomputes the activity columns of ``chats`` (a queryset) from their active messages
+        in one UPDATE with subqueries. Used after soft-deletes and by ``backfill_chat_activity``.
+        """
+        active = Message.objects.filter(chat_room=models.OuterRef("pk"), is_active=True)
+        latest = active.order_by("-created_at")
+        return chats.update(
+            message_count=Coalesce(
+                models.Subquery(active.order_by().values("chat_room").annotate(n=models.Count("pk")).values("n")), 0,
+            ),
+            last_message_at=Coalesce(models.Subquery(latest.values("created_at")[:1]), models.F("created_at")),
+            last_message_preview=Coalesce(
+                models.Subquery(latest.annotate(preview=Substr("text_message", 1, cls.PREVIEW_LENGTH)).values("preview")[:1]),
+                models.Value(""),
+            ),
+        )
+
 
 
 class Message(BaseModel):
@@ -61,6 +125,12 @@ class Message(BaseModel):
     weight = models.IntegerField(_("Weight"), help_text=_("Weight of the message"), null=True, blank=True,
                                     default=1,   
                                 )
+    stats = models.JSONField(_("Stats"), null=True, blank=True,
+                             help_text=_("Step timings and token usage of the turn (assistant messages)"))
+    status = models.CharField(_("Status"), max_length=20, choices=MessageStatus.choices, default=MessageStatus.complete,
+                              help_text=_("aborted: the client went away before the assistant answered"))
+    # Mantenido por triggers en PostgreSQL (ver apps/chat/search.py); sin uso en SQLite (FTS5).
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         verbose_name = _("Message")
@@ -70,12 +140,69 @@ class Message(BaseModel):
     def __str__(self):
         return str(_(f"Created Message with uid {self.uid}"))
 
-    def update_weight(self, is_like: bool): # Puedes añadir type hint
-        if is_like is True: # O simplemente 'if is_like:'
-            self.weight = 2
-        else: # is_like es False
-            self.weight = 0
-        self.save()
+    LIKE_WEIGHT = 2
+    DISLIKE_WEIGHT = 0
 
+    @classmethod
+    def weight_for(cls, is_like: bool) -> int:
+        return cls.LIKE_WEIGHT if is_like else cls.DISLIKE_WEIGHT
 
+    def update_weight(self, is_like: bool): # Puedes añadir type hint
+        self.weight = self.weight_for(is_like)
+        # Solo se escriben weight/updated_at: no pisa otras columnas editadas en paralelo.
+        self.save(update_fields=["weight", "updated_at"])
+
+    @classmethod
+    def bulk_update_weights(cls, user, interactions: dict):
+        """
+        Applies ``{message_uid: is_like}`` for messages owned by ``user``.
+        One SELECT checks ownership and one UPDATE ... CASE writes every weight; the
+        transcripts of their chats get the new weights once the transaction commits.
+        Returns the set of uids that were updated.
+        """
+        owned = list(
+            cls.objects.filter(
+                uid__in=list(interactions),
+                chat_room__registered_by=user,
+                chat_room__is_active=True,
+                is_active=True,
+            ).annotate(
+                has_transcript=models.Exists(ChatTranscript.objects.filter(chat_id=models.OuterRef("chat_room_id"))),
+            )
+        )
+        owned_uids = {message.uid for message in owned}
+        if not owned_uids:
+            return owned_uids
+        liked = [uid for uid in owned_uids if interactions[uid]]
+        now = timezone.now()
+        cls.objects.filter(uid__in=owned_uids).update(
+            weight=models.Case(
+                models.When(uid__in=liked, then=models.Value(cls.LIKE_WEIGHT)),
+                default=models.Value(cls.DISLIKE_WEIGHT),
+            ),
+            updated_at=now,
+        )
+        for message in owned:
+            message.weight, message.updated_at = cls.weight_for(interactions[message.uid]), now
+        # update() no dispara post_save: las transcripciones existentes se actualizan aquí, sin releer los mensajes.
+        from apps.chat.transcripts import record_messages_on_commit
+        record_messages_on_commit([message for message in owned if message.has_transcript], create=False)
+        return owned_uids
+
+
+class ChatTranscript(models.Model):
+    """
+    Denormalized history of a chat (see apps/chat/transcripts.py): an append-only log of
+    zlib-compressed JSON segments, so the history is read from a single row.
+    """
+    chat = models.OneToOneField(Chat, on_delete=models.CASCADE, primary_key=True, related_name="transcript")
+    data = models.BinaryField(_("Data"), default=b"")
+    segments = models.PositiveIntegerField(_("Segments"), default=0)
+    updated_at = models.DateTimeField(_("Updated at"), auto_now=True)
 
+    class Meta:
+        verbose_name = _("Chat transcript")
+        verbose_name_plural = _("Chat transcripts")
+
+    def __str__(self):
+        return str(_(f"Transcript of chat {self.chat_id}"))
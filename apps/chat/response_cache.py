@@ -0,0 +1,152 @@
+#apps/chat/response_cache.py
+"""
+Server-side cache of the rendered JSON of the chat list, chat detail and message history.
+
+Entries are keyed by the user, the request path and the current version of every scope
+the response depends on:
+
+- ``user``: everything of the user (bumped by bulk writes: imports, batch likes).
+- ``list``: the user's chat list (new, deleted or active chats).
+- ``chat``: the detail and history of one chat (its messages).
+
+A write bumps the versions of its scopes once the transaction commits, so invalidation
+is one cache write and no key is scanned. Old entries simply expire (``RESPONSE_CACHE_TIMEOUT``).
+The versions are random tokens, so a version evicted from the cache can never resurrect an
+old entry. A hit returns the stored bytes without touching the database or the serializers.
+
+The backend is the ``RESPONSE_CACHE_ALIAS`` entry of ``CACHES``. The versions live in the
+``RESPONSE_CACHE_VERSIONS_ALIAS`` entry, which must be shared by the workers and never cull
+them (evicting a version only costs misses, but culling at random makes that constant).
+Without that alias they are read from the backend itself, or from the shared tier of
+``apps.utils.cache.TieredCache``.
+"""
+import hashlib
+import logging
+import uuid
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+Scope = Tuple[str, object]
+
+
+def user_identity(user) -> str:
+    # date_joined distingue a un usuario nuevo que reutiliza la pk de otro borrado (o de otra base de datos).
+    joined = user.date_joined.timestamp() if getattr(user, "date_joined", None) else ""
+    return f"{user.pk}:{joined}"
+
+
+class ResponseCache:
+
+    def enabled(self) -> bool:
+        return getattr(settings, "RESPONSE_CACHE_ENABLED", True)
+
+    @property
+    def backend(self):
+        return caches[getattr(settings, "RESPONSE_CACHE_ALIAS", "responses")]
+
+    @property
+    def versions(self):
+        alias = getattr(settings, "RESPONSE_CACHE_VERSIONS_ALIAS", None)
+        if alias and alias in settings.CACHES:
+            return caches[alias]
+        backend = self.backend
+        return getattr(backend, "shared", backend)
+
+    @staticmethod
+    def _version_key(scope: Scope) -> str:
+        return f"resp-version:{scope[0]}:{scope[1]}"
+
+    def current_versions(self, scopes: Iterable[Scope]) -> list:
+        keys = [self._version_key(scope) for scope in scopes]
+        found = self.versions.get_many(keys)
+        for key in keys:
+            if key not in found:
+                self.versions.add(key, uuid.uuid4().hex, timeout=None)
+                found[key] = self.versions.get(key)
+        return [found[key] for key in keys]
+
+    def bump(self, *scopes: Scope):
+        """ New versions for ``scopes`` when the current transaction commits (right away outside one). """
+        if not scopes:
+            return
+        keys = {self._version_key(scope): uuid.uuid4().hex for scope in scopes}
+        transaction.on_commit(lambda: self._set_versions(keys))
+
+    def _set_versions(self, keys: dict):
+        try:
+            self.versions.set_many(keys, timeout=None)
+        except Exception as e:
+            logger.error(f"Could not bump response cache versions {list(keys)}: {e}", exc_info=True)
+
+    def lookup(self, request, name: str, scopes: List[Optional[Scope]]) -> Optional[HttpResponse]:
+        """
+        Returns the cached response of ``request`` or ``None``. On a miss the request remembers
+        the key, and ``ResponseCacheMixin.finalize_response`` stores the response if it is a 200.
+        """
+        if not self.enabled() or None in scopes or getattr(request, "accepted_renderer", None) is None \
+                or request.accepted_renderer.format != "json":
+            return None
+        try:
+            scopes = [("user", request.user.pk), *scopes]
+            token = ":".join(map(str, self.current_versions(scopes)))
+            path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+            key = f"resp:{name}:{user_identity(request.user)}:{path}:{token}"
+            entry = self.backend.get(key)
+        except Exception as e:  # La caché nunca tumba una lectura.
+            logger.error(f"Response cache lookup failed: {e}", exc_info=True)
+            return None
+        if entry is None:
+            request.response_cache_key = key
+            return None
+        content, content_type = entry
+        response = HttpResponse(content, content_type=content_type)
+        response["X-Response-Cache"] = "hit"
+        return response
+
+    def store(self, request, response):
+        key = getattr(request, "response_cache_key", None)
+        if key is None or not isinstance(response, Response) or response.status_code != 200:
+            return
+        try:
+            response.render()
+            self.backend.set(key, (response.content, response["Content-Type"]),
+                             timeout=getattr(settings, "RESPONSE_CACHE_TIMEOUT", 300))
+        except Exception as e:
+            logger.error(f"Response cache store failed: {e}", exc_info=True)
+
+
+response_cache = ResponseCache()
+
+
+def chat_scope(chat_id) -> Optional[Scope]:
+    """ Scope of a chat uid from the URL; ``None`` if it is not a valid uid (nothing to cache). """
+    try:
+        return ("chat", uuid.UUID(str(chat_id)))
+    except ValueError:
+        return None
+
+
+def bump_chat(user_id, chat_id, listed: bool = True):
+    """ A write to a chat or its messages: its detail/history and, if ``listed``, the owner's chat list. """
+    response_cache.bump(*([("list", user_id)] if listed else []), chat_scope(chat_id))
+
+
+def bump_user(user_id):
+    """ Bulk writes: every cached response of the user. """
+    response_cache.bump(("user", user_id))
+
+
+class ResponseCacheMixin:
+    """ DRF views whose handlers call ``response_cache.lookup``: stores the responses of the misses. """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        response_cache.store(request, response)
+        return response
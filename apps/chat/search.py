@@ -0,0 +1,369 @@
+#apps/chat/search.py
+"""
+Full-text search over ``Message.text_message`` and ``Chat.title``.
+
+PostgreSQL: ``search_vector`` tsvector columns kept up to date by triggers, GIN indexes,
+``websearch_to_tsquery`` + ``ts_rank`` + ``ts_headline``.
+SQLite: one FTS5 table (plus a uid map) kept up to date by triggers, ``bm25`` + ``snippet``.
+Other backends fall back to ``icontains``.
+
+The triggers/indexes are not model fields, so they are installed on ``post_migrate``
+(see ``ChatConfig.ready``). Triggers also cover ``bulk_create``/``update()``/raw inserts.
+
+Snippets are HTML: the database marks the matches with control characters, then the text is
+escaped and the marks become ``<mark>``/``</mark>`` (``render_snippet``).
+"""
+import html
+import logging
+import re
+from typing import Any, Dict, List
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, models, router
+from django.db.models import F, Value
+
+from .models import Chat, Message
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CONFIG = getattr(settings, "CHAT_SEARCH_CONFIG", "simple")
+SNIPPET_START, SNIPPET_STOP = "<mark>", "</mark>"
+# Lo que la base de datos pone alrededor de cada coincidencia (no aparece en texto de chat).
+MATCH_START, MATCH_STOP = "\x02", "\x03"
+SNIPPET_TOKENS = 12
+TITLE_RANK_BOOST = 2.0
+
+FTS_TABLE = "chat_search_fts"
+FTS_MAP_TABLE = "chat_search_fts_map"
+
+_fts_installed: Dict[str, bool] = {}
+
+
+def _tables():
+    return {
+        "message": Message._meta.db_table,
+        "chat": Chat._meta.db_table,
+        "fts": FTS_TABLE,
+        "map": FTS_MAP_TABLE,
+        "config": SEARCH_CONFIG,
+    }
+
+
+# --- Instalación (post_migrate) ---------------------------------------------------------
+
+POSTGRES_DDL = """
+CREATE OR REPLACE FUNCTION {message}_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('{config}'::regconfig, coalesce(NEW.text_message, ''));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS {message}_search_vector_trigger ON {message};
+CREATE TRIGGER {message}_search_vector_trigger BEFORE INSERT OR UPDATE OF text_message ON {message}
+    FOR EACH ROW EXECUTE FUNCTION {message}_search_vector_update();
+CREATE INDEX IF NOT EXISTS {message}_search_vector_gin ON {message} USING gin(search_vector);
+
+CREATE OR REPLACE FUNCTION {chat}_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('{config}'::regconfig, coalesce(NEW.title, ''));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS {chat}_search_vector_trigger ON {chat};
+CREATE TRIGGER {chat}_search_vector_trigger BEFORE INSERT OR UPDATE OF title ON {chat}
+    FOR EACH ROW EXECUTE FUNCTION {chat}_search_vector_update();
+CREATE INDEX IF NOT EXISTS {chat}_search_vector_gin ON {chat} USING gin(search_vector);
+
+UPDATE {message} SET search_vector = to_tsvector('{config}'::regconfig, coalesce(text_message, ''))
+    WHERE search_vector IS NULL;
+UPDATE {chat} SET search_vector = to_tsvector('{config}'::regconfig, coalesce(title, ''))
+    WHERE search_vector IS NULL;
+"""
+
+# owner es un token "u<user_id>" indexado: MATCH intersecta el propietario dentro del índice FTS.
+# El mapa fts_rowid <-> uid evita depender del rowid de las tablas Django (no es estable en SQLite).
+SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+        owner, body, kind UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS {map} (fts_rowid INTEGER PRIMARY KEY, object_uid TEXT NOT NULL UNIQUE)",
+    """
+    CREATE TRIGGER IF NOT EXISTS {message}_fts_insert AFTER INSERT ON {message} BEGIN
+        INSERT INTO {fts}(owner, body, kind) VALUES (
+            'u' || (SELECT registered_by_id FROM {chat} WHERE uid = new.chat_room_id), new.text_message, 'message'
+        );
+        INSERT INTO {map}(fts_rowid, object_uid) VALUES (last_insert_rowid(), new.uid);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {message}_fts_update AFTER UPDATE OF text_message ON {message} BEGIN
+        UPDATE {fts} SET body = new.text_message
+            WHERE rowid = (SELECT fts_rowid FROM {map} WHERE object_uid = old.uid);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {message}_fts_delete AFTER DELETE ON {message} BEGIN
+        DELETE FROM {fts} WHERE rowid = (SELECT fts_rowid FROM {map} WHERE object_uid = old.uid);
+        DELETE FROM {map} WHERE object_uid = old.uid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {chat}_fts_insert AFTER INSERT ON {chat} WHEN new.title IS NOT NULL BEGIN
+        INSERT INTO {fts}(owner, body, kind) VALUES ('u' || new.registered_by_id, new.title, 'chat');
+        INSERT INTO {map}(fts_rowid, object_uid) VALUES (last_insert_rowid(), new.uid);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {chat}_fts_update AFTER UPDATE OF title ON {chat}
+        WHEN new.title IS NOT old.title BEGIN
+        DELETE FROM {fts} WHERE rowid = (SELECT fts_rowid FROM {map} WHERE object_uid = old.uid);
+        DELETE FROM {map} WHERE object_uid = old.uid;
+        INSERT INTO {fts}(owner, body, kind) SELECT 'u' || new.registered_by_id, new.title, 'chat'
+            WHERE new.title IS NOT NULL;
+        INSERT INTO {map}(fts_rowid, object_uid) SELECT last_insert_rowid(), new.uid
+            WHERE new.title IS NOT NULL;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {chat}_fts_delete AFTER DELETE ON {chat} BEGIN
+        DELETE FROM {fts} WHERE rowid = (SELECT fts_rowid FROM {map} WHERE object_uid = old.uid);
+        DELETE FROM {map} WHERE object_uid = old.uid;
+    END
+    """,
+]
+
+# Filas que existían antes de instalar los triggers (anti-join contra el mapa, idempotente).
+SQLITE_BACKFILL = [
+    """
+    CREATE TEMP TABLE {fts}_backfill AS
+    SELECT (SELECT COALESCE(MAX(fts_rowid), 0) FROM {map}) + ROW_NUMBER() OVER () AS fts_rowid, *
+    FROM (
+        SELECT m.uid AS object_uid, 'u' || c.registered_by_id AS owner, m.text_message AS body, 'message' AS kind
+        FROM {message} m JOIN {chat} c ON c.uid = m.chat_room_id
+        WHERE m.uid NOT IN (SELECT object_uid FROM {map})
+        UNION ALL
+        SELECT c.uid, 'u' || c.registered_by_id, c.title, 'chat' FROM {chat} c
+        WHERE c.title IS NOT NULL AND c.uid NOT IN (SELECT object_uid FROM {map})
+    )
+    """,
+    "INSERT INTO {fts}(rowid, owner, body, kind) SELECT fts_rowid, owner, body, kind FROM {fts}_backfill",
+    "INSERT INTO {map}(fts_rowid, object_uid) SELECT fts_rowid, object_uid FROM {fts}_backfill",
+    "DROP TABLE {fts}_backfill",
+]
+
+
+def install_search_index(sender=None, using=DEFAULT_DB_ALIAS, **kwargs):
+    """ post_migrate handler: creates the backend specific index objects (idempotent). """
+    connection = connections[using]
+    names = _tables()
+    if not re.fullmatch(r"\w+", SEARCH_CONFIG):
+        raise ValueError(f"Invalid CHAT_SEARCH_CONFIG '{SEARCH_CONFIG}'.")
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(POSTGRES_DDL.format(**names))
+            elif connection.vendor == "sqlite":
+                for statement in SQLITE_DDL + SQLITE_BACKFILL:
+                    cursor.execute(statement.format(**names))
+    except OperationalError as e:
+        # p. ej. SQLite compilado sin FTS5: se usará la búsqueda icontains.
+        logger.warning(f"Full-text search index not installed on '{using}': {e}")
+    _fts_installed.pop(using, None)
+
+
+def fts_installed(using: str) -> bool:
+    """ Checked once per process and alias (servers never run post_migrate themselves). """
+    if using not in _fts_installed:
+        connection = connections[using]
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+                _fts_installed[using] = bool(cursor.fetchone()[0])
+        else:
+            _fts_installed[using] = connection.vendor == "postgresql"
+    return _fts_installed[using]
+
+
+# --- Consulta ------------------------------------------------------------------------------
+
+def render_snippet(text: str) -> str:
+    """ The snippet as HTML: the text escaped and its matches wrapped in ``<mark>``. """
+    return html.escape(text or "").replace(MATCH_START, SNIPPET_START).replace(MATCH_STOP, SNIPPET_STOP)
+
+
+def _fts5_query(user, text: str) -> str:
+    words = re.findall(r"\w+", text)
+    terms = " ".join(f'"{word}"' for word in words[:-1])
+    terms = f'{terms} "{words[-1]}"*'.strip()
+    return f'owner : "u{user.pk}" AND ({terms})'
+
+
+class ConversationSearch:
+    """
+    Lazy, sliceable result set (what ``Paginator`` needs: ``count()`` and slicing).
+    Only the requested page is ranked into rows and gets highlighted snippets.
+    Each hit: ``kind`` ("message" | "chat"), ``chat_uid``, ``chat_title``, ``message_uid``,
+    ``rol``, ``created_at``, ``rank`` (higher is better) and ``snippet``.
+    """
+
+    def __init__(self, user, text: str):
+        self.user = user
+        self.text = text.strip()
+        self.using = router.db_for_read(Message)
+        self.connection = connections[self.using]
+        self._count = None
+        if not re.search(r"\w", self.text):
+            self.backend = "empty"
+        elif fts_installed(self.using):
+            self.backend = self.connection.vendor
+        else:
+            self.backend = "icontains"
+
+    # Paginator
+    def count(self) -> int:
+        if self._count is None:
+            if self.backend == "empty":
+                self._count = 0
+            elif self.backend == "sqlite":
+                self._count = self._sqlite_count()
+            else:
+                self._count = self._ranked_queryset().count()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        if self.backend == "empty":
+            return []
+        offset, limit = item.start or 0, (item.stop or self.count()) - (item.start or 0)
+        if self.backend == "sqlite":
+            page = self._sqlite_page(offset, limit)
+        else:
+            page = list(self._ranked_queryset()[offset:offset + limit])
+        return self._hydrate(page)
+
+    # PostgreSQL / icontains
+    def _ranked_queryset(self):
+        messages = Message.objects.filter(
+            chat_room__registered_by=self.user, chat_room__is_active=True, is_active=True,
+        )
+        chats = Chat.objects.filter(registered_by=self.user, is_active=True)
+        if self.backend == "postgresql":
+            query = SearchQuery(self.text, config=SEARCH_CONFIG, search_type="websearch")
+            messages = messages.filter(search_vector=query).annotate(rank=SearchRank(F("search_vector"), query))
+            chats = chats.filter(search_vector=query).annotate(
+                rank=SearchRank(F("search_vector"), query) * Value(TITLE_RANK_BOOST)
+            )
+        else:
+            messages = messages.filter(text_message__icontains=self.text).annotate(
+                rank=Value(1.0, output_field=models.FloatField())
+            )
+            chats = chats.filter(title__icontains=self.text).annotate(
+                rank=Value(TITLE_RANK_BOOST, output_field=models.FloatField())
+            )
+        messages = messages.annotate(kind=Value("message"), object_uid=F("uid")).values("kind", "object_uid", "rank")
+        chats = chats.annotate(kind=Value("chat"), object_uid=F("uid")).values("kind", "object_uid", "rank")
+        return messages.union(chats, all=True).order_by("-rank", "object_uid")
+
+    # SQLite FTS5
+    def _sqlite_from(self):
+        names = _tables()
+        sql = (
+            "FROM {fts} f JOIN {map} mp ON mp.fts_rowid = f.rowid "
+            "LEFT JOIN {message} m ON f.kind = 'message' AND m.uid = mp.object_uid "
+            "JOIN {chat} c ON c.uid = COALESCE(m.chat_room_id, mp.object_uid) "
+            "WHERE {fts} MATCH %s AND c.is_active AND (m.uid IS NULL OR m.is_active)"
+        ).format(**names)
+        return sql, [_fts5_query(self.user, self.text)]
+
+    def _sqlite_count(self) -> int:
+        sql, params = self._sqlite_from()
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) " + sql, params)
+            return cursor.fetchone()[0]
+
+    def _sqlite_page(self, offset, limit):
+        sql, params = self._sqlite_from()
+        # bm25 es "menor es mejor": se invierte para devolver rank creciente con la relevancia.
+        rank = f"-bm25({FTS_TABLE}, 0.0, 1.0) * (CASE f.kind WHEN 'chat' THEN {TITLE_RANK_BOOST} ELSE 1.0 END)"
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT f.rowid, f.kind, mp.object_uid, {rank} AS rank {sql} "
+                f"ORDER BY rank DESC, f.rowid LIMIT %s OFFSET %s",
+                params + [limit, offset],
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return []
+            placeholders = ", ".join(["%s"] * len(rows))
+            cursor.execute(
+                f"SELECT rowid, snippet({FTS_TABLE}, 1, %s, %s, '…', {SNIPPET_TOKENS}) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND rowid IN ({placeholders})",
+                [MATCH_START, MATCH_STOP] + params + [row[0] for row in rows],
+            )
+            snippets = dict(cursor.fetchall())
+        uid_field = Message._meta.pk
+        return [
+            {
+                "kind": kind,
+                "object_uid": uid_field.to_python(object_uid),
+                "rank": rank_value,
+                "snippet": snippets.get(rowid),
+            }
+            for rowid, kind, object_uid, rank_value in rows
+        ]
+
+    # Común: solo para las filas de la página
+    def _hydrate(self, page: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        message_uids = [hit["object_uid"] for hit in page if hit["kind"] == "message"]
+        chat_uids = [hit["object_uid"] for hit in page if hit["kind"] == "chat"]
+        messages = Message.objects.filter(uid__in=message_uids).values(
+            "uid", "rol", "created_at", "text_message", "chat_room_id", "chat_room__title",
+        )
+        if self.backend == "postgresql" and message_uids:
+            query = SearchQuery(self.text, config=SEARCH_CONFIG, search_type="websearch")
+            messages = messages.annotate(headline=SearchHeadline(
+                "text_message", query, config=SEARCH_CONFIG,
+                start_sel=MATCH_START, stop_sel=MATCH_STOP, max_words=SNIPPET_TOKENS * 2,
+            ))
+        messages = {row["uid"]: row for row in messages} if message_uids else {}
+        chats = {row["uid"]: row for row in Chat.objects.filter(uid__in=chat_uids).values("uid", "title", "created_at")} if chat_uids else {}
+
+        hits = []
+        for hit in page:
+            if hit["kind"] == "message":
+                row = messages.get(hit["object_uid"])
+                if row is None:
+                    continue
+                snippet = hit.get("snippet") or row.get("headline") or row["text_message"][:200]
+                hits.append({
+                    "kind": "message",
+                    "chat_uid": str(row["chat_room_id"]),
+                    "chat_title": row["chat_room__title"],
+                    "message_uid": str(row["uid"]),
+                    "rol": row["rol"],
+                    "created_at": row["created_at"],
+                    "rank": hit["rank"],
+                    "snippet": render_snippet(snippet),
+                })
+            else:
+                row = chats.get(hit["object_uid"])
+                if row is None:
+                    continue
+                hits.append({
+                    "kind": "chat",
+                    "chat_uid": str(row["uid"]),
+                    "chat_title": row["title"],
+                    "message_uid": None,
+                    "rol": None,
+                    "created_at": row["created_at"],
+                    "rank": hit["rank"],
+                    "snippet": render_snippet(hit.get("snippet") or row["title"]),
+                })
+        return hits
@@ -0,0 +1,255 @@
+#apps/chat/semantic.py
+"""
+Local semantic search over the questions a user already asked (no external embedding API).
+
+Embeddings are hashed TF vectors (word unigrams + character trigrams, signed feature hashing)
+of ``EMBEDDING_DIM`` dimensions, L2 normalised and stored as float16. Each user has an
+append-only shard file of fixed-size records ``(uid, vector)``; new messages are appended
+after commit, so indexing is O(1) per message. Queries weight the query vector with the
+shard IDF, score every row with one matrix product and take the top-k with ``argpartition``.
+
+``rebuild`` writes a new shard to a temporary file and swaps it in with ``os.replace``, so
+readers never see a half-built shard. A reader notices the swap by the file's inode and
+reloads it; appenders that opened the old file retry on the new one.
+"""
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: los appends de un solo write() siguen siendo atómicos en la práctica.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = getattr(settings, "CHAT_SEMANTIC_DIM", 256)
+MAX_LOADED_SHARDS = getattr(settings, "CHAT_SEMANTIC_MAX_LOADED_SHARDS", 64)
+SCORE_CHUNK_ROWS = 65536
+CHAR_NGRAM = 3
+CHAR_NGRAM_WEIGHT = 0.5
+
+RECORD_DTYPE = np.dtype([("uid", "V16"), ("vec", "<f2", (EMBEDDING_DIM,))])
+
+
+def index_dir() -> str:
+    return str(getattr(settings, "CHAT_SEMANTIC_INDEX_DIR", os.path.join(settings.BASE_DIR, "var", "semantic_index")))
+
+
+def normalize_text(text: str) -> str:
+    """ Lowercase, strip accents and collapse punctuation/whitespace ("¿Qué barcos?" -> "que barcos"). """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def _features(text: str) -> List[Tuple[int, float]]:
+    words = normalize_text(text).split()
+    counts = {}
+    for word in words:
+        counts[word] = counts.get(word, 0.0) + 1.0
+        padded = f" {word} "
+        for i in range(len(padded) - CHAR_NGRAM + 1):
+            gram = "#" + padded[i:i + CHAR_NGRAM]
+            counts[gram] = counts.get(gram, 0.0) + CHAR_NGRAM_WEIGHT
+    features = []
+    for token, count in counts.items():
+        hashed = zlib.crc32(token.encode("utf-8"))
+        sign = 1.0 if hashed & 0x80000000 else -1.0
+        features.append((hashed % EMBEDDING_DIM, sign * (1.0 + math.log(count)) if count >= 1 else sign * count))
+    return features
+
+
+def embed_texts(texts: Sequence[str]) -> np.ndarray:
+    """ Returns an ``(len(texts), EMBEDDING_DIM)`` float32 matrix of L2 normalised embeddings. """
+    rows, cols, values = [], [], []
+    for row, text in enumerate(texts):
+        for col, value in _features(text or ""):
+            rows.append(row)
+            cols.append(col)
+            values.append(value)
+    matrix = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    if rows:
+        np.add.at(matrix, (np.asarray(rows), np.asarray(cols)), np.asarray(values, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def embed_records(items: Sequence[Tuple[object, str]]) -> np.ndarray:
+    """ Shard records of ``(message_uid, text)`` pairs. """
+    records = np.zeros(len(items), dtype=RECORD_DTYPE)
+    if items:
+        records["uid"] = np.frombuffer(b"".join(uid.bytes for uid, _ in items), dtype="V16")
+        records["vec"] = embed_texts([text for _, text in items])
+    return records
+
+
+def _inode(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+class _Shard:
+    """ In-memory view of one user's shard file; only the appended tail is read on refresh. """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.uids = np.empty(0, dtype="V16")
+        self.vectors = np.empty((0, EMBEDDING_DIM), dtype=np.float16)
+        self.doc_freq = np.zeros(EMBEDDING_DIM, dtype=np.int64)
+        self.size = 0
+        self.inode = None
+
+    def refresh(self):
+        try:
+            with open(self.path, "rb") as handle:
+                stat = os.fstat(handle.fileno())
+                if stat.st_ino != self.inode or stat.st_size // RECORD_DTYPE.itemsize < self.size:
+                    # Reconstruido (otro fichero en la misma ruta): se recarga desde cero.
+                    self.__init__(self.path)
+                    self.inode = stat.st_ino
+                total = stat.st_size // RECORD_DTYPE.itemsize
+                if total == self.size:
+                    return
+                handle.seek(self.size * RECORD_DTYPE.itemsize)
+                tail = np.fromfile(handle, dtype=RECORD_DTYPE, count=total - self.size)
+        except FileNotFoundError:
+            if self.size:
+                self.__init__(self.path)
+            return
+        if self.size + len(tail) > len(self.vectors):
+            capacity = max(1024, 2 * (self.size + len(tail)))
+            vectors = np.empty((capacity, EMBEDDING_DIM), dtype=np.float16)
+            uids = np.empty(capacity, dtype="V16")
+            vectors[:self.size] = self.vectors[:self.size]
+            uids[:self.size] = self.uids[:self.size]
+            self.vectors, self.uids = vectors, uids
+        self.vectors[self.size:self.size + len(tail)] = tail["vec"]
+        self.uids[self.size:self.size + len(tail)] = tail["uid"]
+        self.doc_freq += (tail["vec"] != 0).sum(axis=0)
+        self.size += len(tail)
+
+    def top_k(self, query: np.ndarray, k: int) -> List[Tuple[bytes, float]]:
+        if not self.size:
+            return []
+        idf = np.log((self.size + 1) / (self.doc_freq + 1)).astype(np.float32) + 1.0
+        weighted = query * idf
+        norm = np.linalg.norm(weighted)
+        if not norm:
+            return []
+        weighted /= norm
+        scores = np.empty(self.size, dtype=np.float32)
+        for start in range(0, self.size, SCORE_CHUNK_ROWS):
+            stop = min(start + SCORE_CHUNK_ROWS, self.size)
+            scores[start:stop] = self.vectors[start:stop].astype(np.float32) @ weighted
+        k = min(k, self.size)
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.uids[i].tobytes(), float(scores[i])) for i in best]
+
+
+class SemanticIndex:
+    """ Per-user shards under ``CHAT_SEMANTIC_INDEX_DIR``; loaded shards are kept in a bounded LRU. """
+
+    def __init__(self):
+        self._shards: "OrderedDict[str, _Shard]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def shard_path(self, user_id) -> str:
+        return os.path.join(index_dir(), f"u{user_id}.vec")
+
+    def _shard(self, user_id) -> _Shard:
+        path = self.shard_path(user_id)
+        with self._lock:
+            shard = self._shards.pop(path, None) or _Shard(path)
+            self._shards[path] = shard
+            while len(self._shards) > MAX_LOADED_SHARDS:
+                self._shards.popitem(last=False)
+        return shard
+
+    @staticmethod
+    def _open_locked(path: str, mode: str):
+        """ The shard at ``path`` opened with an exclusive lock, reopened if a rebuild swapped it meanwhile. """
+        while True:
+            handle = open(path, mode)
+            if not fcntl:
+                return handle
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            if os.fstat(handle.fileno()).st_ino == _inode(path):
+                return handle
+            handle.close()
+
+    def add(self, user_id, items: Iterable[Tuple[object, str]]):
+        """ Appends ``(message_uid, text)`` pairs to the user's shard in a single write. """
+        items = list(items)
+        if not items:
+            return
+        records = embed_records(items)
+        os.makedirs(index_dir(), exist_ok=True)
+        with self._open_locked(self.shard_path(user_id), "ab") as handle:
+            handle.write(records.tobytes())
+
+    def rebuild(self, user_id, batches: Iterable[Sequence[Tuple[object, str]]]) -> int:
+        """
+        Replaces the user's shard with the ``(message_uid, text)`` pairs of ``batches``. The new
+        shard is written aside and swapped in; what was appended to the old one meanwhile is kept.
+        """
+        os.makedirs(index_dir(), exist_ok=True)
+        path = self.shard_path(user_id)
+        try:
+            start_size = os.path.getsize(path) // RECORD_DTYPE.itemsize * RECORD_DTYPE.itemsize
+        except FileNotFoundError:
+            start_size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=index_dir(), prefix=f"u{user_id}.", suffix=".tmp")
+        total, seen = 0, set()
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                for batch in batches:
+                    records = embed_records(list(batch))
+                    handle.write(records.tobytes())
+                    seen.update(record.tobytes() for record in records["uid"])
+                    total += len(records)
+                # Los appends esperan al cambio de fichero; los hechos durante la reconstrucción se copian.
+                with self._open_locked(path, "a+b") as live:
+                    live.seek(start_size)
+                    tail = np.frombuffer(live.read(), dtype=np.uint8)
+                    tail = tail[:len(tail) // RECORD_DTYPE.itemsize * RECORD_DTYPE.itemsize].view(RECORD_DTYPE)
+                    handle.write(tail[np.array([uid.tobytes() not in seen for uid in tail["uid"]], dtype=bool)].tobytes())
+                    handle.flush()
+                    os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return total
+
+    def search(self, user_id, text: str, k: int) -> List[Tuple[bytes, float]]:
+        shard = self._shard(user_id)
+        with shard.lock:
+            shard.refresh()
+            return shard.top_k(embed_texts([text])[0], k)
+
+
+semantic_index = SemanticIndex()
+
+
+def index_user_messages(user_id, messages: Iterable[Tuple[object, str]]):
+    """ Best effort: a failing index write must never break the message write path. """
+    try:
+        semantic_index.add(user_id, messages)
+    except Exception as e:
+        logger.error(f"Semantic index update failed for user {user_id}: {e}", exc_info=True)
@@ -1,11 +1,13 @@
 #apps/chat/serializers.py
+from django.conf import settings
 from rest_framework import serializers
 from .models import Chat, Message
 from apps.utils.serializers import AbstractBaseSerializer
 from django.contrib.auth import get_user_model
 
 class MessageSerializer(AbstractBaseSerializer):
-    chat_room = serializers.PrimaryKeyRelatedField(queryset=Chat.objects.all(), required=False)
+    # Sólo lectura: el chat lo fija la vista (evita un SELECT del chat al validar).
+    chat_room = serializers.PrimaryKeyRelatedField(read_only=True)
     
     class Meta:
         model = Message
@@ -13,15 +15,34 @@ class MessageSerializer(AbstractBaseSerializer):
             "text_message",
             "rol",
             "chat_room",
-            "image"
+            "image",
+            "status",
         ]
         extra_kwargs = {
             'rol': {'required': False},
             'chat_room': {'required': False},
-            'image': {'required': False}
+            'image': {'required': False},
+            'status': {'read_only': True},
         }
 
 
+class MessageInteractionSerializer(serializers.Serializer):
+    message_uid = serializers.UUIDField()
+    is_like = serializers.BooleanField(default=True)
+
+
+class MessageInteractionBatchSerializer(serializers.Serializer):
+    interactions = MessageInteractionSerializer(many=True, allow_empty=False, max_length=1000)
+
+
+class MessageBatchSerializer(serializers.Serializer):
+    questions = serializers.ListField(
+        child=serializers.CharField(allow_blank=False),
+        allow_empty=False,
+        max_length=getattr(settings, "CHAT_BATCH_MAX_QUESTIONS", 20),
+    )
+
+
 class ChatSerializer(AbstractBaseSerializer):
     registered_by = serializers.PrimaryKeyRelatedField(queryset=get_user_model().objects.all(), required=False)
     registered_by_username = serializers.CharField(source="registered_by.username", required=False)
@@ -33,7 +54,12 @@ class ChatSerializer(AbstractBaseSerializer):
             "description",
             "registered_by",
             "registered_by_username",
+            "last_message_at",
+            "message_count",
+            "last_message_preview",
         ]
+        # Los mantiene la escritura de mensajes (Chat.record_new_messages).
+        read_only_fields = ("last_message_at", "message_count", "last_message_preview")
         
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -0,0 +1,77 @@
+#apps/chat/signals.py
+import contextvars
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from apps.utils.enums import RolType
+from .models import Chat, Message
+from .response_cache import bump_chat
+from .semantic import index_user_messages
+from .transcripts import record_messages_on_commit
+
+# Mientras está activo, quien guarda los mensajes nuevos registra él mismo su transcripción y
+# actividad en un solo paso al confirmar (MessageCreateAV): los receptores no lo hacen por mensaje.
+_recorded_by_caller = contextvars.ContextVar("chat_messages_recorded_by_caller", default=False)
+
+
+@contextmanager
+def messages_recorded_by_caller():
+    token = _recorded_by_caller.set(True)
+    try:
+        yield
+    finally:
+        _recorded_by_caller.reset(token)
+
+
+@receiver(post_save, sender=Message, dispatch_uid="chat_message_semantic_index")
+def add_message_to_semantic_index(sender, instance: Message, created: bool, raw: bool = False, **kwargs):
+    """ Appends new user questions to the owner's semantic shard once the transaction commits. """
+    if not created or raw or instance.rol != RolType.user:
+        return
+    user_id = instance.chat_room.registered_by_id
+    item = (instance.uid, instance.text_message)
+    transaction.on_commit(lambda: index_user_messages(user_id, [item]))
+
+
+@receiver(post_save, sender=Message, dispatch_uid="chat_message_transcript")
+def add_message_to_transcript(sender, instance: Message, created: bool, raw: bool = False, **kwargs):
+    """ Appends the message (new, soft-deleted or re-weighted) to its chat's transcript once the transaction commits. """
+    if raw or (created and _recorded_by_caller.get()):
+        return
+    # Sólo una inserción crea la transcripción; los cambios mantienen las que ya existen.
+    record_messages_on_commit([instance], create=created)
+
+
+@receiver(post_save, sender=Message, dispatch_uid="chat_message_activity")
+def update_chat_activity(sender, instance: Message, created: bool, raw: bool = False, **kwargs):
+    """
+    Keeps the chat's last_message_at / message_count / last_message_preview in step with its
+    messages once the transaction commits: the chat row is not locked while a turn waits for the agent.
+    """
+    if raw or (created and _recorded_by_caller.get()):
+        return
+    if created:
+        transaction.on_commit(lambda: Chat.record_new_messages(instance.chat_room_id, [instance]))
+    elif not instance.is_active:
+        # Borrado lógico: el mensaje pudo ser el último, se recalcula desde la tabla.
+        transaction.on_commit(lambda: Chat.refresh_activity(Chat.objects.filter(pk=instance.chat_room_id)))
+
+
+@receiver(post_save, sender=Message, dispatch_uid="chat_message_response_cache")
+def invalidate_message_responses(sender, instance: Message, created: bool, raw: bool = False, **kwargs):
+    """ New cache versions for the chat (and the owner's list, unless only the weight changed) on commit. """
+    if raw:
+        return
+    update_fields = kwargs.get("update_fields")
+    weight_only = update_fields is not None and set(update_fields) <= {"weight", "updated_at"}
+    owner_id = None if weight_only else instance.chat_room.registered_by_id
+    bump_chat(owner_id, instance.chat_room_id, listed=not weight_only)
+
+
+@receiver(post_save, sender=Chat, dispatch_uid="chat_response_cache")
+def invalidate_chat_responses(sender, instance: Chat, raw: bool = False, **kwargs):
+    if not raw:
+        bump_chat(instance.registered_by_id, instance.pk)
@@ -0,0 +1,127 @@
+#apps/chat/streaming.py
+"""
+Incremental events of an assistant turn, sent to the client as NDJSON.
+
+``POST /api/chat/<uid>/messages/?stream=1`` runs the turn in a helper thread. While it runs,
+the MAS tool ``publish``es what the MAS streams back, and the response forwards every event
+as one line:
+
+- ``{"event": "mas_text", "delta": "..."}``: partial text of the MAS answer.
+- ``{"event": "mas_image", "image_path": "..."}``: a MAS image, once it is saved.
+- ``{"event": "done", "status": 201, "body": {...}}``: always last. It carries the status and
+  body the non-streaming request would have returned (the message, or the error).
+
+Empty lines are keep-alives and can be ignored. Closing the response before ``done``
+cancels the turn (apps/chat/cancellation.py).
+
+Under WSGI the server iterates the response in the request thread. Under ASGI Django would
+drain a sync iterator into a list before sending anything, so ``ndjson_response`` gives it
+an async iterator there; each event is waited for in the default executor of the loop.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import queue
+import threading
+
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.http import StreamingHttpResponse
+
+from .cancellation import STREAM_CLOSED, TurnCancellation, current_cancellation, set_current_cancellation
+
+logger = logging.getLogger(__name__)
+
+_current_stream = contextvars.ContextVar("chat_turn_stream", default=None)
+
+_END = object()
+
+
+def publish(event: str, **data) -> bool:
+    """ Sends an event to the client of the current turn; ``False`` when the turn is not streamed. """
+    stream = _current_stream.get()
+    if stream is None:
+        return False
+    stream.put(event, **data)
+    return True
+
+
+class TurnEventStream:
+    """
+    Runs ``turn`` (a callable returning a DRF ``Response``) in a thread and iterates over its
+    events as encoded NDJSON lines until the turn is done.
+    """
+
+    def __init__(self, turn, keepalive: float = 15.0):
+        self.keepalive = keepalive
+        self._queue = queue.Queue()
+        # Bajo ASGI es la de la petición (se cancela también si el cliente se desconecta).
+        self.cancellation = current_cancellation() or TurnCancellation()
+        self._finished = False
+        # El hilo hereda el contexto (trazas, métricas) de la petición.
+        self._thread = threading.Thread(
+            target=contextvars.copy_context().run, args=(self._run, turn), name="chat-turn-stream", daemon=True,
+        )
+
+    def start(self) -> "TurnEventStream":
+        self._thread.start()
+        return self
+
+    def put(self, event: str, **data):
+        self._queue.put({"event": event, **data})
+
+    def _run(self, turn):
+        _current_stream.set(self)
+        set_current_cancellation(self.cancellation)
+        try:
+            response = turn()
+            self.put("done", status=response.status_code, body=response.data)
+        except Exception as e:
+            logger.error(f"Streamed turn failed: {e.__class__.__name__} - {e}", exc_info=True)
+            self.put("done", status=500, body={"error": "Ocurrió un error inesperado del servidor."})
+        finally:
+            # Las conexiones a la base de datos son por hilo: las de este hilo no las cierra nadie más.
+            connections.close_all()
+            self._queue.put(_END)
+
+    def _next_line(self):
+        """ Next encoded line (``b"\\n"`` after ``keepalive`` seconds without events); ``None`` at the end. """
+        try:
+            item = self._queue.get(timeout=self.keepalive)
+        except queue.Empty:
+            return b"\n"
+        if item is _END:
+            self._finished = True
+            return None
+        return (json.dumps(item, cls=DjangoJSONEncoder) + "\n").encode()
+
+    def __iter__(self):
+        while (line := self._next_line()) is not None:
+            yield line
+
+    async def aiter(self):
+        """ The same lines for ASGI, without blocking the event loop while the turn runs. """
+        loop = asyncio.get_running_loop()
+        try:
+            while (line := await loop.run_in_executor(None, self._next_line)) is not None:
+                yield line
+        finally:
+            # Django no cierra los iteradores asíncronos: si el envío se corta, el turno se cancela aquí.
+            self.close()
+
+    def close(self):
+        """ Called by ``StreamingHttpResponse.close``: before ``done`` it means the client went away. """
+        if not self._finished:
+            self.cancellation.cancel(STREAM_CLOSED)
+
+
+def ndjson_response(request, events: TurnEventStream) -> StreamingHttpResponse:
+    """ Starts ``events`` and streams them: an async iterator under ASGI, a sync one under WSGI. """
+    events.start()
+    is_asgi = isinstance(getattr(request, "_request", request), ASGIRequest)
+    response = StreamingHttpResponse(events.aiter() if is_asgi else events, content_type="application/x-ndjson")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx: no acumular el cuerpo
+    return response
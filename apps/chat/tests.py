@@ -1,15 +1,37 @@
+import io
 import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
 
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import OperationalError, transaction
+from django.test import override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.exceptions import Throttled
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
 
-from apps.chat.models import Chat, Message
-from apps.utils.enums import RolType
+from apps.chat.answer_cache import AnswerCache, CachedAnswer, answer_cache
+from apps.chat.intent import IntentClassifier, IntentRouter
+from apps.chat.llm_limiter import LLMLimiter
+from apps.chat.metrics import registry, start_turn, current_turn, finish_turn
+from apps.chat.langchain_setup import load_langchain_history_from_db
+from apps.chat.models import Chat, ChatTranscript, Message
+from apps.chat.serializers import MessageSerializer
+from apps.chat.transcripts import (
+    active_entries, check_transcript, encode_segment, message_entry, read_history, record_committed_messages, record_messages,
+)
+from apps.utils.enums import IntentType, MessageStatus, RolType
 
 User = get_user_model()
 
@@ -44,6 +66,40 @@ class ChatViewSetTests(APITestCase):
         self.assertEqual(len(listed_chats), 1)
         self.assertEqual(listed_chats[0]["title"], self.chat1_user1.title)
 
+    def test_list_orders_by_recent_activity_in_one_query(self):
+        older = Chat.objects.create(registered_by=self.user1, title="Chat antiguo")
+        # Las columnas de actividad se actualizan al confirmar la transacción.
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(chat_room=older, rol=RolType.user, text_message="¿Llegaron barcos en 1850?")
+            reply = Message.objects.create(chat_room=older, rol=RolType.assistant, text_message="Sí, " + "goletas " * 40)
+        older.refresh_from_db()
+        self.assertEqual(older.message_count, 2)
+        self.assertEqual(older.last_message_at, reply.created_at)
+        self.assertEqual(older.last_message_preview, Chat.preview_of(reply.text_message))
+        self.assertEqual(len(older.last_message_preview), Chat.PREVIEW_LENGTH)
+
+        # SAVEPOINT, COUNT del paginador, página de chats con su autor, RELEASE.
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("chats-list"))
+        listed = response.data["results"]["chats"]
+        self.assertEqual([chat["title"] for chat in listed], ["Chat antiguo", self.chat1_user1.title])
+        self.assertEqual((listed[0]["message_count"], listed[1]["last_message_preview"]), (2, ""))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reply.soft_delete()
+        older.refresh_from_db()
+        self.assertEqual(older.message_count, 1)
+        self.assertEqual(older.last_message_preview, "¿Llegaron barcos en 1850?")
+
+    def test_backfill_chat_activity(self):
+        Message.objects.create(chat_room=self.chat1_user1, rol=RolType.user, text_message="Hola")
+        Chat.objects.update(message_count=0, last_message_preview="", last_message_at=self.chat1_user2.created_at)
+        call_command("backfill_chat_activity", "--batch-size", "2", stdout=io.StringIO())
+        chat = Chat.objects.get(pk=self.chat1_user1.pk)
+        self.assertEqual((chat.message_count, chat.last_message_preview), (1, "Hola"))
+        empty = Chat.objects.get(pk=self.chat1_user2.pk)
+        self.assertEqual((empty.message_count, empty.last_message_at), (0, empty.created_at))
+
     def test_list_chats_unauthenticated(self):
         self.client.logout()
         url = reverse("chats-list")
@@ -147,7 +203,8 @@ class MessageCreateAVTests(APITestCase):
         url = reverse("chat-messages", kwargs={"pk": new_chat.uid})
         user_input_text = "This is the very first message in this new chat." # 46 chars
         data = {"text_message": user_input_text}
-        response = self.client.post(url, data, format="json")
+        with self.captureOnCommitCallbacks(execute=True):  # El título se guarda al confirmar.
+            response = self.client.post(url, data, format="json")
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         # ... (resto de las aserciones del test) ...
@@ -192,6 +249,28 @@ class MessageCreateAVTests(APITestCase):
         self.assertEqual(ai_message.image, "/media/generated_images/some_image.png")
         self.assertEqual(response.data["message"]["text_message"], "AI final response based on tool.")
 
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    def test_post_message_query_budget(self, mock_agent_executor):
+        answer_cache.clear()
+        mock_agent_executor.invoke.return_value = {"output": "AI response!"}
+        new_chat = Chat.objects.create(registered_by=self.user)
+        url = reverse("chat-messages", kwargs={"pk": new_chat.uid})
+        # SAVEPOINT, chat, transcripción (no hay), historial, INSERT pregunta, INSERT respuesta, RELEASE. Tras
+        # confirmar: crear la transcripción con el turno (SELECT ... FOR UPDATE, SAVEPOINT, mensajes, INSERT,
+        # RELEASE), UPDATE actividad y UPDATE título.
+        with self.assertNumQueries(14), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {"text_message": "¿Qué barcos llegaron en 1850?"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # Segundo turno: el historial sale de la transcripción y el chat ya tiene título.
+        # SAVEPOINT, chat, transcripción, 2 x INSERT mensaje, RELEASE y, tras confirmar, un solo
+        # SELECT ... FOR UPDATE y UPDATE de la transcripción y un UPDATE de actividad para el turno.
+        with self.assertNumQueries(9), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {"text_message": "¿Y cuántos eran ingleses?", "chat_room": str(self.chat.uid)}, format="json")
+        history = mock_agent_executor.invoke.call_args.args[0]["chat_history"]
+        self.assertEqual([m.content for m in history], ["¿Qué barcos llegaron en 1850?", "AI response!"])
+        self.assertEqual(Message.objects.filter(chat_room=new_chat).count(), 4)
+
     @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', False)
     def test_post_message_langchain_setup_failed(self):
         data = {"text_message": "Hello AI"}
@@ -239,6 +318,1054 @@ class MessageCreateAVTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
+@patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+@override_settings(CHAT_ANSWER_CACHE_ENABLED=False, CHAT_BATCH_MAX_PARALLEL=4)
+class MessageBatchAVTests(APITestCase):
+    def setUp(self):
+        self.user = create_test_user(username="user_batch_tests")
+        self.client.force_authenticate(user=self.user)
+        self.chat = Chat.objects.create(registered_by=self.user)
+        self.url = reverse("chat-messages-batch", kwargs={"pk": self.chat.uid})
+
+    @staticmethod
+    def slow_agent(*args, **kwargs):
+        question = args[0]["user_input"].content
+        if "fallo" in question:
+            raise RuntimeError("LLM caído")
+        time.sleep(0.3)
+        return {"output": f"Respuesta a {question}"}
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    @patch('apps.chat.views.load_langchain_history_from_db', return_value=[])
+    def test_batch_answers_concurrently_and_stores_pairs_in_order(self, mock_load_history, mock_agent_executor):
+        mock_agent_executor.invoke.side_effect = self.slow_agent
+        questions = [f"¿Qué barcos llegaron en {year}?" for year in (1820, 1830, 1840, 1850)]
+        started = time.perf_counter()
+        response = self.client.post(self.url, {"questions": questions}, format="json")
+        self.assertLess(time.perf_counter() - started, 1.0)  # secuencial: 1.2 s
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([result["message"]["text_message"] for result in response.data["results"]],
+                         [f"Respuesta a {question}" for question in questions])
+        mock_load_history.assert_called_once()
+
+        # Marcas de tiempo distintas y crecientes: ningún empate lo decide el uid.
+        stored = list(Message.objects.filter(chat_room=self.chat).order_by("created_at", "uid")
+                      .values_list("created_at", "rol", "text_message"))
+        expected = []
+        for question in questions:
+            expected += [(RolType.user, question), (RolType.assistant, f"Respuesta a {question}")]
+        self.assertEqual([row[1:] for row in stored], expected)
+        self.assertEqual(len({row[0] for row in stored}), len(stored))
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.title, questions[0])
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    @patch('apps.chat.views.load_langchain_history_from_db', return_value=[])
+    def test_failed_questions_are_reported_and_not_stored(self, mock_load_history, mock_agent_executor):
+        mock_agent_executor.invoke.side_effect = self.slow_agent
+        response = self.client.post(self.url, {"questions": ["¿Goletas en 1850?", "esto da fallo"]}, format="json")
+        ok, failed = response.data["results"]
+        self.assertEqual(ok["message"]["text_message"], "Respuesta a ¿Goletas en 1850?")
+        self.assertEqual((failed["index"], failed["status"]), (1, 500))
+        self.assertEqual(Message.objects.filter(chat_room=self.chat).count(), 2)
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    def test_batch_validation(self):
+        self.assertEqual(self.client.post(self.url, {"questions": []}, format="json").status_code, status.HTTP_400_BAD_REQUEST)
+        too_many = {"questions": [f"pregunta {index}" for index in range(21)]}
+        self.assertEqual(self.client.post(self.url, too_many, format="json").status_code, status.HTTP_400_BAD_REQUEST)
+        foreign = Chat.objects.create(registered_by=create_test_user(username="other_batch_tests"))
+        url = reverse("chat-messages-batch", kwargs={"pk": foreign.uid})
+        self.assertEqual(self.client.post(url, {"questions": ["hola"]}, format="json").status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ChatTranscriptTests(APITestCase):
+    def setUp(self):
+        self.user = create_test_user(username="user_transcript_tests")
+        self.client.force_authenticate(user=self.user)
+        self.chat = Chat.objects.create(registered_by=self.user, title="Transcript")
+        # La transcripción se escribe al confirmar la transacción.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.messages = [
+                Message.objects.create(chat_room=self.chat, rol=rol, text_message=f"Mensaje {index}")
+                for index, rol in enumerate([RolType.user, RolType.assistant] * 3)
+            ]
+        self.url = reverse("chat-messages", kwargs={"pk": self.chat.uid})
+
+    def table_history(self):
+        queryset = Message.objects.filter(chat_room=self.chat, is_active=True).order_by("created_at")
+        return json.loads(json.dumps(MessageSerializer(queryset, many=True).data, cls=DjangoJSONEncoder))
+
+    def test_history_is_read_from_one_row(self):
+        self.assertTrue(ChatTranscript.objects.filter(chat=self.chat).exists())
+        # Chat, usuario (validador) y transcripción: los mensajes no se consultan.
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["history"], self.table_history())
+        history = load_langchain_history_from_db(self.chat)
+        self.assertEqual([m.content for m in history], [f"Mensaje {index}" for index in range(6)])
+
+    @override_settings(CHAT_TRANSCRIPT_COMPACT_SEGMENTS=4)
+    def test_writes_keep_the_transcript_in_sync(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.messages[1].soft_delete()
+            self.messages[2].update_weight(False)
+            Message.bulk_update_weights(self.user, {self.messages[3].uid: True, self.messages[4].uid: False})
+        record_messages(Message.objects.bulk_create([
+            Message(chat_room=self.chat, rol=RolType.user, text_message="En bloque"),
+        ]))
+        self.assertTrue(check_transcript(self.chat.pk))
+        self.assertLess(ChatTranscript.objects.get(chat=self.chat).segments, 4)  # Se compactó.
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()["history"], self.table_history())
+        self.assertNotIn("Mensaje 1", [item["text_message"] for item in response.data["history"]])
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    def test_failed_append_drops_the_transcript(self, mock_agent_executor):
+        answer_cache.clear()
+        mock_agent_executor.invoke.return_value = {"output": "Respuesta"}
+        with patch("apps.chat.transcripts._append", side_effect=OperationalError("conexión perdida")), \
+                self.assertLogs("apps.chat.transcripts", level="ERROR"), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {"text_message": "Pregunta"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Chat.objects.get(pk=self.chat.pk).message_count, 8)  # El resto del callback se ejecutó.
+        # Sin transcripción el historial sale de la tabla, con el turno.
+        self.assertFalse(ChatTranscript.objects.filter(chat=self.chat).exists())
+        history = self.client.get(self.url).json()["history"]
+        self.assertEqual(history, self.table_history())
+        self.assertEqual(history[-1]["text_message"], "Respuesta")
+
+    def test_rebuild_command_repairs_drift(self):
+        Message.objects.filter(pk=self.messages[0].pk).update(text_message="Editado por fuera")
+        self.assertFalse(check_transcript(self.chat.pk))
+        with self.assertRaises(CommandError):
+            call_command("rebuild_transcripts", "--check", stdout=io.StringIO())
+
+        call_command("rebuild_transcripts", stdout=io.StringIO())
+        self.assertTrue(check_transcript(self.chat.pk))
+        self.assertEqual(self.client.get(self.url).data["history"][0]["text_message"], "Editado por fuera")
+
+    def test_transcripts_written_before_status_replay_as_complete(self):
+        old_entries = [{key: value for key, value in message_entry(message).items() if key != "status"}
+                       for message in self.messages]
+        ChatTranscript.objects.filter(chat=self.chat).update(data=encode_segment(old_entries), segments=1)
+        self.assertTrue(check_transcript(self.chat.pk))
+        self.assertEqual(self.client.get(self.url).json()["history"], self.table_history())
+
+    def test_chats_without_transcript_read_the_table(self):
+        ChatTranscript.objects.all().delete()
+        self.assertEqual(self.client.get(self.url).json()["history"], self.table_history())
+
+        call_command("rebuild_transcripts", "--all", stdout=io.StringIO())
+        self.assertEqual(ChatTranscript.objects.filter(chat=self.chat).count(), 1)
+        with override_settings(CHAT_TRANSCRIPT_ENABLED=False):
+            self.assertIsNone(read_history(self.chat))
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        self.user = create_test_user(username="user_response_cache_tests")
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chat = Chat.objects.create(registered_by=self.user, title="Cacheado")
+            self.message = Message.objects.create(chat_room=self.chat, rol=RolType.user, text_message="Hola")
+        self.list_url = reverse("chats-list")
+        self.history_url = reverse("chat-messages", kwargs={"pk": self.chat.uid})
+
+    def test_repeated_reads_skip_the_database(self):
+        # SAVEPOINT/RELEASE de ATOMIC_REQUESTS; la vista de mensajes no abre esa transacción.
+        for url, queries in ((self.list_url, 2), (reverse("chats-detail", kwargs={"pk": self.chat.uid}), 2),
+                             (self.history_url, 0)):
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, status.HTTP_200_OK)
+            with self.assertNumQueries(queries):
+                second = self.client.get(url)
+            self.assertEqual(second["X-Response-Cache"], "hit")
+            self.assertEqual(second.content, first.content)
+
+        other = create_test_user(username="other_response_cache_tests")
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(self.history_url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_writes_bump_the_versions(self):
+        self.client.get(self.list_url)
+        self.client.get(self.history_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.list_url, {"title": "Nuevo"}, format="json")
+        self.assertEqual(len(self.client.get(self.list_url).json()["results"]["chats"]), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(chat_room=self.chat, rol=RolType.assistant, text_message="¿En qué te ayudo?")
+        self.assertEqual(len(self.client.get(self.history_url).json()["history"]), 2)
+
+        # Un like sólo cambia el peso: el listado sigue en caché.
+        self.client.get(self.list_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("chat-interaction", kwargs={"chat_uid": self.chat.uid}),
+                             {"message_uid": str(self.message.uid)}, format="json")
+        self.assertEqual(self.client.get(self.list_url)["X-Response-Cache"], "hit")
+        self.assertNotIn("X-Response-Cache", self.client.get(self.history_url))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse("chats-detail", kwargs={"pk": self.chat.uid}))
+        self.assertEqual([chat["title"] for chat in self.client.get(self.list_url).json()["results"]["chats"]], ["Nuevo"])
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    def test_reads_between_commit_and_activity_update_are_not_kept(self, mock_agent_executor):
+        mock_agent_executor.invoke.side_effect = Exception("Agente caído")
+        chat = Chat.objects.create(registered_by=self.user)
+        record = record_committed_messages
+
+        def read_list_first(messages):
+            # Un GET del listado entre la confirmación del turno y sus UPDATE de actividad y título.
+            self.client.get(self.list_url)
+            record(messages)
+
+        with patch("apps.chat.views.record_committed_messages", side_effect=read_list_first), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("chat-messages", kwargs={"pk": chat.uid}),
+                                        {"text_message": "¿Qué barcos llegaron?"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        listed = {item["uid"]: item for item in self.client.get(self.list_url).json()["results"]["chats"]}
+        self.assertEqual(
+            (listed[str(chat.uid)]["title"], listed[str(chat.uid)]["message_count"], listed[str(chat.uid)]["last_message_preview"]),
+            ("¿Qué barcos llegaron?", 1, "¿Qué barcos llegaron?"),
+        )
+
+    def test_command_imports_and_backfills_bump_the_user(self):
+        self.assertEqual(len(self.client.get(self.list_url).json()["results"]["chats"]), 1)
+        path = os.path.join(tempfile.mkdtemp(), "chats.ndjson")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path), ignore_errors=True)
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(json.dumps({"title": "Importado", "messages": [{"rol": "user", "text_message": "Hola"}]}) + "\n")
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("import_conversations", path, "--user", self.user.username, stdout=io.StringIO())
+        self.assertEqual(len(self.client.get(self.list_url).json()["results"]["chats"]), 2)
+
+        Chat.objects.filter(pk=self.chat.pk).update(last_message_preview="")
+        self.client.get(self.list_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("backfill_chat_activity", stdout=io.StringIO())
+        response = self.client.get(self.list_url)
+        self.assertNotIn("X-Response-Cache", response)
+        self.assertIn("Hola", [chat["last_message_preview"] for chat in response.json()["results"]["chats"]])
+
+
+class AnswerCacheTests(APITestCase):
+    def setUp(self):
+        answer_cache.clear()
+        self.addCleanup(answer_cache.clear)
+        self.user = create_test_user(username="user_answer_cache_tests")
+        self.client.force_authenticate(user=self.user)
+
+    def _post(self, text, chat=None):
+        chat = chat or Chat.objects.create(registered_by=self.user)
+        with self.captureOnCommitCallbacks(execute=True):  # Las respuestas entran en la caché al confirmar.
+            return self.client.post(reverse("chat-messages", kwargs={"pk": chat.uid}), {"text_message": text}, format="json")
+
+    @patch('apps.chat.views.agent_executor')
+    def test_near_duplicate_first_question_is_served_from_cache(self, mock_agent_executor):
+        mock_agent_executor.invoke.return_value = {"output": "Llegaron 12 barcos."}
+        self.assertEqual(self._post("¿Qué barcos llegaron en 1850?").status_code, status.HTTP_201_CREATED)
+
+        response = self._post("que barcos llegaron en 1850")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response["X-Answer-Cache"], "hit")
+        self.assertEqual(response.data["message"]["text_message"], "Llegaron 12 barcos.")
+        self.assertEqual(mock_agent_executor.invoke.call_count, 1)
+
+        # Otro año es otra pregunta aunque el texto sea casi igual.
+        self._post("¿Qué barcos llegaron en 1851?")
+        self.assertEqual(mock_agent_executor.invoke.call_count, 2)
+
+    @override_settings(CHAT_DUPLICATE_WINDOW=0)  # el repetido seguido no debe tratarse como doble envío
+    @patch('apps.chat.views.agent_executor')
+    def test_follow_up_questions_skip_the_cache(self, mock_agent_executor):
+        mock_agent_executor.invoke.return_value = {"output": "Llegaron 12 barcos."}
+        chat = Chat.objects.create(registered_by=self.user)
+        self._post("¿Qué barcos llegaron en 1850?", chat)
+        self._post("¿Y de esos cuáles eran ingleses?", chat)
+        self._post("¿Y de esos cuáles eran ingleses?", chat)
+        self.assertEqual(mock_agent_executor.invoke.call_count, 3)
+
+    @override_settings(CHAT_DUPLICATE_WINDOW=0)
+    @patch('apps.chat.views.agent_executor')
+    def test_answers_are_per_user_and_never_built_from_history(self, mock_agent_executor):
+        mock_agent_executor.invoke.return_value = {"output": "Te llamas Ana."}
+        chat = Chat.objects.create(registered_by=self.user)
+        self._post("Hola, soy Ana", chat)
+        # Con historial la respuesta no se guarda, aunque la pregunta parezca independiente.
+        self._post("¿Cuántos barcos llegaron en 1850?", chat)
+        self._post("¿Cuántos barcos llegaron en 1850?", chat)
+        self.assertEqual(mock_agent_executor.invoke.call_count, 3)
+
+        self._post("¿Qué barcos llegaron en 1850?")
+        other = create_test_user(username="user_answer_cache_other")
+        self.client.force_authenticate(user=other)
+        response = self.client.post(
+            reverse("chat-messages", kwargs={"pk": Chat.objects.create(registered_by=other).uid}),
+            {"text_message": "¿Qué barcos llegaron en 1850?"}, format="json",
+        )
+        self.assertFalse(response.has_header("X-Answer-Cache"))
+        self.assertEqual(mock_agent_executor.invoke.call_count, 5)
+
+    @patch('apps.chat.views.agent_executor')
+    def test_disliked_answers_are_not_served_again(self, mock_agent_executor):
+        mock_agent_executor.invoke.return_value = {"output": "Respuesta equivocada."}
+        self._post("¿Qué barcos llegaron en 1850?")
+        Message.objects.get(text_message="Respuesta equivocada.").update_weight(is_like=False)
+
+        mock_agent_executor.invoke.return_value = {"output": "Llegaron 12 barcos."}
+        response = self._post("¿Qué barcos llegaron en 1850?")
+        self.assertFalse(response.has_header("X-Answer-Cache"))
+        self.assertEqual(response.data["message"]["text_message"], "Llegaron 12 barcos.")
+        self.assertEqual(mock_agent_executor.invoke.call_count, 2)
+
+    def test_cache_evicts_least_recently_used_and_expired_entries(self):
+        cache = AnswerCache(max_entries=2, ttl=60, threshold=0.9)
+        answers = {}
+        for text in ("barcos de 1850", "capitanes de 1850", "puertos de 1850"):
+            answers[text] = CachedAnswer(message_uid=uuid.uuid4(), text_message=text, image=None)
+            cache.put(1, text, answers[text])
+        all_alive = lambda uids: {uid: 1 for uid in uids}
+        self.assertIsNone(cache.get(1, "barcos de 1850", all_alive))
+        self.assertIs(cache.get(1, "puertos de 1850", all_alive), answers["puertos de 1850"])
+        self.assertIsNone(cache.get(2, "puertos de 1850", all_alive))
+
+        with patch("apps.chat.answer_cache.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get(1, "puertos de 1850", all_alive))
+        self.assertEqual(len(cache), 1)
+
+
+class IntentRouterTests(APITestCase):
+    def setUp(self):
+        self.classifier = IntentClassifier(min_margin=0.15)
+        self.agent = MagicMock()
+        self.agent.invoke.return_value = {"output": "agent answer", "intermediate_steps": []}
+        self.llm = MagicMock()
+        self.llm.invoke.return_value = MagicMock(content="llm answer")
+        self.tool = MagicMock()
+        self.tool.name = "query_historical_data_system"
+        self.tool.invoke.return_value = json.dumps({"text_response": "12 barcos", "image_path": None, "error": None})
+        self.router = IntentRouter(self.agent, self.llm, self.tool, MagicMock(), MagicMock(), self.classifier)
+
+    def test_classifier_rules_and_fallback(self):
+        self.assertEqual(self.classifier.classify("¡Hola, buenos días!"), IntentType.chitchat)
+        self.assertEqual(self.classifier.classify("¿Qué barcos llegaron a La Habana en 1850?"), IntentType.data_query)
+        self.assertEqual(self.classifier.classify("¿Cuál es la capital de Francia?"), IntentType.agent)
+        # Una pregunta de datos que depende del turno anterior la resuelve el agente.
+        self.assertEqual(self.classifier.classify("¿Y cuántos de esos barcos eran ingleses?", has_history=True), IntentType.agent)
+
+    def test_greeting_skips_the_agent_and_the_tool(self):
+        result = self.router.invoke({"chat_history": [], "user_input": "Hola"})
+        self.assertEqual(result["output"], "llm answer")
+        self.assertEqual(result["intent"], IntentType.chitchat)
+        self.assertEqual(self.llm.invoke.call_count, 1)
+        self.agent.invoke.assert_not_called()
+        self.tool.invoke.assert_not_called()
+
+    def test_data_query_calls_the_tool_directly(self):
+        result = self.router.invoke({"chat_history": [], "user_input": "¿Cuántos barcos llegaron en 1850?"})
+        self.tool.invoke.assert_called_once_with({"user_query": "¿Cuántos barcos llegaron en 1850?"}, None)
+        self.assertEqual(self.llm.invoke.call_count, 1)
+        self.agent.invoke.assert_not_called()
+        action, observation = result["intermediate_steps"][0]
+        self.assertEqual(action.tool, "query_historical_data_system")
+        self.assertEqual(json.loads(observation)["text_response"], "12 barcos")
+
+    @override_settings(CHAT_INTENT_ROUTING_ENABLED=False)
+    def test_routing_can_be_disabled(self):
+        result = self.router.invoke({"chat_history": [], "user_input": "Hola"})
+        self.assertEqual(result["output"], "agent answer")
+        self.assertEqual(result["intent"], IntentType.agent)
+
+    def test_train_intent_model_from_history(self):
+        model_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, model_dir, ignore_errors=True)
+        user = create_test_user(username="user_intent_tests")
+        chat = Chat.objects.create(registered_by=user)
+        Message.objects.create(chat_room=chat, rol=RolType.user, text_message="Tráfico de bergantines ingleses")
+        Message.objects.create(chat_room=chat, rol=RolType.assistant, text_message="Gráfico", image="chat_images/a.png")
+        with override_settings(CHAT_INTENT_MODEL_PATH=f"{model_dir}/intent.npz"):
+            call_command("train_intent_model", stdout=MagicMock())
+            classifier = IntentClassifier(min_margin=0.0)
+            classifier.load()
+            self.assertEqual(classifier.model_intent("bergantines ingleses"), IntentType.data_query)
+
+
+class LazyAgentTests(APITestCase):
+    def setUp(self):
+        patcher = patch('apps.chat.langchain_setup._agent_executor', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('apps.chat.langchain_setup.build_agent_executor')
+    def test_agent_is_built_once_across_threads(self, mock_build):
+        import threading
+        from apps.chat import langchain_setup
+        mock_build.return_value.invoke.return_value = {"output": "ok"}
+        threads = [threading.Thread(target=langchain_setup.agent_executor.invoke, args=({},)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(mock_build.call_count, 1)
+        self.assertEqual(mock_build.return_value.invoke.call_count, 8)
+
+    @patch('apps.chat.langchain_setup.build_agent_executor', side_effect=ValueError("missing API key"))
+    def test_build_failure_is_reported_as_unavailable(self, mock_build):
+        from apps.chat import langchain_setup
+        with self.assertRaises(NotImplementedError):
+            langchain_setup.agent_executor.invoke({})
+        self.assertFalse(langchain_setup.warm_up())
+
+
+class LLMLimiterTests(APITestCase):
+    def test_full_queue_is_rejected_with_retry_after(self):
+        limiter = LLMLimiter(max_concurrency=1, max_queue=0, max_wait=5, rate=0, burst=1)
+        with limiter.slot():
+            with self.assertRaises(Throttled) as raised:
+                limiter.acquire()
+        self.assertGreaterEqual(raised.exception.wait, 1)
+        self.assertEqual(limiter.stats()["rejected_total"], 1)
+        self.assertEqual(limiter.stats()["in_flight"], 0)
+
+    def test_queued_call_runs_when_a_slot_frees_up(self):
+        import threading
+        limiter = LLMLimiter(max_concurrency=1, max_queue=1, max_wait=5, rate=0, burst=1)
+        limiter.acquire()
+        admitted = threading.Event()
+        waiter = threading.Thread(target=lambda: (limiter.acquire(), admitted.set()))
+        waiter.start()
+        while limiter.stats()["queue_depth"] != 1:
+            time.sleep(0.001)
+        self.assertFalse(admitted.is_set())
+        limiter.release(duration=0.01)
+        waiter.join(timeout=5)
+        self.assertTrue(admitted.is_set())
+        self.assertEqual(limiter.stats()["admitted_total"], 2)
+
+    def test_token_bucket_times_out_queued_calls(self):
+        limiter = LLMLimiter(max_concurrency=10, max_queue=10, max_wait=0.05, rate=0.5, burst=1)
+        with limiter.slot():
+            pass
+        with self.assertRaises(Throttled):
+            limiter.acquire()
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    def test_message_post_returns_429_when_saturated(self, mock_agent_executor):
+        user = create_test_user(username="user_limiter_tests")
+        self.client.force_authenticate(user=user)
+        chat = Chat.objects.create(registered_by=user)
+        limiter = LLMLimiter(max_concurrency=1, max_queue=0, max_wait=5, rate=0, burst=1)
+        limiter.acquire()
+        with patch('apps.chat.views.llm_limiter', limiter):
+            response = self.client.post(reverse("chat-messages", kwargs={"pk": chat.uid}),
+                                        {"text_message": "¿Qué barcos llegaron en 1850?"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("Retry-After", response)
+        mock_agent_executor.invoke.assert_not_called()
+        # El reintento tras Retry-After no debe encontrar la pregunta ya guardada.
+        self.assertFalse(Message.objects.filter(chat_room=chat).exists())
+        chat.refresh_from_db()
+        self.assertFalse(chat.title)
+
+    def test_status_endpoint_is_superuser_only(self):
+        self.client.force_authenticate(user=create_test_user(username="user_limiter_status"))
+        self.assertEqual(self.client.get(reverse("llm-limiter-status")).status_code, status.HTTP_403_FORBIDDEN)
+        admin = User.objects.create_superuser(username="admin_limiter", email="admin@example.com", password="x")
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(reverse("llm-limiter-status"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("queue_depth", response.data)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        registry.reset()
+        answer_cache.clear()
+
+    def test_callback_handler_records_tokens_and_tool_calls(self):
+        from langchain_core.outputs import Generation, LLMResult
+        from apps.chat.callbacks import TurnMetricsCallbackHandler
+        handler = TurnMetricsCallbackHandler()
+        token = start_turn()
+        run_id, tool_run_id = uuid.uuid4(), uuid.uuid4()
+        handler.on_chat_model_start({}, [], run_id=run_id)
+        handler.on_llm_end(LLMResult(generations=[[Generation(text="ok")]],
+                                     llm_output={"token_usage": {"prompt_tokens": 120, "completion_tokens": 30}}),
+                           run_id=run_id)
+        handler.on_tool_start({"name": "query_historical_data_system"}, "1850", run_id=tool_run_id)
+        handler.on_tool_end(json.dumps({"error": "MAS caído", "text_response": None}), run_id=tool_run_id)
+        stats = current_turn().as_dict()
+        finish_turn(token)
+        self.assertEqual((stats["llm_calls"], stats["prompt_tokens"], stats["completion_tokens"]), (1, 120, 30))
+        self.assertEqual(stats["tool_calls"], {"query_historical_data_system": 1})
+        self.assertIn("llm", stats["steps"])
+        rendered = registry.render()
+        self.assertIn('chat_llm_tokens_total{type="prompt"} 120', rendered)
+        self.assertIn('chat_tool_calls_total{status="error",tool="query_historical_data_system"} 1', rendered)
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    def test_post_stores_turn_stats_on_the_assistant_message(self, mock_agent_executor):
+        user = create_test_user(username="user_metrics_tests")
+        self.client.force_authenticate(user=user)
+        chat = Chat.objects.create(registered_by=user)
+        mock_agent_executor.invoke.return_value = {"output": "Hola", "intent": IntentType.chitchat}
+        response = self.client.post(reverse("chat-messages", kwargs={"pk": chat.uid}), {"text_message": "hola"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn("callbacks", mock_agent_executor.invoke.call_args.kwargs["config"])
+        stats = Message.objects.get(uid=response.data["message"]["uid"]).stats
+        self.assertEqual(stats["route"], IntentType.chitchat)
+        self.assertTrue({"history", "db_write", "llm_queue", "agent"} <= set(stats["steps"]))
+        self.assertIn('chat_turns_total{route="chitchat",status="ok"} 1', registry.render())
+
+    @override_settings(METRICS_TOKEN="scrape-secret")
+    def test_metrics_endpoint_accepts_superusers_and_the_scrape_token(self):
+        url = reverse("metrics")
+        self.assertIn(self.client.get(url).status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        self.assertIn(self.client.get(url, HTTP_AUTHORIZATION="Bearer wrong").status_code,
+                      (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        registry.observe("chat_step_duration_seconds", 0.3, step="mas_request")
+        response = self.client.get(url, HTTP_AUTHORIZATION="Bearer scrape-secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn('chat_step_duration_seconds_bucket{step="mas_request",le="0.5"} 1', body)
+        self.assertIn("# TYPE chat_llm_queue_depth gauge", body)
+        self.assertIn('http_bulkhead_in_flight{bulkhead="default"}', body)
+        admin = User.objects.create_superuser(username="admin_metrics", email="admin_metrics@example.com", password="x")
+        self.client.force_authenticate(user=admin)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+
+class TracingTests(APITestCase):
+    def setUp(self):
+        answer_cache.clear()
+        self.user = create_test_user(username="user_tracing_tests")
+        self.client.force_authenticate(user=self.user)
+        self.chat = Chat.objects.create(registered_by=self.user)
+        self.trace_dir = tempfile.mkdtemp()
+        self.trace_file = f"{self.trace_dir}/traces.jsonl"
+        self.addCleanup(shutil.rmtree, self.trace_dir, ignore_errors=True)
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    def test_turn_is_traced_and_reported(self, mock_agent_executor):
+        from apps.chat.tracing import read_spans, traceparent
+        sent_headers = []
+
+        def run_agent(inputs, config):
+            handler = config["callbacks"][0]
+            run_id = uuid.uuid4()
+            handler.on_tool_start({"name": "query_historical_data_system"}, "1850", run_id=run_id)
+            sent_headers.append(traceparent())
+            handler.on_tool_end(json.dumps({"text_response": "3 barcos"}), run_id=run_id)
+            return {"output": "Llegaron 3 barcos."}
+
+        mock_agent_executor.invoke.side_effect = run_agent
+        client_trace = "0af7651916cd43dd8448eb211c80319c"
+        with override_settings(CHAT_TRACING_ENABLED=True, CHAT_TRACE_FILE=self.trace_file):
+            response = self.client.post(reverse("chat-messages", kwargs={"pk": self.chat.uid}),
+                                        {"text_message": "¿Qué barcos llegaron en 1850?"}, format="json",
+                                        HTTP_TRACEPARENT=f"00-{client_trace}-b7ad6b7169203331-01")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response["X-Trace-Id"], client_trace)
+
+        spans = {item["name"]: item for item in read_spans(self.trace_file, client_trace)}
+        self.assertTrue({"MessageCreateAV.post", "history", "db_write", "agent", "tool:query_historical_data_system"} <= set(spans))
+        self.assertEqual(spans["MessageCreateAV.post"]["parent_id"], "b7ad6b7169203331")
+        self.assertEqual(spans["tool:query_historical_data_system"]["parent_id"], spans["agent"]["span_id"])
+        # La cabecera enviada al MAS cuelga del span de la herramienta.
+        self.assertEqual(sent_headers, [f"00-{client_trace}-{spans['tool:query_historical_data_system']['span_id']}-01"])
+
+        out = io.StringIO()
+        call_command("trace_report", client_trace, file=self.trace_file, stdout=out)
+        self.assertIn("tool:query_historical_data_system", out.getvalue())
+        out = io.StringIO()
+        call_command("trace_report", file=self.trace_file, stdout=out)
+        self.assertIn(client_trace, out.getvalue())
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    def test_tracing_disabled_writes_nothing(self, mock_agent_executor):
+        mock_agent_executor.invoke.return_value = {"output": "Hola"}
+        with override_settings(CHAT_TRACING_ENABLED=False, CHAT_TRACE_FILE=self.trace_file):
+            response = self.client.post(reverse("chat-messages", kwargs={"pk": self.chat.uid}),
+                                        {"text_message": "hola"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("X-Trace-Id", response)
+        self.assertFalse(os.path.exists(self.trace_file))
+
+
+class EmulatorTests(APITestCase):
+    def setUp(self):
+        from apps.chat.emulators import make_llm_server, make_mas_server, serve_in_thread
+        self.llm = make_llm_server(latency="fixed:0")
+        self.mas = make_mas_server(latency="fixed:0", image_ratio=1.0, image_bytes=30_000)
+        for server in (self.llm, self.mas):
+            serve_in_thread(server)
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+
+    def test_fake_openai_answers_tool_calls_text_and_streams(self):
+        from openai import OpenAI
+        client = OpenAI(api_key="sk-fake", base_url=f"{self.llm.url}/v1", max_retries=0)
+        tools = [{"type": "function", "function": {"name": "query_historical_data_system", "parameters": {"type": "object"}}}]
+        question = [{"role": "user", "content": "¿Qué barcos llegaron en 1850?"}]
+        completion = client.chat.completions.create(model="gpt-4o-mini", messages=question, tools=tools)
+        call = completion.choices[0].message.tool_calls[0]
+        self.assertEqual(call.function.name, "query_historical_data_system")
+        self.assertEqual(json.loads(call.function.arguments), {"user_query": "¿Qué barcos llegaron en 1850?"})
+        self.assertGreater(completion.usage.prompt_tokens, 0)
+
+        greeting = client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": "hola"}], tools=tools)
+        self.assertIn("hola", greeting.choices[0].message.content)
+        stream = client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": "hola que tal"}], stream=True)
+        self.assertEqual("".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices),
+                         "Respuesta simulada a: hola que tal")
+
+    def test_tool_decodes_and_saves_fake_mas_images(self):
+        from apps.chat.tools import query_historical_data_system
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with patch('apps.chat.tools.MAS_API_URL', self.mas.url), override_settings(MEDIA_ROOT=media_root):
+            result = json.loads(query_historical_data_system.invoke({"user_query": "barcos en 1850"}))
+        self.assertIsNone(result["error"])
+        saved = os.path.join(media_root, result["image_path"].split("/media/", 1)[1])
+        self.assertAlmostEqual(os.path.getsize(saved), 30_000, delta=100)
+
+    def test_tool_forwards_streamed_mas_text_and_images(self):
+        import requests
+        from apps.chat.tools import query_historical_data_system
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        results = {}
+        for stream_format in ("ndjson", "sse", "off"):
+            requests.post(f"{self.mas.url}/_control", json={"stream_format": stream_format}, timeout=5)
+            with patch('apps.chat.tools.MAS_API_URL', self.mas.url), patch('apps.chat.tools.publish') as publish, \
+                    override_settings(MEDIA_ROOT=media_root):
+                result = json.loads(query_historical_data_system.invoke({"user_query": "goletas en 1850"}))
+            events = [call.args[0] for call in publish.call_args_list]
+            results[stream_format] = result
+            self.assertIsNone(result["error"])
+            self.assertTrue(result["image_path"])
+            if stream_format == "off":
+                self.assertEqual(events, [])
+            else:
+                self.assertGreater(events.count("mas_text"), 1)
+                self.assertEqual(events[-1], "mas_image")
+                self.assertEqual(publish.call_args.kwargs, {"image_path": result["image_path"]})
+        self.assertEqual(results["ndjson"]["text_response"], results["off"]["text_response"])
+        self.assertEqual(results["sse"]["text_response"], results["off"]["text_response"])
+
+    def test_cancelled_turn_aborts_the_streamed_mas_answer(self):
+        import requests
+        from apps.chat.cancellation import TurnCancellation, TurnCancelled, reset_current_cancellation, set_current_cancellation
+        from apps.chat.tools import query_historical_data_system
+        requests.post(f"{self.mas.url}/_control", json={"stream_format": "ndjson", "image_ratio": 0}, timeout=5)
+        cancellation = TurnCancellation()
+        token = set_current_cancellation(cancellation)
+        self.addCleanup(reset_current_cancellation, token)
+        # El cliente se va en cuanto llega el primer fragmento de texto.
+        with patch('apps.chat.tools.MAS_API_URL', self.mas.url), \
+                patch('apps.chat.tools.publish', side_effect=lambda *args, **kwargs: cancellation.cancel()) as publish:
+            with self.assertRaises(TurnCancelled) as raised:
+                query_historical_data_system.invoke({"user_query": "goletas en 1850"})
+        self.assertEqual(raised.exception.stage, "mas")
+        self.assertEqual(publish.call_count, 1)
+        with patch('apps.chat.tools.MAS_API_URL', self.mas.url), patch('apps.chat.tools.requests.post') as post:
+            with self.assertRaises(TurnCancelled):
+                query_historical_data_system.invoke({"user_query": "goletas en 1851"})
+        post.assert_not_called()
+
+    def test_control_endpoint_changes_latency_and_images(self):
+        import requests
+        state = requests.post(f"{self.mas.url}/_control", json={"latency": "uniform:0,0.01", "image_ratio": 0}, timeout=5).json()
+        self.assertEqual((state["latency"], state["image_ratio"]), ("uniform:0,0.01", 0.0))
+        reply = requests.post(f"{self.mas.url}/api/query", json={"query": "barcos en 1850"}, timeout=5).json()
+        self.assertIsNone(reply["image_response"])
+        bad = requests.post(f"{self.mas.url}/_control", json={"latency": "gamma:1"}, timeout=5)
+        self.assertEqual(bad.status_code, 400)
+
+
+class ParallelToolsTests(APITestCase):
+    def build_executor(self, delays, tool_timeout=5.0):
+        from langchain.agents import BaseMultiActionAgent
+        from langchain_core.agents import AgentAction, AgentFinish
+        from langchain_core.tools import tool
+        from apps.chat.executor import ParallelToolsAgentExecutor
+
+        @tool
+        def lookup(port: str) -> str:
+            """ Looks a port up. """
+            time.sleep(delays[port])
+            return f"datos de {port}"
+
+        class TwoLookupsAgent(BaseMultiActionAgent):
+            @property
+            def input_keys(self):
+                return ["input"]
+
+            def plan(self, intermediate_steps, callbacks=None, **kwargs):
+                if intermediate_steps:
+                    return AgentFinish({"output": " | ".join(observation for _, observation in intermediate_steps)}, "")
+                return [AgentAction("lookup", {"port": port}, "") for port in delays]
+
+            async def aplan(self, intermediate_steps, callbacks=None, **kwargs):
+                return self.plan(intermediate_steps, callbacks, **kwargs)
+
+        return ParallelToolsAgentExecutor(agent=TwoLookupsAgent(), tools=[lookup], tool_timeout=tool_timeout,
+                                          return_intermediate_steps=True)
+
+    def test_tool_calls_of_one_step_run_concurrently_and_keep_their_order(self):
+        executor = self.build_executor({"La Habana": 0.4, "Cádiz": 0.2, "Veracruz": 0.3})
+        started = time.perf_counter()
+        result = executor.invoke({"input": "compara los puertos"})
+        self.assertLess(time.perf_counter() - started, 0.8)  # secuencial: 0.9 s
+        self.assertEqual(result["output"], "datos de La Habana | datos de Cádiz | datos de Veracruz")
+
+        import asyncio
+        result = asyncio.run(executor.ainvoke({"input": "compara los puertos"}))
+        self.assertEqual([action.tool_input["port"] for action, _ in result["intermediate_steps"]],
+                         ["La Habana", "Cádiz", "Veracruz"])
+
+    def test_a_slow_tool_call_times_out_without_failing_the_turn(self):
+        executor = self.build_executor({"La Habana": 1.0, "Cádiz": 0.0}, tool_timeout=0.2)
+        result = executor.invoke({"input": "compara los puertos"})
+        slow, fast = [observation for _, observation in result["intermediate_steps"]]
+        self.assertIn("timeout", json.loads(slow)["text_response"])
+        self.assertEqual(fast, "datos de Cádiz")
+
+    def test_a_queued_tool_call_past_its_deadline_is_a_timeout_not_a_cancellation(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from apps.chat.cancellation import TurnCancellation, reset_current_cancellation, set_current_cancellation
+        pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(pool.shutdown)
+        executor = self.build_executor({"La Habana": 0.5, "Cádiz": 0.0}, tool_timeout=0.2)
+        token = set_current_cancellation(TurnCancellation())
+        try:
+            with patch("apps.chat.executor.get_tool_pool", return_value=pool):
+                result = executor.invoke({"input": "compara los puertos"})
+        finally:
+            reset_current_cancellation(token)
+        # Cádiz sigue en la cola cuando vence su plazo: se cancela y cuenta como timeout.
+        self.assertEqual([json.loads(observation)["text_response"] for _, observation in result["intermediate_steps"]],
+                         ["Información no disponible (timeout)."] * 2)
+
+
+class StreamedTurnTests(APITransactionTestCase):
+    # El turno corre en otro hilo: necesita ver los datos confirmados, no la transacción del test.
+    def setUp(self):
+        self.user = create_test_user(username="user_stream_tests")
+        self.client.force_authenticate(user=self.user)
+        self.chat = Chat.objects.create(registered_by=self.user, title="Streamed")
+        self.url = reverse("chat-messages", kwargs={"pk": self.chat.uid}) + "?stream=1"
+
+    def read_events(self, response):
+        body = b"".join(response.streaming_content).decode()
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    @patch('apps.chat.views.load_langchain_history_from_db', return_value=[])
+    def test_stream_forwards_mas_events_before_the_message(self, mock_load_history, mock_agent_executor):
+        from apps.chat.streaming import publish
+        from apps.utils.middleware import bulkhead_stats
+
+        def invoke(*args, **kwargs):
+            publish("mas_text", delta="Llegaron ")
+            publish("mas_text", delta="12 goletas.")
+            return {"output": "Llegaron 12 goletas."}
+        mock_agent_executor.invoke.side_effect = invoke
+
+        response = self.client.post(self.url, {"text_message": "¿Qué goletas llegaron en 1850?"}, format="json")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        events = self.read_events(response)
+        self.assertEqual([event["event"] for event in events], ["mas_text", "mas_text", "done"])
+        self.assertEqual((events[-1]["status"], events[-1]["body"]["message"]["text_message"]), (201, "Llegaron 12 goletas."))
+        self.assertTrue(Message.objects.filter(chat_room=self.chat, rol=RolType.assistant).exists())
+        self.assertEqual(bulkhead_stats()["agent"]["in_flight"], 0)
+
+    @override_settings(CHAT_ANSWER_CACHE_ENABLED=False)
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    @patch('apps.chat.views.load_langchain_history_from_db', return_value=[])
+    def test_batch_stream_sends_each_answer_when_ready(self, mock_load_history, mock_agent_executor):
+        def invoke(agent_input, **kwargs):
+            question = agent_input["user_input"].content
+            time.sleep(0.3 if question == "primera" else 0)
+            return {"output": question.upper()}
+        mock_agent_executor.invoke.side_effect = invoke
+
+        url = reverse("chat-messages-batch", kwargs={"pk": self.chat.uid}) + "?stream=1"
+        events = self.read_events(self.client.post(url, {"questions": ["primera", "segunda"]}, format="json"))
+        self.assertEqual([(event["event"], event.get("index")) for event in events], [("answer", 1), ("answer", 0), ("done", None)])
+        self.assertEqual([result["message"]["text_message"] for result in events[-1]["body"]["results"]], ["PRIMERA", "SEGUNDA"])
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    @patch('apps.chat.views.load_langchain_history_from_db', return_value=[])
+    def test_asgi_stream_sends_events_while_the_turn_runs(self, mock_load_history, mock_agent_executor):
+        import asyncio
+        from django.core.asgi import get_asgi_application
+        from rest_framework_simplejwt.tokens import AccessToken
+        from apps.chat.streaming import publish
+        from apps.utils.middleware import bulkhead_stats
+        first_line_sent, seen_by_agent = threading.Event(), []
+
+        def invoke(*args, **kwargs):
+            publish("mas_text", delta="Llegaron ")
+            # Bajo ASGI la línea llega al cliente antes de que el turno acabe (no se acumula el cuerpo).
+            seen_by_agent.append(first_line_sent.wait(5))
+            return {"output": "Llegaron 12 goletas."}
+        mock_agent_executor.invoke.side_effect = invoke
+
+        body = json.dumps({"text_message": "¿Qué goletas llegaron en 1850?"}).encode()
+        path = reverse("chat-messages", kwargs={"pk": self.chat.uid})
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+            "path": path, "raw_path": path.encode(), "query_string": b"stream=1", "root_path": "",
+            "headers": [(b"host", b"testserver"), (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"authorization", f"JWT {AccessToken.for_user(self.user)}".encode())],
+            "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+        }
+
+        async def request():
+            messages, chunks = [{"type": "http.request", "body": body, "more_body": False}], []
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                await asyncio.Event().wait()
+
+            async def send(message):
+                if message["type"] == "http.response.body":
+                    chunks.append(message.get("body", b""))
+                    if b"mas_text" in message.get("body", b""):
+                        first_line_sent.set()
+
+            await asyncio.wait_for(get_asgi_application()(scope, receive, send), timeout=10)
+            return chunks
+
+        chunks = asyncio.run(request())
+        self.assertEqual(seen_by_agent, [True])
+        events = [json.loads(chunk) for chunk in chunks if chunk.strip()]
+        self.assertEqual([event["event"] for event in events], ["mas_text", "done"])
+        self.assertEqual(bulkhead_stats()["agent"]["in_flight"], 0)
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    def test_stream_reports_errors_in_the_last_event(self):
+        other = create_test_user(username="other_stream_tests")
+        url = reverse("chat-messages", kwargs={"pk": Chat.objects.create(registered_by=other).uid}) + "?stream=1"
+        events = self.read_events(self.client.post(url, {"text_message": "hola"}, format="json"))
+        self.assertEqual([(event["event"], event["status"]) for event in events], [("done", 404)])
+
+
+@patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+@patch('apps.chat.views.load_langchain_history_from_db', return_value=[])
+class IdempotentPostTests(APITransactionTestCase):
+    def setUp(self):
+        answer_cache.clear()
+        self.addCleanup(answer_cache.clear)
+        self.user = create_test_user(username="user_idempotency_tests")
+        self.chat = Chat.objects.create(registered_by=self.user, title="Reintentos")
+        self.url = reverse("chat-messages", kwargs={"pk": self.chat.uid})
+
+    def post(self, text, key=None):
+        client = APIClient()  # un cliente por hilo
+        client.force_authenticate(user=self.user)
+        headers = {"HTTP_IDEMPOTENCY_KEY": key} if key else {}
+        return client.post(self.url, {"text_message": text}, format="json", **headers)
+
+    @patch('apps.chat.views.agent_executor')
+    def test_retry_with_the_same_key_replays_the_response(self, mock_agent_executor, mock_load_history):
+        mock_agent_executor.invoke.return_value = {"output": "Llegaron 12 goletas."}
+        first = self.post("¿Qué goletas llegaron en 1850?", key="clave-1")
+        retry = self.post("¿Qué goletas llegaron en 1850?", key="clave-1")
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.data["message"]["uid"], first.data["message"]["uid"])
+        self.assertEqual(mock_agent_executor.invoke.call_count, 1)
+        self.assertEqual(Message.objects.filter(chat_room=self.chat).count(), 2)
+
+        self.assertEqual(self.post("Otra pregunta", key="clave-1").status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    @patch('apps.chat.views.agent_executor')
+    def test_retry_during_the_turn_waits_for_it(self, mock_agent_executor, mock_load_history):
+        def slow_invoke(*args, **kwargs):
+            time.sleep(0.5)
+            return {"output": "Llegaron 12 goletas."}
+        mock_agent_executor.invoke.side_effect = slow_invoke
+
+        # Sin clave: el doble envío del mismo texto se suprime igual.
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            first = pool.submit(self.post, "¿Qué goletas llegaron en 1850?")
+            time.sleep(0.1)
+            retry = pool.submit(self.post, "¿qué goletas llegaron en 1850? ")
+            first, retry = first.result(), retry.result()
+        self.assertEqual(mock_agent_executor.invoke.call_count, 1)
+        self.assertEqual(retry.data["message"]["uid"], first.data["message"]["uid"])
+        self.assertEqual(Message.objects.filter(chat_room=self.chat).count(), 2)
+
+    @patch('apps.chat.views.agent_executor')
+    def test_turns_rolled_back_after_returning_are_not_replayed(self, mock_agent_executor, mock_load_history):
+        from apps.chat.views import MessageCreateAV
+        mock_agent_executor.invoke.return_value = {"output": "Llegaron 12 goletas."}
+        tracked_turn = MessageCreateAV.tracked_turn
+
+        def turn_then_fail_commit(view, *args, **kwargs):
+            response = tracked_turn(view, *args, **kwargs)
+            transaction.set_rollback(True)  # Falla la confirmación después de devolver el 201.
+            return response
+
+        with patch.object(MessageCreateAV, "tracked_turn", turn_then_fail_commit):
+            first = self.post("¿Qué goletas llegaron en 1850?", key="clave-3")
+        self.assertEqual(first.status_code, 201)
+        self.assertFalse(Message.objects.filter(chat_room=self.chat).exists())
+        self.assertEqual(len(answer_cache), 0)  # ni la respuesta de un mensaje que no llegó a guardarse
+
+        retry = self.post("¿Qué goletas llegaron en 1850?", key="clave-3")
+        self.assertEqual((retry.status_code, retry.has_header("Idempotent-Replayed")), (201, False))
+        self.assertNotEqual(retry.data["message"]["uid"], first.data["message"]["uid"])
+        self.assertTrue(Message.objects.filter(uid=retry.data["message"]["uid"]).exists())
+        self.assertEqual(mock_agent_executor.invoke.call_count, 2)
+
+    @patch('apps.chat.views.agent_executor')
+    def test_failed_turns_can_be_retried(self, mock_agent_executor, mock_load_history):
+        mock_agent_executor.invoke.side_effect = [RuntimeError("LLM caído"), {"output": "Ahora sí."}]
+        self.assertEqual(self.post("¿Qué goletas llegaron?", key="clave-2").status_code, 500)
+        retry = self.post("¿Qué goletas llegaron?", key="clave-2")
+        self.assertEqual((retry.status_code, retry.has_header("Idempotent-Replayed")), (201, False))
+
+
+class TurnCancellationTests(APITransactionTestCase):
+    def setUp(self):
+        registry.reset()
+        answer_cache.clear()
+        self.addCleanup(answer_cache.clear)
+        self.user = create_test_user(username="user_cancellation_tests")
+        self.chat = Chat.objects.create(registered_by=self.user, title="Cancelaciones")
+        self.url = reverse("chat-messages", kwargs={"pk": self.chat.uid})
+        self.agent_started = threading.Event()
+
+    def slow_agent(self, agent_input, config):
+        # Como un agente de varios pasos: los callbacks se llaman antes de cada llamada al LLM.
+        from apps.chat.callbacks import CancellationCallbackHandler
+        self.agent_started.set()
+        handler = next(handler for handler in config["callbacks"] if isinstance(handler, CancellationCallbackHandler))
+        for _ in range(100):
+            handler.on_chat_model_start({}, [])
+            time.sleep(0.05)
+        return {"output": "Respuesta que nadie leerá."}
+
+    def assert_aborted(self, stage, reason):
+        user_message, assistant_message = Message.objects.filter(chat_room=self.chat).order_by("created_at")
+        self.assertEqual((user_message.rol, user_message.status), (RolType.user, MessageStatus.complete))
+        self.assertEqual((assistant_message.rol, assistant_message.status), (RolType.assistant, MessageStatus.aborted))
+        self.assertIn(f'chat_turns_cancelled_total{{reason="{reason}",stage="{stage}"}} 1', registry.render())
+        self.assertIn('status="cancelled"', registry.render())
+        # El agente no ve el turno abortado; el historial sí lo muestra.
+        history = load_langchain_history_from_db(self.chat)
+        self.assertEqual([message.content for message in history], [user_message.text_message])
+        self.client.force_authenticate(user=self.user)
+        history = self.client.get(self.url).json()["history"]
+        self.assertEqual([item["status"] for item in history], [MessageStatus.complete, MessageStatus.aborted])
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    def test_client_disconnect_on_asgi_cancels_the_agent(self, mock_agent_executor):
+        import asyncio
+        from django.core.asgi import get_asgi_application
+        from rest_framework_simplejwt.tokens import AccessToken
+        from apps.chat.cancellation import CancelOnDisconnect
+        mock_agent_executor.invoke.side_effect = self.slow_agent
+        application = CancelOnDisconnect(get_asgi_application())
+        body = json.dumps({"text_message": "¿Qué goletas llegaron en 1850?"}).encode()
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+            "path": self.url, "raw_path": self.url.encode(), "query_string": b"", "root_path": "",
+            "headers": [(b"host", b"testserver"), (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"authorization", f"JWT {AccessToken.for_user(self.user)}".encode())],
+            "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+        }
+
+        async def request():
+            messages, sent = [{"type": "http.request", "body": body, "more_body": False}], []
+            gone = asyncio.Event()
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                await gone.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+
+            task = asyncio.ensure_future(application(scope, receive, send))
+            while not self.agent_started.is_set() and not task.done():
+                await asyncio.sleep(0.01)
+            gone.set()  # El usuario cierra la pestaña.
+            await asyncio.wait_for(task, timeout=5)
+            return sent
+
+        started = time.monotonic()
+        sent = asyncio.run(request())
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertEqual(sent[0]["status"], 499)
+        self.assert_aborted("llm", "client_disconnected")
+
+    @patch('apps.chat.views.LANGCHAIN_SETUP_SUCCESSFUL', True)
+    @patch('apps.chat.views.agent_executor')
+    def test_closing_a_streamed_response_cancels_the_turn(self, mock_agent_executor):
+        mock_agent_executor.invoke.side_effect = self.slow_agent
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(self.url + "?stream=1", {"text_message": "¿Qué goletas llegaron en 1850?"}, format="json")
+        self.assertTrue(self.agent_started.wait(5))
+        response.close()  # Lo que hace el servidor WSGI cuando el cliente se va.
+        # El hilo del turno termina en seguida, sin esperar a que el agente acabe.
+        turn_threads = [thread for thread in threading.enumerate() if thread.name == "chat-turn-stream"]
+        for thread in turn_threads:
+            thread.join(timeout=2)
+        self.assertFalse(any(thread.is_alive() for thread in turn_threads))
+        self.assert_aborted("llm", "stream_closed")
+
+
+class BenchmarkTests(APITestCase):
+    def test_measure_and_compare(self):
+        from apps.chat.benchmarks import Case, compare, measure, seed_chat
+        from apps.chat.langchain_setup import load_langchain_history_from_db
+        user = create_test_user(username="user_benchmark_tests")
+
+        def setup():
+            chat = seed_chat(user, 10)
+            return lambda: load_langchain_history_from_db(chat)
+
+        result = measure(Case("history_load_10", setup, items=10), rounds=5).as_dict()
+        self.assertEqual(result["rounds"], 5)
+        self.assertLessEqual(result["min"], result["median"])
+        self.assertGreater(result["items_per_second"], 0)
+        self.assertEqual(Message.objects.filter(chat_room__registered_by=user).count(), 10)
+
+        def broken_setup():
+            raise ImportError("missing module")
+        self.assertIn("missing module", measure(Case("broken", broken_setup), rounds=1).skipped)
+
+        previous = {"history_load_10": dict(result, median=result["median"] / 2), "gone": dict(result)}
+        rows = compare({"history_load_10": result}, previous, threshold=0.5)
+        self.assertEqual([(row["name"], row["regression"]) for row in rows], [("history_load_10", True)])
+
+
 class MessageInteractionAVTests(APITestCase):
     def setUp(self):
         self.user = create_test_user(username="user_interaction_tests")
@@ -291,4 +1418,257 @@ class MessageInteractionAVTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
         self.assertIn("interaction feature not available", response.data["error"].lower())
-        mock_get_object_or_404_in_view.assert_called_once_with(Message, uid=str(self.message_to_interact.uid))
\ No newline at end of file
+        mock_get_object_or_404_in_view.assert_called_once_with(Message, uid=str(self.message_to_interact.uid))
+
+class ChatImportAVTests(APITestCase):
+    def setUp(self):
+        self.user = create_test_user(username="user_import_tests")
+        self.client.force_authenticate(user=self.user)
+        self.import_url = reverse("chat-import")
+
+    def _post_ndjson(self, records):
+        body = "\n".join(json.dumps(record) for record in records)
+        return self.client.post(self.import_url, data=body, content_type="application/x-ndjson")
+
+    def test_import_ndjson_preserves_order_and_roles(self):
+        records = [
+            {
+                "title": "Imported chat",
+                "created_at": "2024-01-01T10:00:00Z",
+                "messages": [
+                    {"rol": "assistant", "text_message": "Second", "created_at": "2024-01-01T10:00:05Z"},
+                    {"rol": "user", "text_message": "First", "created_at": "2024-01-01T10:00:01Z"},
+                    {"rol": "assistant", "text_message": "Third"},
+                ],
+            },
+            {"title": "Empty chat"},
+        ]
+        response = self._post_ndjson(records)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["chats"], 2)
+        self.assertEqual(response.data["messages"], 3)
+
+        chat = Chat.objects.get(title="Imported chat")
+        self.assertEqual(chat.registered_by, self.user)
+        self.assertEqual(chat.created_at.isoformat(), "2024-01-01T10:00:00+00:00")
+        history = list(chat.chat_messages.order_by("created_at").values_list("rol", "text_message"))
+        self.assertEqual(history, [
+            (RolType.user, "First"),
+            (RolType.assistant, "Second"),
+            (RolType.assistant, "Third"),
+        ])
+
+    def test_import_invalid_record_writes_nothing(self):
+        records = [
+            {"title": "Valid chat", "messages": [{"rol": "user", "text_message": "Hi"}]},
+            {"title": "Invalid chat", "messages": [{"rol": "system", "text_message": ""}]},
+        ]
+        response = self._post_ndjson(records)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(response.data["error"]), 2)
+        self.assertFalse(Chat.objects.filter(registered_by=self.user).exists())
+
+    def test_import_command_reports_impossible_dates(self):
+        path = os.path.join(tempfile.mkdtemp(), "chats.ndjson")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path), ignore_errors=True)
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(json.dumps({"title": "ok"}) + "\n" + json.dumps({"created_at": "2024-02-30T00:00:00"}) + "\n")
+        with self.assertRaisesMessage(CommandError, "record 2: invalid created_at '2024-02-30T00:00:00'"):
+            call_command("import_conversations", path, "--user", self.user.username, stdout=io.StringIO())
+        self.assertFalse(Chat.objects.filter(registered_by=self.user).exists())
+
+    def test_import_malformed_ndjson(self):
+        response = self.client.post(self.import_url, data='{"title": "ok"}\n{broken', content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_import_in_several_batches(self):
+        from apps.chat.importers import ConversationImporter
+        records = [
+            {"messages": [{"rol": "user", "text_message": f"q{i}"}, {"rol": "assistant", "text_message": f"a{i}"}]}
+            for i in range(25)
+        ]
+        summary = ConversationImporter(user=self.user, batch_size=8).run(records)
+        self.assertEqual(summary["messages"], 50)
+        self.assertEqual(Message.objects.filter(chat_room__registered_by=self.user).count(), 50)
+
+
+class MessageInteractionBatchAVTests(APITestCase):
+    def setUp(self):
+        self.user = create_test_user(username="user_batch_interaction_tests")
+        self.other_user = create_test_user(username="other_batch_interaction_tests")
+        self.client.force_authenticate(user=self.user)
+
+        chat = Chat.objects.create(registered_by=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.messages = [
+                Message.objects.create(chat_room=chat, rol=RolType.assistant, text_message=f"Answer {i}")
+                for i in range(3)
+            ]
+        other_chat = Chat.objects.create(registered_by=self.other_user)
+        self.foreign_message = Message.objects.create(chat_room=other_chat, rol=RolType.assistant, text_message="Not yours")
+        self.url = reverse("message-interactions-batch")
+
+    def test_batch_updates_weights_in_bulk(self):
+        data = {"interactions": [
+            {"message_uid": str(self.messages[0].uid), "is_like": True},
+            {"message_uid": str(self.messages[1].uid), "is_like": False},
+            {"message_uid": str(self.messages[2].uid), "is_like": False},
+            {"message_uid": str(self.messages[2].uid), "is_like": True},
+        ]}
+        # SELECT de propiedad (con los mensajes) y UPDATE ... CASE; al confirmar, SELECT/UPDATE de la transcripción.
+        with self.captureOnCommitCallbacks() as callbacks, self.assertNumQueries(2):
+            updated = Message.bulk_update_weights(
+                self.user, {uuid.UUID(i["message_uid"]): i["is_like"] for i in data["interactions"]}
+            )
+        self.assertEqual(len(updated), 3)
+        with self.assertNumQueries(2):
+            for callback in callbacks:
+                callback()
+        entries = active_entries(bytes(ChatTranscript.objects.get(chat=self.messages[0].chat_room).data))
+        weights = {entry["uid"]: entry["weight"] for entry in entries}
+        self.assertEqual([weights[str(m.uid)] for m in self.messages],
+                         [Message.LIKE_WEIGHT, Message.DISLIKE_WEIGHT, Message.LIKE_WEIGHT])
+
+        Message.objects.update(weight=1)
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["updated"], 3)
+        weights = [Message.objects.get(pk=m.pk).weight for m in self.messages]
+        self.assertEqual(weights, [Message.LIKE_WEIGHT, Message.DISLIKE_WEIGHT, Message.LIKE_WEIGHT])
+
+    def test_batch_ignores_messages_of_other_users(self):
+        data = {"interactions": [{"message_uid": str(self.foreign_message.uid), "is_like": False}]}
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["updated"], 0)
+        self.assertEqual(response.data["not_found"], [str(self.foreign_message.uid)])
+        self.foreign_message.refresh_from_db()
+        self.assertEqual(self.foreign_message.weight, 1)
+
+    def test_batch_requires_interactions(self):
+        response = self.client.post(self.url, {"interactions": []}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update_weight_writes_only_weight_columns(self):
+        message = self.messages[0]
+        Message.objects.filter(pk=message.pk).update(text_message="Edited elsewhere")
+        message.update_weight(False)
+        message.refresh_from_db()
+        self.assertEqual(message.weight, Message.DISLIKE_WEIGHT)
+        self.assertEqual(message.text_message, "Edited elsewhere")
+
+
+class ChatSearchAVTests(APITestCase):
+    def setUp(self):
+        self.user = create_test_user(username="user_search_tests")
+        self.other_user = create_test_user(username="other_search_tests")
+        self.client.force_authenticate(user=self.user)
+
+        self.chat = Chat.objects.create(registered_by=self.user)
+        self.match = Message.objects.create(
+            chat_room=self.chat, rol=RolType.user, text_message="¿Qué sabes del bergantín que salió de Cádiz en 1850?"
+        )
+        Message.objects.create(chat_room=self.chat, rol=RolType.assistant, text_message="Hola, ¿en qué puedo ayudarte?")
+        self.titled_chat = Chat.objects.create(registered_by=self.user, title="Goletas de La Habana")
+        other_chat = Chat.objects.create(registered_by=self.other_user)
+        Message.objects.create(chat_room=other_chat, rol=RolType.user, text_message="El bergantín de Cádiz")
+        self.url = reverse("chat-search")
+
+    def _hits(self, query):
+        response = self.client.get(self.url, {"q": query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data["results"]["hits"]
+
+    def test_search_messages_is_scoped_and_highlighted(self):
+        hits = self._hits("bergantin cadiz")
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(hits[0]["message_uid"], str(self.match.uid))
+        self.assertEqual(hits[0]["chat_uid"], str(self.chat.uid))
+        self.assertIn("<mark>", hits[0]["snippet"])
+
+    def test_search_snippets_escape_the_message_html(self):
+        Message.objects.create(chat_room=self.chat, rol=RolType.user,
+                               text_message='La fragata <img src=x onerror="alert(1)"> llegó')
+        snippet = self._hits("fragata")[0]["snippet"]
+        self.assertNotIn("<img", snippet)
+        self.assertIn("&lt;img src=x onerror=&quot;alert(1)&quot;&gt;", snippet)
+        self.assertIn("<mark>fragata</mark>", snippet)
+
+    def test_search_matches_chat_titles(self):
+        hits = self._hits("goletas")
+        self.assertEqual([hit["kind"] for hit in hits], ["chat"])
+        self.assertEqual(hits[0]["chat_uid"], str(self.titled_chat.uid))
+
+    def test_search_follows_title_updates_and_soft_deletes(self):
+        self.chat.title = "Viajes a Cádiz"
+        self.chat.save()
+        self.assertEqual({hit["kind"] for hit in self._hits("cadiz")}, {"chat", "message"})
+        self.match.soft_delete()
+        self.assertEqual([hit["kind"] for hit in self._hits("bergantin")], [])
+
+    def test_search_requires_query(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SimilarQuestionsAVTests(APITestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+        settings_override = override_settings(CHAT_SEMANTIC_INDEX_DIR=self.index_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = create_test_user(username="user_similar_tests")
+        self.client.force_authenticate(user=self.user)
+        self.chat = Chat.objects.create(registered_by=self.user, title="Barcos")
+        self.url = reverse("chat-similar")
+
+    def _ask(self, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(chat_room=self.chat, rol=RolType.user, text_message=text)
+
+    def test_similar_questions_ranked_by_similarity(self):
+        target = self._ask("¿Qué barcos llegaron a La Habana en 1850?")
+        self._ask("Muéstrame un gráfico de capitanes por puerto")
+        self._ask("Hola, buenos días")
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(chat_room=self.chat, rol=RolType.assistant, text_message="Barcos llegaron en 1850")
+
+        response = self.client.get(self.url, {"q": "que barcos llegaron en 1850", "k": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]["message_uid"], str(target.uid))
+        self.assertGreater(results[0]["score"], results[1]["score"])
+
+    def test_soft_deleted_questions_are_hidden(self):
+        question = self._ask("¿Qué barcos llegaron en 1850?")
+        question.soft_delete()
+        response = self.client.get(self.url, {"q": "barcos 1850"})
+        self.assertEqual(response.data["results"], [])
+
+    def test_rebuild_swaps_the_shard_and_readers_reload_it(self):
+        from apps.chat.semantic import RECORD_DTYPE, semantic_index
+        first = self._ask("¿Qué barcos llegaron en 1850?")
+        second = self._ask("¿Qué goletas salieron de Cádiz?")
+        self.assertEqual(len(semantic_index.search(self.user.pk, "barcos", 5)), 2)  # shard cargado en memoria
+        first.soft_delete()
+        call_command("rebuild_semantic_index", user=self.user.username, stdout=io.StringIO())
+        path = semantic_index.shard_path(self.user.pk)
+        self.assertEqual(os.path.getsize(path), RECORD_DTYPE.itemsize)
+        self.assertEqual(os.listdir(self.index_dir), [os.path.basename(path)])  # sin temporales
+
+        # Mismo número de filas que el shard cargado: el lector detecta el cambio por el inodo, no por el tamaño.
+        third = self._ask("Capitanes de bergantines")
+        found = {uid for uid, _ in semantic_index.search(self.user.pk, "barcos goletas capitanes", 5)}
+        self.assertEqual(found, {second.uid.bytes, third.uid.bytes})
+
+    def test_imported_questions_are_indexed(self):
+        from apps.chat.importers import ConversationImporter
+        with self.captureOnCommitCallbacks(execute=True):
+            ConversationImporter(user=self.user).run([
+                {"messages": [{"rol": "user", "text_message": "Capitanes de goletas en Cádiz"}]},
+            ])
+        response = self.client.get(self.url, {"q": "goletas cadiz"})
+        self.assertEqual(response.data["results"][0]["text_message"], "Capitanes de goletas en Cádiz")
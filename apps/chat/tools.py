@@ -11,11 +11,116 @@ from django.core.files.storage import default_storage # Importar default_storage
 from django.conf import settings
 from langchain.tools import tool
 
+from apps.chat.cancellation import TurnCancelled, check_cancelled, on_cancel
+from apps.chat.metrics import timed
+from apps.chat.streaming import publish
+from apps.chat.tracing import traceparent
+from apps.utils.logs import Redacted
+
 logger = logging.getLogger(__name__)
 
 MAS_API_URL = getattr(settings, "MAS_API_URL", None)
 MAS_QUERY_ENDPOINT = "/api/query"
 MAS_IMAGE_UPLOAD_SUBDIR = getattr(settings, "MAS_IMAGE_UPLOAD_SUBDIR", "chat_images")
+MAS_STREAM_ACCEPT = "application/x-ndjson, text/event-stream;q=0.9, application/json;q=0.5"
+
+
+def save_base64_image(data_uri: str) -> str:
+    """ Decodes a ``data:image/...;base64,`` URI and saves it under MAS_IMAGE_UPLOAD_SUBDIR; returns the stored path. """
+    header, encoded_data = data_uri.split(",", 1)
+    with timed("image_decode"):
+        image_data_bytes = base64.b64decode(encoded_data)
+
+    extension = "png" # Default
+    mime_type_match = re.search(r"data:image/(\w+);base64", header)
+    if mime_type_match:
+        ext = mime_type_match.group(1).lower()
+        if ext in ['png', 'jpg', 'jpeg', 'gif', 'webp']: extension = ext
+        else: extension = "png" # Default si no es segura
+
+    filename_only = f"mas_viz_{uuid.uuid4()}.{extension}"
+    relative_upload_path = os.path.join(MAS_IMAGE_UPLOAD_SUBDIR, filename_only)
+
+    logger.info("Guardando archivo en: %s (relativo a MEDIA_ROOT)", relative_upload_path)
+    # default_storage.save devuelve la ruta relativa real donde se guardó
+    with timed("image_save"):
+        return default_storage.save(relative_upload_path, ContentFile(image_data_bytes))
+
+
+def store_mas_image(mas_base64_image, final_mas_response: dict):
+    """ Saves a MAS image into ``final_mas_response["image_path"]``; failures are appended to its ``error``. """
+    logger.info("Base64 de imagen recibido del MAS. Intentando guardar como archivo...")
+    try:
+        if isinstance(mas_base64_image, str) and ";base64," in mas_base64_image:
+            saved_file_path = save_base64_image(mas_base64_image)
+
+            # --- ¡ASIGNAR LA RUTA GUARDADA A LA RESPUESTA FINAL! ---
+            final_mas_response["image_path"] = "http://localhost:8000/media/"+saved_file_path # <--- ¡CORREGIDO AQUÍ!
+        else:
+            logger.warning("Formato Base64 inesperado del MAS.")
+            final_mas_response["error"] = (final_mas_response["error"] or "") + " Error procesando formato de imagen."
+    except Exception as img_e:
+        logger.exception(f"Error al guardar la imagen Base64 del MAS: {img_e}")
+        final_mas_response["error"] = (final_mas_response["error"] or "") + f" Error al procesar imagen: {str(img_e)}"
+
+
+def is_streamed_response(response) -> bool:
+    content_type = response.headers.get("Content-Type", "")
+    return "application/x-ndjson" in content_type or "text/event-stream" in content_type
+
+
+def iter_mas_chunks(response):
+    """
+    Decoded chunks of a streamed MAS answer: one JSON object per NDJSON line, or per
+    server-sent event (``data:`` lines; a ``[DONE]`` event ends the stream).
+    """
+    response.encoding = response.encoding or "utf-8"
+    if "text/event-stream" not in response.headers.get("Content-Type", ""):
+        for line in response.iter_lines(decode_unicode=True):
+            if line.strip():
+                yield json.loads(line)
+        return
+    data = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("data:"):
+            data.append(line[5:].removeprefix(" "))
+        elif not line and data:  # Una línea vacía cierra el evento.
+            event, data = "\n".join(data), []
+            if event.strip() == "[DONE]":
+                return
+            yield json.loads(event)
+    if data and "\n".join(data).strip() != "[DONE]":
+        yield json.loads("\n".join(data))
+
+
+def read_mas_stream(response, final_mas_response: dict):
+    """
+    Reads a streamed MAS answer into ``final_mas_response``. Chunks are ``{"type": "text", "delta"}``,
+    ``{"type": "image", "image_response"}``, ``{"type": "error", "error"}`` and ``{"type": "done"}``;
+    text deltas and saved images are forwarded to the client as they arrive (apps/chat/streaming.py).
+    """
+    text = []
+    for chunk in iter_mas_chunks(response):
+        check_cancelled("mas")  # El cliente se fue: no se sigue leyendo el MAS.
+        kind = chunk.get("type")
+        if kind == "text":
+            delta = chunk.get("delta") or ""
+            text.append(delta)
+            publish("mas_text", delta=delta)
+        elif kind == "image":
+            if final_mas_response["image_path"]:  # El mensaje sólo guarda una imagen.
+                logger.warning("El MAS envió más de una imagen; se conserva la primera.")
+                continue
+            store_mas_image(chunk.get("image_response"), final_mas_response)
+            if final_mas_response["image_path"]:
+                publish("mas_image", image_path=final_mas_response["image_path"])
+        elif kind == "error":
+            final_mas_response["error"] = chunk.get("error")
+        elif kind == "done":
+            break
+        else:
+            logger.debug("Fragmento desconocido del MAS ignorado: %s", Redacted(chunk))
+    final_mas_response["text_response"] = "".join(text) or None
 
 
 @tool
@@ -25,7 +130,7 @@ def query_historical_data_system(user_query: str) -> str:
     DO NOT use this tool for general questions, greetings, or any topic NOT directly related to maritime historical records.
     Input should be the user's exact query.
     """
-    logger.info(f"Tool 'query_historical_data_system' invoked with query: '{user_query}'")
+    logger.info("Tool 'query_historical_data_system' invoked with query: '%s'", Redacted(user_query))
     if not MAS_API_URL:
         logger.error("MAS_API_URL no está configurado en settings.py.")
         return json.dumps({"error": "Configuración incorrecta: El servicio de datos históricos no está disponible.", "text_response": None, "image_path": None})
@@ -41,58 +146,45 @@ def query_historical_data_system(user_query: str) -> str:
         "error": None
     }
 
+    streaming = getattr(settings, "MAS_STREAMING", True)
+    if streaming:  # El MAS puede responder por partes (NDJSON o SSE) o con el JSON de siempre.
+        headers["Accept"] = MAS_STREAM_ACCEPT
+
     try:
-        logger.debug(f"Enviando POST a MAS: {full_url} con payload: {payload}")
-        response = requests.post(full_url, headers=headers, json=payload, timeout=60)
+        check_cancelled("mas")
+        logger.debug("Enviando POST a MAS: %s con payload: %s", full_url, Redacted(payload))
+        with timed("mas_request"):
+            if traceparent():  # Propaga la traza del turno al MAS (W3C Trace Context).
+                headers["traceparent"] = traceparent()
+            response = requests.post(full_url, headers=headers, json=payload, timeout=60, stream=streaming)
         response.raise_for_status()
+        # Si el turno se cancela, cerrar la respuesta corta la conexión con el MAS y la lectura en curso.
+        unregister_close = on_cancel(response.close)
 
+        streamed = is_streamed_response(response)
         try:
-            mas_data = response.json()
-            logger.debug(f"Respuesta JSON cruda del MAS: {mas_data}")
-
-            # Asignar text_response y error del MAS si existen en el JSON
-            final_mas_response["text_response"] = mas_data.get("text_response")
-            final_mas_response["error"] = mas_data.get("error") # Error lógico del MAS
-
-            mas_base64_image = mas_data.get("image_response")
-
-            # --- Procesar y guardar la imagen si se recibió Base64 ---
-            if mas_base64_image:
-                logger.info("Base64 de imagen recibido del MAS. Intentando guardar como archivo...")
-                try:
-                    if isinstance(mas_base64_image, str) and ";base64," in mas_base64_image:
-                        header, encoded_data = mas_base64_image.split(",", 1)
-                        image_data_bytes = base64.b64decode(encoded_data)
-
-                        extension = "png" # Default
-                        mime_type_match = re.search(r"data:image/(\w+);base64", header)
-                        if mime_type_match:
-                            ext = mime_type_match.group(1).lower()
-                            if ext in ['png', 'jpg', 'jpeg', 'gif', 'webp']: extension = ext
-                            else: extension = "png" # Default si no es segura
-
-                        filename_only = f"mas_viz_{uuid.uuid4()}.{extension}"
-                        relative_upload_path = os.path.join(MAS_IMAGE_UPLOAD_SUBDIR, filename_only)
-
-                        logger.info(f"Guardando archivo en: {relative_upload_path} (relativo a MEDIA_ROOT)")
-                        # --- ¡AQUÍ ES DONDE SE GUARDA Y SE OBTIENE LA RUTA CORRECTA! ---
-                        saved_file_path = default_storage.save(relative_upload_path, ContentFile(image_data_bytes))
-                        # default_storage.save devuelve la ruta relativa real donde se guardó
+            if streamed:
+                with timed("mas_stream"):
+                    read_mas_stream(response, final_mas_response)
+                check_cancelled("mas")  # Un stream cortado por la cancelación puede acabar sin error.
+            else:
+                mas_data = response.json()
+                # Redacted: la imagen en base64 puede ocupar megas y sólo se formatea si DEBUG está activo.
+                logger.debug("Respuesta JSON cruda del MAS: %s", Redacted(mas_data))
 
+                # Asignar text_response y error del MAS si existen en el JSON
+                final_mas_response["text_response"] = mas_data.get("text_response")
+                final_mas_response["error"] = mas_data.get("error") # Error lógico del MAS
 
-                        # --- ¡ASIGNAR LA RUTA GUARDADA A LA RESPUESTA FINAL! ---
-                        final_mas_response["image_path"] = "http://localhost:8000/media/"+saved_file_path # <--- ¡CORREGIDO AQUÍ!
+                mas_base64_image = mas_data.get("image_response")
 
-                        # Ajustar text_response si solo era un mensaje genérico de "gráfico generado" del MAS
-                        if not final_mas_response["text_response"] or "visualizaci" in final_mas_response["text_response"].lower():
-                             final_mas_response["text_response"] = "Se generó una visualización para tu consulta." # Mensaje estándar
+                # --- Procesar y guardar la imagen si se recibió Base64 ---
+                if mas_base64_image:
+                    store_mas_image(mas_base64_image, final_mas_response)
 
-                    else:
-                        logger.warning("Formato Base64 inesperado del MAS.")
-                        final_mas_response["error"] = (final_mas_response["error"] or "") + " Error procesando formato de imagen."
-                except Exception as img_e:
-                    logger.exception(f"Error al guardar la imagen Base64 del MAS: {img_e}")
-                    final_mas_response["error"] = (final_mas_response["error"] or "") + f" Error al procesar imagen: {str(img_e)}"
+            # Ajustar text_response si solo era un mensaje genérico de "gráfico generado" del MAS
+            if final_mas_response["image_path"] and (not final_mas_response["text_response"] or "visualizaci" in final_mas_response["text_response"].lower()):
+                final_mas_response["text_response"] = "Se generó una visualización para tu consulta." # Mensaje estándar
 
             # Si hubo un error del MAS, pero también texto, el texto podría explicar el error
             # Esto lo dejamos como estaba, solo asegurando que use los campos de final_mas_response
@@ -102,22 +194,31 @@ def query_historical_data_system(user_query: str) -> str:
                 final_mas_response["text_response"] = f"Error del sistema de datos: {final_mas_response['error']}"
 
 
-        except json.JSONDecodeError:
-            logger.error(f"Fallo al decodificar JSON de MAS. Contenido: {response.text[:500]}...", exc_info=True)
+        except json.JSONDecodeError as e:
+            # Un stream ya consumido no se puede volver a leer: se registra sólo el fragmento inválido.
+            content = e.doc[:500] if streamed else response.text[:500]
+            logger.error(f"Fallo al decodificar JSON de MAS. Contenido: {content}...", exc_info=True)
             final_mas_response["error"] = "El servicio de datos devolvió un formato inválido."
             final_mas_response["text_response"] = "Información no disponible (formato inesperado)."
+        finally:
+            unregister_close()
+            response.close()
 
         # --- Devolver la respuesta final (que ahora incluye image_path si se guardó) ---
-        logger.debug(f"Herramienta finalizando, devolviendo JSON: {json.dumps(final_mas_response)}")
+        logger.debug("Herramienta finalizando, devolviendo JSON: %s", Redacted(final_mas_response))
         return json.dumps(final_mas_response)
 
     # ... (resto de los except para requests.exceptions y Exception) ...
+    except TurnCancelled:
+        logger.info("Consulta al MAS abortada: el cliente se desconectó.")
+        raise
     except requests.exceptions.Timeout:
         logger.error(f"Timeout (60s) al llamar al MAS en {full_url}", exc_info=True)
         final_mas_response["error"] = "Servicio de datos tardó demasiado."
         final_mas_response["text_response"] = "Información no disponible (timeout)."
         return json.dumps(final_mas_response)
     except requests.exceptions.ConnectionError:
+        check_cancelled("mas")  # La conexión la cerró la cancelación, no el MAS.
         logger.error(f"Error de conexión al llamar al MAS en {full_url}", exc_info=True)
         final_mas_response["error"] = "No se pudo conectar al servicio de datos."
         final_mas_response["text_response"] = "Información no disponible (error de conexión)."
@@ -129,6 +230,7 @@ def query_historical_data_system(user_query: str) -> str:
         final_mas_response["text_response"] = f"Información no disponible (error {e.response.status_code}): {error_detail}"
         return json.dumps(final_mas_response)
     except Exception as e:
+        check_cancelled("mas")
         logger.exception(f"Error inesperado llamando al MAS: {e}", exc_info=True)
         final_mas_response["error"] = f"Error inesperado contactando servicio de datos: {str(e)[:100]}"
         final_mas_response["text_response"] = "Información no disponible (error inesperado)."
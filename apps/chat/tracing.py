@@ -0,0 +1,185 @@
+#apps/chat/tracing.py
+"""
+Lightweight request tracing of the assistant turns (view, history, agent iterations, tools,
+MAS call, image save, inserts).
+
+``start_trace`` opens the root span of a turn and ``span`` the nested ones; the current span
+lives in a context variable, so ``metrics.timed`` blocks, the LangChain callbacks and the MAS
+tool nest under it without passing it around. The ids follow W3C Trace Context and
+``traceparent()`` is sent to the MAS so its spans can be joined with ours.
+
+Finished traces are appended as JSON lines (one span per line) to ``CHAT_TRACE_FILE``;
+``python manage.py trace_report <trace_id>`` prints the breakdown of one of them.
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+def trace_file() -> str:
+    return str(getattr(settings, "CHAT_TRACE_FILE", os.path.join(settings.BASE_DIR, "var", "traces.jsonl")))
+
+
+class Span:
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attrs: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._started
+            self.trace.spans.append(self)
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "attrs": self.attrs,
+        }
+
+
+class Trace:
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List[Span] = []
+
+
+_current_span: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("chat_trace_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_current_span(span: Optional[Span]):
+    """ For callbacks that open and close spans in different calls (no ``with`` block). """
+    _current_span.set(span)
+
+
+def _sampled(traceparent: Optional[str]):
+    """ (trace_id, parent_id) of a sampled turn, or None; an incoming ``traceparent`` decides by its flag. """
+    match = TRACEPARENT_RE.match((traceparent or "").strip().lower())
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        return (trace_id, parent_id) if int(flags, 16) & 1 else None
+    if random.random() >= getattr(settings, "CHAT_TRACE_SAMPLE_RATE", 1.0):
+        return None
+    return secrets.token_hex(16), None
+
+
+def start_trace(name: str, traceparent: Optional[str] = None, **attrs) -> Optional[Span]:
+    """ Opens the root span of a turn (None when it is not sampled); close it with ``finish_trace``. """
+    sampled = _sampled(traceparent) if getattr(settings, "CHAT_TRACING_ENABLED", False) else None
+    if sampled is None:
+        return None
+    trace_id, parent_id = sampled
+    root = Span(Trace(trace_id), name, parent_id, attrs)
+    _current_span.set(root)
+    return root
+
+
+def finish_trace(root: Optional[Span], **attrs):
+    if root is None:
+        return
+    root.set(**attrs)
+    root.end()
+    _current_span.set(None)
+    exporter.export(root.trace.spans)
+
+
+def start_span(name: str, **attrs) -> Optional[Span]:
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return Span(parent.trace, name, parent.span_id, attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """ ``with span("mas_request"): ...``; a no-op outside a sampled turn. """
+    child = start_span(name, **attrs)
+    if child is None:
+        yield None
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def traceparent() -> Optional[str]:
+    """ W3C ``traceparent`` header for outgoing calls made inside the current span. """
+    current = _current_span.get()
+    if current is None:
+        return None
+    return f"00-{current.trace.trace_id}-{current.span_id}-01"
+
+
+class JsonlSpanExporter:
+    """ Appends the spans of finished traces to a JSON lines file; rotates it once past ``max_bytes``. """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]):
+        path = trace_file()
+        lines = "".join(json.dumps(item.as_dict(), default=str) + "\n" for item in spans)
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.max_bytes and os.path.exists(path) and os.path.getsize(path) > self.max_bytes:
+                    os.replace(path, path + ".1")
+                with open(path, "a", encoding="utf-8") as handle:
+                    handle.write(lines)
+        except OSError as e:  # Las trazas nunca deben tumbar el turno.
+            logger.warning(f"Could not export trace spans to {path}: {e}")
+
+
+def read_spans(path: str, trace_id: Optional[str] = None):
+    """ Spans stored in ``path`` (and its rotated ``.1``), optionally only those of ``trace_id``. """
+    for candidate in (path + ".1", path):
+        if not os.path.exists(candidate):
+            continue
+        with open(candidate, encoding="utf-8") as handle:
+            for line in handle:
+                if trace_id and trace_id not in line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+                if not trace_id or item.get("trace_id") == trace_id:
+                    yield item
+
+
+exporter = JsonlSpanExporter(max_bytes=getattr(settings, "CHAT_TRACE_MAX_BYTES", 50 * 1024 * 1024))
@@ -0,0 +1,202 @@
+#apps/chat/transcripts.py
+"""
+Denormalized transcript of a chat: its history read from a single row.
+
+``ChatTranscript.data`` is an append-only log of segments. Each segment is a 4-byte length
+followed by a zlib-compressed JSON list of entries. An entry is a message as
+``MessageSerializer`` returns it plus ``weight`` and ``is_active``. Every insert,
+soft-delete or weight change appends the new state of the message. When the log is
+replayed, the last entry of each uid wins, and fields added to the serializer after an entry
+was written take their default (``ENTRY_DEFAULTS``). Once ``CHAT_TRANSCRIPT_COMPACT_SEGMENTS``
+segments pile up, the log is rewritten as one segment of the active messages.
+
+A chat's transcript is created with its first message insert after the feature is enabled
+(``CHAT_TRANSCRIPT_ENABLED``). Until then readers fall back to the ``Message`` table.
+``post_save`` appends once the write's transaction commits (``record_messages_on_commit``), in
+a short transaction of their own: a rollback discards them, and the transcript row is not
+locked while a turn waits for the agent. These appends run as robust ``on_commit`` callbacks;
+when one fails, the chat's transcript is deleted, so reads fall back to the table instead of
+serving a history without the turn (the next insert builds it again). ``MessageCreateAV`` appends the question and answer
+of a turn together after commit, in one locked read-modify-write. Bulk writes that skip
+``post_save`` call ``record_messages`` (or ``record_messages_on_commit``) themselves.
+``ConversationImporter`` only creates new chats, and they get their transcript with their
+next message. ``manage.py rebuild_transcripts`` checks the transcripts against the table and repairs drift.
+"""
+import json
+import logging
+import struct
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from apps.utils.enums import MessageStatus
+from .models import ChatTranscript, Message
+from .serializers import MessageSerializer
+
+logger = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct(">I")
+
+# Campos de la entrada que no forman parte de la respuesta del historial.
+STATE_FIELDS = ("weight", "is_active")
+
+# Valores de campos añadidos al serializador después de escribirse la entrada (transcripciones antiguas).
+ENTRY_DEFAULTS = {"status": MessageStatus.complete}
+
+
+def transcripts_enabled() -> bool:
+    return getattr(settings, "CHAT_TRANSCRIPT_ENABLED", True)
+
+
+def message_entry(message: Message) -> Dict:
+    entry = json.loads(json.dumps(MessageSerializer(message).data, cls=DjangoJSONEncoder))
+    entry["weight"] = message.weight
+    entry["is_active"] = message.is_active
+    return entry
+
+
+def history_item(entry: Dict) -> Dict:
+    """ The entry as ``MessageSerializer`` returns it. """
+    return {key: value for key, value in entry.items() if key not in STATE_FIELDS}
+
+
+def encode_segment(entries: List[Dict]) -> bytes:
+    payload = zlib.compress(json.dumps(entries, separators=(",", ":")).encode())
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def iter_segments(data: bytes) -> Iterator[List[Dict]]:
+    offset = 0
+    while offset < len(data):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        yield json.loads(zlib.decompress(data[offset:offset + length]))
+        offset += length
+
+
+def _order_key(entry: Dict):
+    return datetime.fromisoformat(entry["created_at"]), entry["uid"]
+
+
+def replay(data: bytes) -> List[Dict]:
+    """ Latest entry of every message in the log, in ``created_at`` order (soft-deleted included). """
+    latest = {}
+    for entries in iter_segments(data):
+        for entry in entries:
+            for key, value in ENTRY_DEFAULTS.items():
+                entry.setdefault(key, value)
+            latest[entry["uid"]] = entry
+    return sorted(latest.values(), key=_order_key)
+
+
+def active_entries(data: bytes) -> List[Dict]:
+    return [entry for entry in replay(data) if entry["is_active"]]
+
+
+def build_entries(chat_id) -> List[Dict]:
+    """ Entries of the active messages of the chat, from the ``Message`` table. """
+    messages = Message.objects.filter(chat_room_id=chat_id, is_active=True).order_by("created_at", "uid")
+    return sorted((message_entry(message) for message in messages), key=_order_key)
+
+
+def read_history(chat) -> Optional[List[Dict]]:
+    """ Active entries of the chat's transcript, or ``None`` when the chat has none (read the table). """
+    if not transcripts_enabled():
+        return None
+    data = ChatTranscript.objects.filter(chat_id=chat.pk).values_list("data", flat=True).first()
+    if data is None:
+        return None
+    return active_entries(bytes(data))
+
+
+def _append(chat_id, entries: List[Dict], create: bool):
+    # Sin savepoint: dentro de una transacción en bloque son dos consultas (SELECT ... FOR UPDATE y UPDATE).
+    with transaction.atomic(savepoint=False):
+        transcript = ChatTranscript.objects.select_for_update().filter(chat_id=chat_id).first()
+        if transcript is None:
+            if not create or not transcripts_enabled():
+                return
+            try:
+                with transaction.atomic():
+                    # La tabla ya incluye los mensajes recién guardados en esta transacción.
+                    ChatTranscript.objects.create(chat_id=chat_id, data=encode_segment(build_entries(chat_id)), segments=1)
+                return
+            except IntegrityError:  # Otra petición la creó a la vez.
+                transcript = ChatTranscript.objects.select_for_update().get(chat_id=chat_id)
+
+        data = bytes(transcript.data) + encode_segment(entries)
+        segments = transcript.segments + 1
+        if segments >= getattr(settings, "CHAT_TRANSCRIPT_COMPACT_SEGMENTS", 64):
+            data, segments = encode_segment(active_entries(data)), 1
+        ChatTranscript.objects.filter(pk=chat_id).update(data=data, segments=segments, updated_at=timezone.now())
+
+
+def record_messages(messages: Iterable[Message], create: bool = True):
+    """
+    Appends the current state of ``messages`` to the transcripts of their chats. ``create``
+    builds the transcript of a chat that has none; otherwise such chats are skipped.
+    """
+    for chat_id, entries in _entries_by_chat(messages).items():
+        _append(chat_id, entries, create)
+
+
+def record_committed_messages(messages: Iterable[Message], create: bool = True):
+    """
+    ``record_messages`` for messages already committed (from ``on_commit``): a chat whose
+    append fails loses its transcript instead of keeping one without these messages.
+    """
+    _append_or_drop(_entries_by_chat(messages), create)
+
+
+def record_messages_on_commit(messages: Iterable[Message], create: bool = True):
+    """ ``record_committed_messages`` once the current transaction commits; the entries are taken now. """
+    by_chat = _entries_by_chat(messages)
+    # robust: un fallo aquí no deja sin ejecutar los demás callbacks de la transacción.
+    transaction.on_commit(lambda: _append_or_drop(by_chat, create), robust=True)
+
+
+def _append_or_drop(by_chat: Dict, create: bool):
+    for chat_id, entries in by_chat.items():
+        try:
+            _append(chat_id, entries, create)
+        except Exception:
+            logger.exception("Transcript append failed for chat %s; dropping its transcript.", chat_id)
+            drop_transcript(chat_id)
+
+
+def drop_transcript(chat_id):
+    """ Deletes the chat's transcript: its history is read from the table until the next insert rebuilds it. """
+    try:
+        ChatTranscript.objects.filter(chat_id=chat_id).delete()
+    except Exception:
+        logger.exception("Could not drop the transcript of chat %s; run manage.py rebuild_transcripts.", chat_id)
+
+
+def _entries_by_chat(messages: Iterable[Message]) -> Dict:
+    by_chat = defaultdict(list)
+    for message in messages:
+        by_chat[message.chat_room_id].append(message_entry(message))
+    return by_chat
+
+
+def check_transcript(chat_id) -> bool:
+    """ ``True`` when the chat's transcript matches the table (or the chat has none). """
+    data = ChatTranscript.objects.filter(chat_id=chat_id).values_list("data", flat=True).first()
+    if data is None:
+        return True
+    return active_entries(bytes(data)) == build_entries(chat_id)
+
+
+def rebuild_transcript(chat_id):
+    """ Rewrites the chat's transcript from the table (creating it if needed). """
+    with transaction.atomic():
+        ChatTranscript.objects.select_for_update().filter(chat_id=chat_id).first()
+        ChatTranscript.objects.update_or_create(
+            chat_id=chat_id, defaults={"data": encode_segment(build_entries(chat_id)), "segments": 1},
+        )
@@ -1,12 +1,20 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path, include
-from .views import ChatViewSet, MessageCreateAV, MessageInteractionAV
+from .views import ChatViewSet, ChatImportAV, ChatSearchAV, SimilarQuestionsAV, LLMLimiterStatusAV, BulkheadStatusAV, MetricsAV, MessageCreateAV, MessageBatchAV, MessageInteractionAV, MessageInteractionBatchAV
 
 router = DefaultRouter()
 router.register(r'chats', ChatViewSet, basename='chats')  # Agrega basename
 
 urlpatterns = [
+    path('chats/import/', ChatImportAV.as_view(), name='chat-import'),  # Antes del router para no chocar con chats/<pk>/
+    path('chats/search/', ChatSearchAV.as_view(), name='chat-search'),
+    path('chats/similar/', SimilarQuestionsAV.as_view(), name='chat-similar'),
     path('', include(router.urls)),
     path('chats/<uuid:pk>/messages/', MessageCreateAV.as_view(), name='chat-messages'),  # Agregar name
+    path('chats/<uuid:pk>/messages/batch/', MessageBatchAV.as_view(), name='chat-messages-batch'),
     path('chats/<uuid:chat_uid>/messages/interaction/', MessageInteractionAV.as_view(), name='chat-interaction'),  # Agregar name
+    path('messages/interactions/', MessageInteractionBatchAV.as_view(), name='message-interactions-batch'),
+    path('status/llm/', LLMLimiterStatusAV.as_view(), name='llm-limiter-status'),
+    path('status/bulkhead/', BulkheadStatusAV.as_view(), name='bulkhead-status'),
+    path('metrics/', MetricsAV.as_view(), name='metrics'),
 ]
\ No newline at end of file
@@ -4,23 +4,53 @@ from rest_framework import status, viewsets
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
-from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.exceptions import ParseError, PermissionDenied, Throttled, ValidationError
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from django.conf import settings
 # from django.core.files.base import ContentFile # No parece usarse
-from django.http import Http404 # <--- AÑADIDO
+from django.http import Http404, HttpResponse # <--- AÑADIDO
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from apps.chat.validators import ChatValidators
+from apps.chat.answer_cache import CachedAnswer, answer_cache, is_context_free
+from apps.chat.cancellation import CLIENT_CLOSED_REQUEST, TurnCancelled, check_cancelled
+from apps.chat.llm_limiter import llm_limiter
+from apps.chat.metrics import (
+    current_turn, finish_turn, record_cancellation, record_step, registry, render_gauges, start_turn, timed,
+    turn_status,
+)
+from apps.chat.tracing import finish_trace, start_trace
+from apps.chat.idempotency import run_once
+from apps.chat.importers import ConversationImporter, bulk_insert_rows
+from apps.chat.search import ConversationSearch
+from apps.chat.semantic import index_user_messages, semantic_index
+from apps.chat.response_cache import ResponseCacheMixin, bump_chat, bump_user, chat_scope, response_cache
+from apps.chat.signals import messages_recorded_by_caller
+from apps.chat.streaming import TurnEventStream, ndjson_response, publish
+from apps.chat.transcripts import history_item, read_history, record_committed_messages, record_messages
 from apps.utils.paginations import MediumSetPagination
-from apps.utils.enums import RolType
+from apps.utils.parsers import NDJSONParser
+from apps.utils.logs import Redacted, dropped_records
+from apps.utils.db_router import ReplicaReadsMixin
+from apps.utils.middleware import bulkhead_stats
+from apps.utils.permissions import HasMetricsToken, IsSuperUser
+from apps.utils.enums import MessageStatus, RolType
 from .models import Chat, Message
 # from rest_framework import serializers # No es necesario si no se usa directamente aquí
-from .serializers import ChatSerializer, ChatDetailSerializer, MessageSerializer
+from .serializers import ChatSerializer, ChatDetailSerializer, MessageSerializer, MessageInteractionBatchSerializer, MessageBatchSerializer
 # import base64 # No parece usarse
+import contextvars
 import json
 import traceback
+import uuid
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import timedelta
 # import re # No parece usarse
-# import uuid # No parece usarse
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +77,61 @@ except Exception as e:
     def load_langchain_history_from_db(*args, **kwargs): raise NotImplementedError("LangChain history loader unavailable.")
     LANGCHAIN_SETUP_SUCCESSFUL = False
 
+def chat_title_from_first_message(chat, text):
+    """ (title, description) of an untitled chat, taken from its first question. """
+    title = (text[:50].strip() + '...') if len(text) > 50 else text.strip()
+    description = (text[:100].strip() + '...') if len(text) > 100 else text.strip()
+    return title or f"Chat {str(chat.uid)[:8]}", description or f"Chat session {str(chat.uid)[:8]}"
+
+
+def load_answer_weights(message_uids):
+    """ Live weights of cached answers; deleted messages or chats are left out. """
+    return dict(
+        Message.objects.filter(uid__in=message_uids, is_active=True, chat_room__is_active=True)
+        .values_list("uid", "weight")
+    )
+
+
+NO_ANSWER_TEXT = "No se recibió una respuesta válida del asistente."
+ABORTED_TEXT = "Respuesta cancelada: el cliente se desconectó antes de que terminara."
+
+
+def invoke_agent(history_for_agent, user_input_text):
+    """
+    Runs the agent for one question behind the LLM limiter (``Throttled`` when its queue is
+    full) and records the route of the current turn. ``TurnCancelled`` when the client went away.
+    """
+    from langchain_core.messages import HumanMessage
+    from apps.chat.callbacks import CancellationCallbackHandler, TurnMetricsCallbackHandler
+    agent_input_data = {
+        "chat_history": history_for_agent,
+        "user_input": HumanMessage(content=user_input_text),
+    }
+    # Limita las llamadas concurrentes al LLM; si la cola está llena lanza Throttled (429).
+    check_cancelled("llm_queue")
+    with llm_limiter.slot() as waited:
+        record_step("llm_queue", waited)
+        check_cancelled("llm_queue")  # El cliente se fue mientras esperaba turno: el hueco se libera ya.
+        with timed("agent"):
+            result = agent_executor.invoke(agent_input_data, config={
+                "callbacks": [TurnMetricsCallbackHandler(), CancellationCallbackHandler()],
+            })
+    current_turn().route = result.get("intent", "agent")
+    return result
+
+
+def mas_result_from_steps(result) -> Optional[Dict[str, Any]]:
+    """ Parsed JSON of the first MAS tool call of an agent result, if there was one. """
+    for action, observation in result.get("intermediate_steps") or []:
+        if getattr(action, 'tool', None) == "query_historical_data_system":
+            try:
+                return json.loads(observation)
+            except Exception: # Ser más específico si es posible
+                logger.error(f"Failed to parse tool observation: {observation}", exc_info=True)
+                return None
+    return None
+
+
 def handle_exceptions(func):
     """
     Decorator to handle common exceptions in ChatViewSet views.
@@ -78,6 +163,12 @@ def handle_exceptions(func):
                 {"error": e.detail if hasattr(e, 'detail') else str(e)},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+        except ParseError as e: # Cuerpo JSON/NDJSON mal formado
+            logger.warning(f"ParseError caught in handle_exceptions decorator: {e.detail}")
+            return Response(
+                {"error": e.detail},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
         except ValueError as e: # Genérico de Python
             logger.warning(f"ValueError caught in handle_exceptions decorator: {e}", exc_info=True)
             return Response(
@@ -93,14 +184,20 @@ def handle_exceptions(func):
     return wrapper
 
 
-class ChatViewSet(viewsets.ModelViewSet):
+class ChatViewSet(ResponseCacheMixin, ReplicaReadsMixin, viewsets.ModelViewSet):
+    replica_read_actions = ("list", "retrieve")
     queryset = Chat.objects.filter(is_active=True)
     serializer_class = ChatSerializer
     permission_classes = [IsAuthenticated]
 
     @handle_exceptions # El decorador ahora maneja Http404, PermissionDenied, ValidationError
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset().filter(registered_by=request.user).order_by('-created_at')
+        cached = response_cache.lookup(request, "chat-list", [("list", request.user.pk)])
+        if cached is not None:
+            return cached
+        # Una consulta sobre chat_recent_activity_idx (más el COUNT del paginador); el autor viene en el JOIN.
+        queryset = (self.get_queryset().filter(registered_by=request.user).select_related("registered_by")
+                    .order_by('-last_message_at', '-created_at'))
         paginator = MediumSetPagination()
         paginated_queryset = paginator.paginate_queryset(queryset, request)
         serializer = self.get_serializer(paginated_queryset, many=True)
@@ -115,6 +212,9 @@ class ChatViewSet(viewsets.ModelViewSet):
 
     @handle_exceptions # El decorador ahora maneja Http404, PermissionDenied
     def retrieve(self, request, *args, **kwargs):
+        cached = response_cache.lookup(request, "chat-detail", [chat_scope(kwargs.get(self.lookup_field))])
+        if cached is not None:
+            return cached
         instance = self.get_object() # Puede lanzar Http404 si no se encuentra (DRF lo hace)
         if instance.registered_by != request.user:
             # Esto debería ser manejado por DRF o por un validador,
@@ -145,7 +245,141 @@ class ChatViewSet(viewsets.ModelViewSet):
         )
 
 
-class MessageCreateAV(APIView):
+class ChatImportAV(APIView):
+    """
+    Bulk import of chats and messages for the authenticated user.
+    Accepts NDJSON (one chat per line) or a JSON list with the same records.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [NDJSONParser, JSONParser]
+
+    @handle_exceptions
+    def post(self, request, *args, **kwargs):
+        records = request.data
+        if not isinstance(records, list):
+            raise ValidationError("Expected NDJSON records or a JSON list of chats.")
+        summary = ConversationImporter(user=request.user).run(records)
+        logger.info(f"Imported {summary['chats']} chats / {summary['messages']} messages for user {request.user.pk}.")
+        return Response(summary, status=status.HTTP_201_CREATED)
+
+
+class ChatSearchAV(APIView):
+    """
+    Ranked full-text search over the user's messages and chat titles: ``GET /api/chats/search/?q=...``.
+    Each hit carries a highlighted ``snippet`` (matches wrapped in <mark>).
+    """
+    permission_classes = [IsAuthenticated]
+
+    @handle_exceptions
+    def get(self, request, *args, **kwargs):
+        text = request.query_params.get("q", "").strip()
+        if not text:
+            raise ValidationError("Query parameter 'q' is required.")
+        results = ConversationSearch(request.user, text)
+        paginator = MediumSetPagination()
+        hits = paginator.paginate_queryset(results, request)
+        return paginator.get_paginated_response({"hits": hits})
+
+
+class SimilarQuestionsAV(APIView):
+    """
+    Semantic "similar questions I've asked before": ``GET /api/chats/similar/?q=...&k=5``.
+    Runs on the local per-user vector shard (see apps/chat/semantic.py).
+    """
+    permission_classes = [IsAuthenticated]
+    max_results = 50
+
+    @handle_exceptions
+    def get(self, request, *args, **kwargs):
+        text = request.query_params.get("q", "").strip()
+        if not text:
+            raise ValidationError("Query parameter 'q' is required.")
+        k = min(int(request.query_params.get("k", 5)), self.max_results)  # ValueError -> 400
+        if k < 1:
+            raise ValidationError("Query parameter 'k' must be positive.")
+
+        # Se piden candidatos de más: los mensajes borrados siguen en el shard hasta reconstruirlo.
+        candidates = semantic_index.search(request.user.pk, text, k * 3)
+        scores = {uuid.UUID(bytes=uid): score for uid, score in candidates}
+        rows = Message.objects.filter(
+            uid__in=list(scores), is_active=True,
+            chat_room__registered_by=request.user, chat_room__is_active=True,
+        ).values("uid", "text_message", "created_at", "chat_room_id", "chat_room__title")
+        results = sorted(
+            (
+                {
+                    "message_uid": str(row["uid"]),
+                    "chat_uid": str(row["chat_room_id"]),
+                    "chat_title": row["chat_room__title"],
+                    "text_message": row["text_message"],
+                    "created_at": row["created_at"],
+                    "score": round(scores[row["uid"]], 4),
+                }
+                for row in rows
+            ),
+            key=lambda result: -result["score"],
+        )[:k]
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class LLMLimiterStatusAV(APIView):
+    """
+    In-flight calls, queue depth and wait times of the outbound LLM limiter (this process).
+    """
+    permission_classes = [IsSuperUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(llm_limiter.stats(), status=status.HTTP_200_OK)
+
+
+class BulkheadStatusAV(APIView):
+    """
+    In-flight, admitted and shed requests per bulkhead class (this process).
+    """
+    permission_classes = [IsSuperUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(bulkhead_stats(), status=status.HTTP_200_OK)
+
+
+class MetricsAV(APIView):
+    """
+    Prometheus text exposition of the turn metrics plus the limiter and bulkhead gauges (this process).
+    """
+    permission_classes = [HasMetricsToken]
+
+    def get(self, request, *args, **kwargs):
+        limiter = llm_limiter.stats()
+        bulkheads = bulkhead_stats()
+        body = "".join([
+            registry.render(),
+            render_gauges("chat_llm_in_flight", "Outbound LLM calls in flight.", [({}, limiter["in_flight"])]),
+            render_gauges("chat_llm_queue_depth", "Calls waiting in the LLM limiter queue.", [({}, limiter["queue_depth"])]),
+            render_gauges("chat_llm_avg_wait_seconds", "Moving average of the LLM limiter wait.", [({}, limiter["avg_wait_seconds"])]),
+            render_gauges("log_records_dropped", "Log records dropped because the async logging queue was full.",
+                          [({}, dropped_records())]),
+            render_gauges("http_bulkhead_in_flight", "Requests in flight per bulkhead class.",
+                          [({"bulkhead": name}, stats["in_flight"]) for name, stats in bulkheads.items()]),
+        ])
+        return HttpResponse(body, content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def record_turn(owner_id, chat_id, messages):
+    """
+    Appends the messages of a turn to the chat's transcript and activity columns, one write each,
+    then bumps the chat's cached responses (``update()`` sends no ``post_save``).
+    """
+    try:
+        record_committed_messages(messages)
+        Chat.record_new_messages(chat_id, messages)
+    finally:
+        bump_chat(owner_id, chat_id)
+
+
+# Sin ATOMIC_REQUESTS: el turno abre su propia transacción (run_once / tracked_turn) y la confirma
+# antes de que la respuesta se guarde para los reintentos (apps/chat/idempotency.py).
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
+class MessageCreateAV(ResponseCacheMixin, ReplicaReadsMixin, APIView):
     permission_classes = [IsAuthenticated]
     serializer_class = MessageSerializer
     chat_validator = ChatValidators()
@@ -154,11 +388,19 @@ class MessageCreateAV(APIView):
         chat_uid = kwargs.get('pk')
         if not chat_uid:
              return Response({"error": "Chat UID not provided in URL."}, status=status.HTTP_400_BAD_REQUEST)
+        # Repetir la lectura no toca la base de datos (apps/chat/response_cache.py).
+        cached = response_cache.lookup(request, "chat-history", [chat_scope(chat_uid)])
+        if cached is not None:
+            return cached
         try:
             # get_object_or_404 lanza Http404, que DRF convierte a una respuesta 404.
             chat = get_object_or_404(Chat, uid=chat_uid)
             self.chat_validator.validate(chat=chat, request=request) # Puede lanzar PermissionDenied
 
+            # Una sola fila (apps/chat/transcripts.py); sin transcripción se lee la tabla de mensajes.
+            entries = read_history(chat)
+            if entries is not None:
+                return Response({"history": [history_item(entry) for entry in entries]}, status=status.HTTP_200_OK)
             queryset = Message.objects.filter(chat_room=chat, is_active=True).order_by('created_at')
             serializer = self.serializer_class(queryset, many=True)
             return Response({"history": serializer.data}, status=status.HTTP_200_OK)
@@ -177,6 +419,51 @@ class MessageCreateAV(APIView):
             return Response({"error": "An unexpected error occurred retrieving history."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def post(self, request, *args, **kwargs):
+        # `?stream=1`: la respuesta es NDJSON con el texto parcial del MAS mientras el turno avanza.
+        # Un reintento (misma Idempotency-Key o mismo texto seguido) recibe la respuesta del primer envío.
+        turn = lambda: run_once(request, kwargs.get('pk'), lambda: self.tracked_turn(request, *args, **kwargs))
+        if request.query_params.get("stream") in ("1", "true"):
+            return ndjson_response(request, TurnEventStream(turn, keepalive=getattr(settings, "CHAT_STREAM_KEEPALIVE", 15)))
+        return turn()
+
+    def tracked_turn(self, request, *args, **kwargs):
+        # Tiempos y consumo del turno: se guardan en Message.stats y alimentan /api/metrics/.
+        # La traza del turno continúa la del cliente si envía `traceparent`.
+        turn_token = start_turn()
+        root_span = start_trace("MessageCreateAV.post", traceparent=request.headers.get("traceparent"),
+                                chat_uid=str(kwargs.get('pk')))
+        response = None
+        try:
+            # El turno corre en una transacción (la de run_once, o una propia si no hay nada que
+            # reservar): un 429 la deshace entera y el reintento no duplica la pregunta ni el título.
+            with transaction.atomic(savepoint=False), messages_recorded_by_caller():
+                response = self.create_turn(request, *args, **kwargs)
+            if root_span is not None:
+                response["X-Trace-Id"] = root_span.trace.trace_id
+            return response
+        finally:
+            status_code = getattr(response, "status_code", None)
+            turn = current_turn()
+            finish_trace(root_span, status_code=status_code, route=turn.route if turn else None)
+            finish_turn(turn_token, status=turn_status(status_code))
+
+    def aborted_turn(self, chat, cancelled: TurnCancelled, turn_messages):
+        """ The question stays in the history; the assistant turn is saved as ``aborted``. """
+        record_cancellation(cancelled.stage, cancelled.reason)
+        logger.info(f"Turn of chat {chat.uid} cancelled at {cancelled.stage} ({cancelled.reason}).")
+        with timed("db_write"):
+            assistant_message_instance = Message.objects.create(
+                chat_room=chat,
+                rol=RolType.assistant,
+                text_message=ABORTED_TEXT,
+                status=MessageStatus.aborted,
+                stats=current_turn().as_dict(),
+            )
+        turn_messages.append(assistant_message_instance)
+        response_serializer = self.serializer_class(assistant_message_instance)
+        return Response({"message": response_serializer.data}, status=CLIENT_CLOSED_REQUEST)
+
+    def create_turn(self, request, *args, **kwargs):
         if not LANGCHAIN_SETUP_SUCCESSFUL:
              logger.error("LangChain setup unsuccessful, MessageCreateAV.post returning 503.")
              return Response(
@@ -195,56 +482,86 @@ class MessageCreateAV(APIView):
             chat = get_object_or_404(Chat.objects.filter(registered_by=request.user, is_active=True), uid=chat_uid)
             # El validador podría ser redundante si el get_object_or_404 ya verifica la pertenencia.
             # self.chat_validator.validate(request, chat) # Si este validador hace más cosas, mantenlo.
-            logger.debug(f"Chat {chat.uid} validation successful for post.")
+            logger.debug("Chat %s validation successful for post.", chat.uid)
 
-            chat_has_title = bool(chat.title)
             serializer = self.serializer_class(data=request.data, context={'request': request})
             # is_valid(raise_exception=True) lanza ValidationError, DRF lo convierte a 400.
             serializer.is_valid(raise_exception=True)
-            user_message_instance = serializer.save(chat_room=chat, rol=RolType.user)
-            user_input_text = user_message_instance.text_message
-            logger.info(f"User message saved (UID: {user_message_instance.uid}) in chat {chat.uid}.")
-
-            if not chat_has_title:
-                 active_messages_count = Message.objects.filter(chat_room=chat, is_active=True).count()
-                 if active_messages_count == 1:
-                    chat.title = (user_input_text[:50].strip() + '...') if len(user_input_text) > 50 else user_input_text.strip()
-                    chat.description = (user_input_text[:100].strip() + '...') if len(user_input_text) > 100 else user_input_text.strip()
-                    if not chat.title: chat.title = f"Chat {chat.uid[:8]}"
-                    if not chat.description: chat.description = f"Chat session {chat.uid[:8]}"
-                    chat.save()
-                    logger.info(f"Chat title updated to: '{chat.title}'")
 
+            # El historial se lee ANTES de guardar la pregunta: así no hay que releerla ni
+            # contar mensajes para saber si es el primer turno del chat.
             try:
-                 all_langchain_history = load_langchain_history_from_db(chat)
-                 # ... (resto de la lógica de carga de historial) ...
-                 if all_langchain_history and all_langchain_history[-1].type == 'human' and all_langchain_history[-1].content.strip() == user_input_text.strip():
-                      agent_user_input_lc_message = all_langchain_history[-1]
-                      history_for_agent = all_langchain_history[:-1]
-                 else:
-                      from langchain.schema import HumanMessage
-                      agent_user_input_lc_message = HumanMessage(content=user_input_text)
-                      history_for_agent = []
+                with timed("history"):
+                    history_for_agent = load_langchain_history_from_db(chat)
+                is_first_message = not history_for_agent
             except Exception as e:
-                 logger.error(f"Error loading history: {e}", exc_info=True)
-                 from langchain.schema import HumanMessage
-                 agent_user_input_lc_message = HumanMessage(content=user_input_text)
-                 history_for_agent = []
-
-            agent_input_data = {
-                "chat_history": history_for_agent,
-                "user_input": agent_user_input_lc_message,
-            }
+                logger.error(f"Error loading history: {e}", exc_info=True)
+                history_for_agent = []
+                is_first_message = not Message.objects.filter(chat_room=chat, is_active=True).exists()
+
+            with timed("db_write"):
+                user_message_instance = serializer.save(chat_room=chat, rol=RolType.user)
+            user_input_text = user_message_instance.text_message
+            logger.info("User message saved (UID: %s) in chat %s.", user_message_instance.uid, chat.uid)
+            # La respuesta se añade al guardarse: al confirmar, una sola escritura de transcripción y actividad por turno.
+            turn_messages = [user_message_instance]
+            # robust: si falla, la respuesta ya está guardada y los demás callbacks (título, caché) se ejecutan igual.
+            transaction.on_commit(lambda: record_turn(chat.registered_by_id, chat.pk, turn_messages), robust=True)
+
+            if is_first_message and not chat.title:
+                title, description = chat_title_from_first_message(chat, user_input_text)
+
+                def set_title():
+                    # Un solo UPDATE condicional: no pisa un título puesto por otra petición entre tanto.
+                    if Chat.objects.filter(Q(title__isnull=True) | Q(title=""), pk=chat.pk).update(
+                        title=title, description=description, updated_at=timezone.now(),
+                    ):
+                        logger.info("Chat title updated to: '%s'", title)
+                        bump_chat(chat.registered_by_id, chat.pk)
+                # Al confirmar: la fila del chat no queda bloqueada mientras se espera al agente.
+                transaction.on_commit(set_title, robust=True)
+
+            # Caché de respuestas del usuario: sólo para primeras preguntas o preguntas sin referencias al contexto.
+            use_answer_cache = getattr(settings, "CHAT_ANSWER_CACHE_ENABLED", True) and (
+                not history_for_agent or is_context_free(user_input_text)
+            )
+            if use_answer_cache:
+                with timed("answer_cache"):
+                    cached = answer_cache.get(request.user.pk, user_input_text, load_answer_weights)
+                if cached is not None:
+                    current_turn().route = "cache"
+                    with timed("db_write"):
+                        assistant_message_instance = Message.objects.create(
+                            chat_room=chat,
+                            rol=RolType.assistant,
+                            text_message=cached.text_message,
+                            image=cached.image,
+                            stats=current_turn().as_dict(),
+                        )
+                    turn_messages.append(assistant_message_instance)
+                    logger.info("Answer cache hit for chat %s (source message %s).", chat.uid, cached.message_uid)
+                    response_serializer = self.serializer_class(assistant_message_instance)
+                    return Response(
+                        {"message": response_serializer.data},
+                        status=status.HTTP_201_CREATED,
+                        headers={"X-Answer-Cache": "hit"},
+                    )
 
             try:
-                logger.info(f"Invoking agent_executor for chat {chat.uid}...")
-                result = agent_executor.invoke(agent_input_data)
-                logger.debug(f"Full agent_executor result: {result}")
+                logger.info("Invoking agent_executor for chat %s...", chat.uid)
+                result = invoke_agent(history_for_agent, user_input_text)
+                logger.debug("Full agent_executor result: %s", Redacted(result))
                 if "intermediate_steps" in result:
-                    logger.debug(f"Intermediate steps: {result['intermediate_steps']}")
+                    logger.debug("Intermediate steps: %s", Redacted(result['intermediate_steps']))
                 else:
                     logger.warning("No 'intermediate_steps' found in agent_executor result.")
-                logger.info(f"Agent invocation complete for chat {chat.uid}.")
+                logger.info("Agent invocation complete for chat %s (intent: %s).", chat.uid, result.get('intent', 'agent'))
+            except Throttled as e: # Cola del limitador llena: respuesta rápida en lugar de un timeout
+                 transaction.set_rollback(True)  # El turno no ocurrió: ni pregunta ni título guardados.
+                 return Response({"error": e.detail}, status=status.HTTP_429_TOO_MANY_REQUESTS,
+                                 headers={"Retry-After": str(e.wait)})
+            except TurnCancelled as e: # El cliente se fue: no se gasta más en una respuesta que nadie leerá
+                return self.aborted_turn(chat, e, turn_messages)
             except NotImplementedError: # Langchain dummy function
                  logger.error("LangChain agent_executor not implemented.", exc_info=True)
                  return Response({"error": "El asistente IA no está disponible."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
@@ -254,18 +571,8 @@ class MessageCreateAV(APIView):
                                 status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
             # ... (resto de la lógica de procesamiento de LangChain y guardado de mensaje) ...
-            agent_final_text_output = result.get('output', "No se recibió una respuesta válida del asistente.")
-            mas_tool_result_dict: Optional[Dict[str, Any]] = None
-            if "intermediate_steps" in result and result["intermediate_steps"]:
-                for step in result["intermediate_steps"]:
-                    action, observation = step
-                    tool_name = getattr(action, 'tool', None)
-                    if tool_name == "query_historical_data_system":
-                        try:
-                            mas_tool_result_dict = json.loads(observation)
-                        except Exception: # Ser más específico si es posible
-                            logger.error(f"Failed to parse tool observation: {observation}", exc_info=True)
-                        break
+            agent_final_text_output = result.get('output', NO_ANSWER_TEXT)
+            mas_tool_result_dict = mas_result_from_steps(result)
             mas_image_path_from_tool = mas_tool_result_dict.get('image_path') if mas_tool_result_dict else None
 
             assistant_message_instance = Message(
@@ -273,9 +580,23 @@ class MessageCreateAV(APIView):
                 rol=RolType.assistant,
                 text_message=agent_final_text_output,
                 image=mas_image_path_from_tool,
+                stats=current_turn().as_dict(),
             )
-            assistant_message_instance.save()
-            logger.info(f"Assistant message saved (ID: {assistant_message_instance.uid}).")
+            with timed("db_write"):
+                assistant_message_instance.save()
+            turn_messages.append(assistant_message_instance)
+            logger.info("Assistant message saved (ID: %s).", assistant_message_instance.uid)
+
+            # Sólo se guardan respuestas de primeros turnos: las demás pueden depender de la conversación.
+            # Al confirmar: antes, una búsqueda no encontraría el mensaje y tras un rollback no existiría.
+            if use_answer_cache and not history_for_agent and "output" in result \
+                    and not (mas_tool_result_dict or {}).get("error"):
+                answer = CachedAnswer(
+                    message_uid=assistant_message_instance.uid,
+                    text_message=assistant_message_instance.text_message,
+                    image=assistant_message_instance.image,
+                )
+                transaction.on_commit(lambda: answer_cache.put(request.user.pk, user_input_text, answer), robust=True)
 
             response_serializer = self.serializer_class(assistant_message_instance)
             return Response({"message": response_serializer.data}, status=status.HTTP_201_CREATED)
@@ -329,4 +650,196 @@ class MessageInteractionAV(APIView):
              return Response({"error": "Interaction feature not available for this message."}, status=status.HTTP_501_NOT_IMPLEMENTED)
         except Exception as e:
             logger.error(f"Error during message interaction: {e.__class__.__name__} - {e}", exc_info=True)
-            return Response({"error": "An unexpected error occurred during interaction."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({"error": "An unexpected error occurred during interaction."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MessageInteractionBatchAV(APIView):
+    """
+    Records many likes/dislikes at once: ``{"interactions": [{"message_uid": ..., "is_like": true}, ...]}``.
+    Ownership is checked in one query and every weight is written with one UPDATE.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @handle_exceptions
+    def post(self, request, *args, **kwargs):
+        serializer = MessageInteractionBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # Si un mensaje aparece varias veces, gana la última interacción.
+        interactions = {item["message_uid"]: item["is_like"] for item in serializer.validated_data["interactions"]}
+
+        updated_uids = Message.bulk_update_weights(request.user, interactions)
+        bump_user(request.user.pk)
+        not_found = [str(uid) for uid in interactions if uid not in updated_uids]
+        if not_found:
+            logger.warning(f"Batch interaction skipped {len(not_found)} unknown or foreign messages for user {request.user.pk}.")
+        return Response(
+            {"updated": len(updated_uids), "not_found": not_found},
+            status=status.HTTP_200_OK,
+        )
+
+
+@dataclass
+class BatchAnswer:
+    text_message: Optional[str] = None
+    image: Optional[str] = None
+    stats: Optional[Dict[str, Any]] = None
+    cacheable: bool = False
+    error: Optional[str] = None
+    status_code: int = status.HTTP_201_CREATED
+
+
+def answer_batch_question(history_for_agent, question: str, use_answer_cache: bool,
+                          cached: Optional[CachedAnswer]) -> BatchAnswer:
+    """
+    One question of a batch, tracked as its own turn: the cached answer (looked up by the
+    caller, so this never touches the database) or the agent.
+    """
+    turn_token = start_turn()
+    answer = BatchAnswer()
+    try:
+        if cached is not None:
+            current_turn().route = "cache"
+            answer.text_message, answer.image = cached.text_message, cached.image
+        else:
+            result = invoke_agent(history_for_agent, question)
+            mas_tool_result_dict = mas_result_from_steps(result) or {}
+            answer.text_message = result.get("output", NO_ANSWER_TEXT)
+            answer.image = mas_tool_result_dict.get("image_path")
+            # Como en MessageCreateAV: sólo respuestas que no dependen del historial del chat.
+            answer.cacheable = use_answer_cache and not history_for_agent and "output" in result \
+                and not mas_tool_result_dict.get("error")
+        answer.stats = current_turn().as_dict()
+    except Throttled as e:
+        answer.error, answer.status_code = str(e.detail), status.HTTP_429_TOO_MANY_REQUESTS
+    except TurnCancelled as e:
+        record_cancellation(e.stage, e.reason)
+        answer.error, answer.status_code = ABORTED_TEXT, CLIENT_CLOSED_REQUEST
+    except NotImplementedError:
+        answer.error, answer.status_code = "El asistente IA no está disponible.", status.HTTP_503_SERVICE_UNAVAILABLE
+    except Exception as e:
+        logger.error(f"ERROR answering a batch question: {e}", exc_info=True)
+        answer.error = f"Hubo un problema al contactar al asistente IA: {str(e)}"
+        answer.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    finally:
+        finish_turn(turn_token, status=turn_status(answer.status_code))
+    return answer
+
+
+class MessageBatchAV(APIView):
+    """
+    Answers several questions of a chat at once: ``{"questions": ["...", ...]}``.
+
+    The history is loaded once and every question is answered as the next one after it,
+    concurrently (``CHAT_BATCH_MAX_PARALLEL`` at a time, each behind the LLM limiter). The
+    user/assistant pairs are then written in the order of the questions with one multi-row
+    insert, with increasing ``created_at`` so every answer sorts after its question; questions that failed are reported and not stored. With ``?stream=1``
+    every answer is sent as soon as it is ready (NDJSON, see apps/chat/streaming.py).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        if request.query_params.get("stream") in ("1", "true"):
+            events = TurnEventStream(lambda: self.answer_batch(request, *args, **kwargs),
+                                     keepalive=getattr(settings, "CHAT_STREAM_KEEPALIVE", 15))
+            return ndjson_response(request, events)
+        return self.answer_batch(request, *args, **kwargs)
+
+    @handle_exceptions
+    def answer_batch(self, request, *args, **kwargs):
+        if not LANGCHAIN_SETUP_SUCCESSFUL:
+            return Response({"error": "El asistente IA no está disponible actualmente debido a un problema de configuración."},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        chat = get_object_or_404(Chat.objects.filter(registered_by=request.user, is_active=True), uid=kwargs.get('pk'))
+        serializer = MessageBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        questions = serializer.validated_data["questions"]
+
+        root_span = start_trace("MessageBatchAV.post", traceparent=request.headers.get("traceparent"),
+                                chat_uid=str(chat.uid), questions=len(questions))
+        response = None
+        try:
+            response = self.answer_questions(request, chat, questions)
+            return response
+        finally:
+            finish_trace(root_span, status_code=getattr(response, "status_code", None))
+
+    def answer_questions(self, request, chat, questions):
+        try:
+            history_for_agent = load_langchain_history_from_db(chat)
+        except Exception as e:
+            logger.error(f"Error loading history: {e}", exc_info=True)
+            history_for_agent = []
+
+        # La caché se consulta aquí: los hilos del lote sólo llaman al agente y no abren conexiones a la base de datos.
+        lookups = []
+        for question in questions:
+            use_answer_cache = getattr(settings, "CHAT_ANSWER_CACHE_ENABLED", True) and (
+                not history_for_agent or is_context_free(question)
+            )
+            cached = answer_cache.get(request.user.pk, question, load_answer_weights) if use_answer_cache else None
+            lookups.append((use_answer_cache, cached))
+
+        answers = [None] * len(questions)
+        parallel = max(1, min(getattr(settings, "CHAT_BATCH_MAX_PARALLEL", 4), len(questions)))
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="chat-batch") as pool:
+            # Cada pregunta corre en una copia del contexto: su propio turno de métricas, bajo la traza del lote.
+            futures = {
+                pool.submit(contextvars.copy_context().run, answer_batch_question, history_for_agent, question, *lookup): index
+                for index, (question, lookup) in enumerate(zip(questions, lookups))
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                answer = answers[index] = future.result()
+                publish("answer", index=index, question=questions[index], text_message=answer.text_message,
+                        image=answer.image, error=answer.error, status=answer.status_code)
+        logger.info(f"Batch of {len(questions)} questions answered for chat {chat.uid} "
+                    f"({sum(answer.error is None for answer in answers)} ok).")
+
+        pairs = [
+            (index, Message(chat_room=chat, rol=RolType.user, text_message=question),
+             Message(chat_room=chat, rol=RolType.assistant, text_message=answer.text_message,
+                     image=answer.image, stats=answer.stats))
+            for index, (question, answer) in enumerate(zip(questions, answers)) if answer.error is None
+        ]
+        if pairs:
+            # Pregunta 1, respuesta 1, pregunta 2...: un microsegundo entre cada una para que no empaten al
+            # ordenar por created_at. bulk_create no sirve: auto_now_add pisaría las marcas de tiempo.
+            created = [message for _, question, reply in pairs for message in (question, reply)]
+            started_at = timezone.now()
+            for offset, message in enumerate(created):
+                message.created_at = message.updated_at = started_at + timedelta(microseconds=offset)
+            with transaction.atomic():
+                bulk_insert_rows(Message, [
+                    {field.attname: getattr(message, field.attname) for field in Message._meta.concrete_fields}
+                    for message in created
+                ])
+                record_messages(created)
+                Chat.record_new_messages(chat.pk, created)
+                if not chat.title and not history_for_agent:
+                    title, description = chat_title_from_first_message(chat, pairs[0][1].text_message)
+                    Chat.objects.filter(Q(title__isnull=True) | Q(title=""), pk=chat.pk).update(
+                        title=title, description=description, updated_at=timezone.now(),
+                    )
+                # Tras los UPDATE de actividad y título, que no envían post_save.
+                bump_chat(request.user.pk, chat.pk)
+                # Las inserciones en bloque no disparan post_save: el índice semántico se alimenta aquí.
+                items = [(question.uid, question.text_message) for _, question, _ in pairs]
+                transaction.on_commit(lambda: index_user_messages(request.user.pk, items))
+                cacheable = [
+                    (question.text_message, CachedAnswer(message_uid=reply.uid, text_message=reply.text_message, image=reply.image))
+                    for index, question, reply in pairs if answers[index].cacheable
+                ]
+                # Como en MessageCreateAV: las respuestas entran en la caché cuando sus mensajes ya existen.
+                transaction.on_commit(
+                    lambda: [answer_cache.put(request.user.pk, text, answer) for text, answer in cacheable], robust=True,
+                )
+
+        saved = {index: reply for index, _, reply in pairs}
+        results = []
+        for index, (question, answer) in enumerate(zip(questions, answers)):
+            if index in saved:
+                results.append({"index": index, "question": question, "message": MessageSerializer(saved[index]).data})
+            else:
+                results.append({"index": index, "question": question, "error": answer.error, "status": answer.status_code})
+        return Response({"results": results}, status=status.HTTP_201_CREATED)
+
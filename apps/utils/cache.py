@@ -0,0 +1,98 @@
+#apps/utils/cache.py
+"""
+Two-tier cache backend: process-local memory in front of a cache shared by the workers.
+
+``TieredCache`` reads the local tier first and falls back to the shared one, which is a
+``SparseCullFileBasedCache`` at ``LOCATION`` (or any backend given as ``OPTIONS["SHARED"]``). Writes
+go to both tiers. Other workers only see the shared tier, so a local copy can stay stale
+for up to ``OPTIONS["LOCAL_TIMEOUT"]`` seconds. Store only immutable values here, such as
+entries under versioned keys, and read keys that change in place from ``shared``.
+
+``FileBasedCache`` lists its whole directory to cull on every write. ``SparseCullFileBasedCache``
+does that at most once every ``OPTIONS["CULL_INTERVAL"]`` seconds per process, and never when
+it is ``None`` (for small stores whose keys must not be evicted, such as cache versions).
+"""
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+
+
+class SparseCullFileBasedCache(FileBasedCache):
+
+    def __init__(self, dir, params):
+        options = dict(params.get("OPTIONS", {}))
+        self._cull_interval = options.pop("CULL_INTERVAL", 60)
+        super().__init__(dir, dict(params, OPTIONS=options))
+        self._cull_lock = threading.Lock()
+        self._next_cull = 0.0
+
+    def _cull(self):
+        if self._cull_interval is None:
+            return
+        with self._cull_lock:
+            now = time.monotonic()
+            if now < self._next_cull:
+                return
+            self._next_cull = now + self._cull_interval
+        super()._cull()
+
+
+class TieredCache(BaseCache):
+
+    def __init__(self, location, params):
+        options = dict(params.get("OPTIONS", {}))
+        local_timeout = options.pop("LOCAL_TIMEOUT", 60)
+        local_max_entries = options.pop("LOCAL_MAX_ENTRIES", 1000)
+        shared_backend = options.pop("SHARED", None)
+        shared_params = dict(params, OPTIONS=options)
+        super().__init__(shared_params)
+        self.local = LocMemCache(f"tiered:{location}", {
+            "TIMEOUT": local_timeout, "OPTIONS": {"MAX_ENTRIES": local_max_entries},
+        })
+        self.shared = (import_string(shared_backend) if shared_backend else SparseCullFileBasedCache)(location, shared_params)
+        self._local_timeout = local_timeout
+
+    def _local_expiry(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self._local_timeout
+        return min(timeout, self._local_timeout)
+
+    def get(self, key, default=None, version=None):
+        missing = object()
+        value = self.local.get(key, missing, version=version)
+        if value is not missing:
+            return value
+        value = self.shared.get(key, missing, version=version)
+        if value is missing:
+            return default
+        self.local.set(key, value, timeout=self._local_timeout, version=version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout=timeout, version=version)
+        self.local.set(key, value, timeout=self._local_expiry(timeout), version=version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if not self.shared.add(key, value, timeout=timeout, version=version):
+            return False
+        self.local.set(key, value, timeout=self._local_expiry(timeout), version=version)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.touch(key, timeout=self._local_expiry(timeout), version=version)
+        return self.shared.touch(key, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.local.delete(key, version=version)
+        return self.shared.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        return self.local.has_key(key, version=version) or self.shared.has_key(key, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
@@ -0,0 +1,163 @@
+#apps/utils/db_router.py
+"""
+Read-replica routing with read-your-writes consistency.
+
+Reads go to the replicas (``DATABASE_REPLICAS``) only where a view opted in with
+``ReplicaReadsMixin``, for safe methods, once the user is authenticated. Everything else,
+and every write, uses ``default``. A request sticks to the primary once it writes, and
+``ReplicaRoutingMiddleware`` pins a user who wrote to the primary for
+``DATABASE_REPLICA_PIN_SECONDS``. The pin is kept in the cache, so it needs a shared
+``CACHES`` backend to hold across workers.
+
+A replica is probed at most every ``DATABASE_REPLICA_CHECK_SECONDS``. A replica that cannot
+connect is skipped for ``DATABASE_REPLICA_RETRY_SECONDS`` and reads fail over to the primary.
+"""
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+
+class RoutingState:
+    """ Routing decisions of one request. """
+
+    def __init__(self):
+        self.use_replicas = False
+        self.wrote = False
+
+
+_routing_state: "contextvars.ContextVar[Optional[RoutingState]]" = contextvars.ContextVar("db_routing_state", default=None)
+
+
+def begin_request():
+    return _routing_state.set(RoutingState())
+
+
+def finish_request(token) -> RoutingState:
+    state = _routing_state.get()
+    _routing_state.reset(token)
+    return state
+
+
+def _pin_key(user_id) -> str:
+    return f"db-router:recent-write:{user_id}"
+
+
+def remember_write(user_id):
+    """ Pins the user's reads to the primary for DATABASE_REPLICA_PIN_SECONDS. """
+    seconds = getattr(settings, "DATABASE_REPLICA_PIN_SECONDS", 5)
+    if seconds > 0:
+        cache.set(_pin_key(user_id), 1, timeout=seconds)
+
+
+def has_recent_write(user_id) -> bool:
+    return cache.get(_pin_key(user_id)) is not None
+
+
+def use_replicas(user):
+    """ Lets the rest of the current request read from the replicas, unless ``user`` wrote recently. """
+    state = _routing_state.get()
+    if state is None or state.wrote or not getattr(settings, "DATABASE_REPLICAS", []):
+        return
+    if user is not None and user.is_authenticated and has_recent_write(user.pk):
+        return
+    state.use_replicas = True
+
+
+class ReplicaHealth:
+    """ Per-process health of the replicas: periodic connection probes and a back-off after a failure. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = {}
+        self._down_until = {}
+
+    def is_healthy(self, alias: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._down_until.get(alias, 0) > now:
+                return False
+            if now - self._checked_at.get(alias, float("-inf")) < getattr(settings, "DATABASE_REPLICA_CHECK_SECONDS", 10):
+                return True
+            self._checked_at[alias] = now
+        try:
+            connection = connections[alias]
+            connection.ensure_connection()
+            if not connection.is_usable():
+                raise DatabaseError("connection is not usable")
+        except Exception as e:
+            self.mark_down(alias, e)
+            return False
+        return True
+
+    def mark_down(self, alias: str, error=None):
+        retry = getattr(settings, "DATABASE_REPLICA_RETRY_SECONDS", 30)
+        logger.warning(f"Replica '{alias}' unavailable ({error}); reading from the primary for {retry}s.")
+        with self._lock:
+            self._down_until[alias] = time.monotonic() + retry
+            self._checked_at.pop(alias, None)
+        try:
+            connections[alias].close()
+        except Exception:
+            pass
+
+    def reset(self):
+        with self._lock:
+            self._checked_at.clear()
+            self._down_until.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+    """ ``DATABASE_ROUTERS`` entry: see the module docstring. """
+
+    _round_robin = itertools.count()
+
+    def db_for_read(self, model, **hints):
+        state = _routing_state.get()
+        if state is None or not state.use_replicas or state.wrote:
+            return None
+        replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        for offset in range(len(replicas)):
+            alias = replicas[(next(self._round_robin) + offset) % len(replicas)]
+            if replica_health.is_healthy(alias):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None:
+            state.wrote = True  # A partir de aquí la petición sólo lee del primario.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Las réplicas tienen los mismos datos que el primario.
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, "DATABASE_REPLICAS", [])}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaReadsMixin:
+    """
+    DRF views whose safe requests may read from the replicas. ``replica_read_actions``
+    limits it to some actions of a viewset (``None``: every safe request).
+    """
+    replica_read_actions = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)  # Autentica: la consulta del usuario va al primario.
+        action = getattr(self, "action", None)
+        if request.method in SAFE_METHODS and (self.replica_read_actions is None or action in self.replica_read_actions):
+            use_replicas(request.user)
@@ -48,4 +48,13 @@ class Enum(metaclass=EnumMetaClass):
 
 class RolType(Enum):
     user = _("user")
-    assistant = _("assistant")
\ No newline at end of file
+    assistant = _("assistant")
+
+class MessageStatus(Enum):
+    complete = _("complete")
+    aborted = _("aborted")
+
+class IntentType(Enum):
+    chitchat = _("chitchat")
+    data_query = _("data_query")
+    agent = _("agent")
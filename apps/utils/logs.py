@@ -0,0 +1,137 @@
+"""
+Logging helpers for the request hot path.
+
+- ``AsyncQueueHandler``: request threads only put the record on a bounded queue; a listener
+  thread formats and writes it. When the queue is full the record is dropped (and counted)
+  instead of blocking the request.
+- ``SamplingFilter``: keeps only a fraction of the DEBUG/INFO records of noisy loggers.
+- ``Redacted``: lazy ``%s`` argument that truncates long values and hides base64 payloads;
+  nothing is built unless the record is actually emitted.
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import weakref
+from logging.handlers import QueueHandler, QueueListener
+
+BASE64_DATA_RE = re.compile(r"data:([\w/+.-]+);base64,[A-Za-z0-9+/=\s]+")
+
+
+def redact(value, limit: int = 500):
+    """ Copy of ``value`` with base64 data URIs replaced by their size and long strings truncated. """
+    if isinstance(value, dict):
+        return {key: redact(item, limit) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item, limit) for item in value[:50]] + ([f"... {len(value) - 50} more"] if len(value) > 50 else [])
+    if isinstance(value, str):
+        if ";base64," in value[:100]:
+            return BASE64_DATA_RE.sub(lambda match: f"data:{match.group(1)};base64,<{len(match.group(0))} chars>", value[:limit + 200])
+        if len(value) > limit:
+            return f"{value[:limit]}... <{len(value)} chars>"
+    return value
+
+
+class Redacted:
+    """ ``logger.debug("Respuesta: %s", Redacted(data))``: redacted and truncated only when emitted. """
+
+    def __init__(self, value, limit: int = 500):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = str(redact(self.value, self.limit))
+        return text if len(text) <= self.limit * 4 else f"{text[:self.limit * 4]}... <truncated>"
+
+
+class SamplingFilter(logging.Filter):
+    """
+    ``rates`` maps logger names (or prefixes) to the fraction of DEBUG/INFO records kept;
+    WARNING and above always pass.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        # Los prefijos más largos primero: "apps.chat.views" gana a "apps".
+        self.rates = sorted((rates or {}).items(), key=lambda item: -len(item[0]))
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        for name, rate in self.rates:
+            if record.name == name or record.name.startswith(name + "."):
+                return rate >= 1 or random.random() < rate
+        return True
+
+
+_async_handlers = weakref.WeakSet()
+
+
+def dropped_records() -> int:
+    """ Records dropped because an ``AsyncQueueHandler`` queue was full (this process). """
+    return sum(handler.dropped for handler in list(_async_handlers))
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    Non-blocking handler: the record goes to a bounded queue and a ``QueueListener`` thread
+    writes it to ``stream`` with this handler's formatter.
+    """
+
+    def __init__(self, queue_size: int = 10000, max_message_chars: int = 4000, stream=None):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.max_message_chars = max_message_chars
+        self.dropped = 0
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        _async_handlers.add(self)
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Sólo se resuelve el mensaje (los args podrían cambiar luego); el formato completo lo hace el listener.
+        message = record.getMessage()
+        if len(message) > self.max_message_chars:
+            message = f"{message[:self.max_message_chars]}... <{len(message)} chars>"
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args = message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def restart_listener(self):
+        """ After ``fork`` the listener thread does not exist in the child: start a new one. """
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()  # Vacía la cola antes de salir.
+            self.listener = None
+        super().close()
+
+
+def _restart_listeners_after_fork():
+    for handler in list(_async_handlers):
+        if handler.listener is not None:
+            handler.restart_listener()
+
+
+# gunicorn con preload_app configura el logging en el master y luego hace fork de los workers.
+os.register_at_fork(after_in_child=_restart_listeners_after_fork)
+
@@ -14,10 +14,12 @@ from apps.chat.serializers import MessageSerializer
 from django.conf import settings
 from django.core.files.base import ContentFile
 from apps.chat.tools import GenerateImageTool
+from apps.chat.llm_limiter import llm_limiter
 from .constance import SYSTEM_MESSAGE
 
 API_KEY = settings.API_KEY_OPEN_AI
-client = OpenAI(api_key=API_KEY)
+client = OpenAI(api_key=API_KEY, base_url=getattr(settings, "OPENAI_BASE_URL", None),
+                max_retries=getattr(settings, "CHAT_LLM_MAX_RETRIES", 1))
  
 class Formatted_Messages_Manager:
     """ Class that is responsible for preparing messages to pass them through context. """
@@ -139,6 +141,11 @@ class GPT_Response_Manager:
 
     def generate_response(self, formated_messages:list, chat:Chat):
         """ Method to generate a response. """
+        # Fuera del try: Throttled (429 + Retry-After) no debe convertirse en ValidationError.
+        with llm_limiter.slot():
+            return self.__generate_response(formated_messages, chat)
+
+    def __generate_response(self, formated_messages:list, chat:Chat):
         try:
             # Realiza la solicitud a la API de OpenAI
             first_response = client.chat.completions.create(
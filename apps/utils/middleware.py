@@ -0,0 +1,164 @@
+import logging
+import re
+import threading
+
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework.permissions import SAFE_METHODS
+
+from apps.utils.db_router import begin_request, finish_request, remember_write
+
+logger = logging.getLogger(__name__)
+
+
+class Bulkhead:
+    """ Non-blocking in-flight counter of one request class; a full bulkhead sheds instead of queueing. """
+
+    def __init__(self, name: str, max_in_flight: int, retry_after: int, routes=()):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.routes = [(method.upper(), re.compile(pattern)) for method, pattern in routes]
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def matches(self, request) -> bool:
+        return any(request.method == method and pattern.match(request.path_info) for method, pattern in self.routes)
+
+    def try_enter(self) -> bool:
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "admitted_total": self.admitted,
+                "rejected_total": self.rejected,
+            }
+
+
+def build_bulkheads():
+    """
+    One bulkhead per class in ``BULKHEADS`` (first match wins) plus the ``default`` class.
+    Expensive classes get a share of ``WORKER_THREADS`` and ``BULKHEAD_READ_RESERVE`` threads
+    are always left for the default (cheap reads, login...).
+    """
+    threads = getattr(settings, "WORKER_THREADS", 8)
+    reserve = min(getattr(settings, "BULKHEAD_READ_RESERVE", 2), threads - 1)
+    bulkheads = []
+    for name, config in getattr(settings, "BULKHEADS", {}).items():
+        bulkheads.append(Bulkhead(
+            name,
+            max_in_flight=max(1, min(config.get("max_in_flight", threads), threads - reserve)),
+            retry_after=config.get("retry_after", 5),
+            routes=config.get("routes", ()),
+        ))
+    default = Bulkhead("default", max_in_flight=threads, retry_after=1)
+    return bulkheads, default
+
+
+_bulkheads, _default_bulkhead = None, None
+_bulkheads_lock = threading.Lock()
+
+
+def get_bulkheads():
+    global _bulkheads, _default_bulkhead
+    if _bulkheads is None:
+        with _bulkheads_lock:
+            if _bulkheads is None:
+                _bulkheads, _default_bulkhead = build_bulkheads()
+    return _bulkheads, _default_bulkhead
+
+
+def bulkhead_stats() -> dict:
+    bulkheads, default = get_bulkheads()
+    return {bulkhead.name: bulkhead.stats() for bulkhead in bulkheads + [default]}
+
+
+class BulkheadMiddleware:
+    """
+    Admission control per request class so slow agent calls cannot take every worker thread.
+    A request whose class is full gets ``503`` with ``Retry-After`` right away.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def classify(self, request) -> Bulkhead:
+        bulkheads, default = get_bulkheads()
+        return next((bulkhead for bulkhead in bulkheads if bulkhead.matches(request)), default)
+
+    def __call__(self, request):
+        bulkhead = self.classify(request)
+        if not bulkhead.try_enter():
+            logger.warning(f"Bulkhead '{bulkhead.name}' full ({bulkhead.max_in_flight} in flight); shedding {request.method} {request.path_info}")
+            return JsonResponse(
+                {"error": "El servidor está ocupado atendiendo otras consultas. Inténtalo de nuevo en unos segundos."},
+                status=503,
+                headers={"Retry-After": str(bulkhead.retry_after)},
+            )
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            bulkhead.leave()
+            raise
+        if response.streaming:
+            # El cuerpo se sigue generando después de devolver la respuesta (turnos con `?stream=1`):
+            # el cupo se libera cuando el servidor lo termina de enviar o lo cierra.
+            wrap = self.leave_after_async if response.is_async else self.leave_after
+            response.streaming_content = wrap(response.streaming_content, bulkhead)
+        else:
+            bulkhead.leave()
+        return response
+
+    @staticmethod
+    def leave_after(content, bulkhead: Bulkhead):
+        try:
+            yield from content
+        finally:
+            bulkhead.leave()
+
+    @staticmethod
+    async def leave_after_async(content, bulkhead: Bulkhead):
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            bulkhead.leave()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Per-request state of the replica router (apps/utils/db_router.py). After a request that
+    wrote (an unsafe method that succeeded, or any ORM write), the user's reads stick to the
+    primary for ``DATABASE_REPLICA_PIN_SECONDS``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = begin_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            state = finish_request(token)
+        wrote = state.wrote or (request.method not in SAFE_METHODS and response.status_code < 400)
+        user = getattr(request, "user", None) if wrote else None
+        if user is not None and user.is_authenticated:
+            remember_write(user.pk)
+        return response
+
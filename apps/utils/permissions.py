@@ -1,5 +1,19 @@
+import hmac
+
+from django.conf import settings
 from rest_framework import permissions
 
 class IsSuperUser(permissions.BasePermission):
     def has_permission(self, request, view):
-        return bool(request.user and request.user.is_superuser)
\ No newline at end of file
+        return bool(request.user and request.user.is_superuser)
+
+
+class HasMetricsToken(permissions.BasePermission):
+    """ Superusers, or scrapers sending ``Authorization: Bearer <METRICS_TOKEN>``. """
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_superuser:
+            return True
+        token = getattr(settings, "METRICS_TOKEN", "")
+        header = request.META.get("HTTP_AUTHORIZATION", "")
+        return bool(token) and hmac.compare_digest(header.encode(), f"Bearer {token}".encode())
@@ -0,0 +1,39 @@
+#apps/utils/test_runner.py
+import copy
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class IsolatedStorageTestRunner(DiscoverRunner):
+    """ Test runner that points the on-disk stores of the app (``var/``) at a temporary directory. """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._storage_dir = tempfile.mkdtemp(prefix="chat-tests-")
+        self._storage_settings = override_settings(**self.storage_settings(self._storage_dir))
+        self._storage_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._storage_settings.disable()
+        shutil.rmtree(self._storage_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
+
+    @staticmethod
+    def storage_settings(directory: str) -> dict:
+        caches = copy.deepcopy(settings.CACHES)
+        responses = caches.get(getattr(settings, "RESPONSE_CACHE_ALIAS", "responses"), {})
+        # Sólo la caché en ficheros vive en var/; un backend compartido (RESPONSE_CACHE_URL) se respeta.
+        if responses.get("BACKEND") == "apps.utils.cache.TieredCache":
+            responses["LOCATION"] = os.path.join(directory, "response_cache")
+        versions = caches.get(getattr(settings, "RESPONSE_CACHE_VERSIONS_ALIAS", "response_versions"), {})
+        if versions.get("BACKEND") == "apps.utils.cache.SparseCullFileBasedCache":
+            versions["LOCATION"] = os.path.join(directory, "response_cache", "versions")
+        return {
+            "CHAT_SEMANTIC_INDEX_DIR": os.path.join(directory, "semantic_index"),
+            "CACHES": caches,
+        }
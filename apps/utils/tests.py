@@ -1,3 +1,247 @@
-from django.test import TestCase
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from apps.chat.models import Chat
+from apps.utils.cache import SparseCullFileBasedCache, TieredCache
+from apps.utils.db_router import replica_health
+from apps.utils.logs import AsyncQueueHandler, Redacted, SamplingFilter
+from apps.utils.middleware import BulkheadMiddleware, bulkhead_stats
+
+REPLICA = "replica_test"
+AGENT_PATH = "/api/chats/7f8c1e4e-0000-4000-8000-000000000000/messages/"
+
+
+@override_settings(
+    WORKER_THREADS=4,
+    BULKHEAD_READ_RESERVE=2,
+    BULKHEADS={"agent": {"max_in_flight": 10, "retry_after": 7, "routes": [("POST", r"^/api/chats/[0-9a-f-]+/messages/$")]}},
+)
+class BulkheadMiddlewareTests(APITestCase):
+    def setUp(self):
+        # Los bulkheads se construyen una vez por proceso; cada test parte de cero.
+        for name in ("_bulkheads", "_default_bulkhead"):
+            patcher = patch(f"apps.utils.middleware.{name}", None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.release = threading.Event()
+        self.entered = threading.Semaphore(0)
+        self.factory = RequestFactory()
+
+    def _blocking_view(self, request):
+        self.entered.release()
+        self.release.wait(timeout=5)
+        return HttpResponse("ok")
+
+    def _start_blocked(self, middleware, request, count):
+        threads = [threading.Thread(target=middleware, args=(request,)) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for _ in range(count):
+            self.entered.acquire(timeout=5)
+        self.addCleanup(lambda: [thread.join(timeout=5) for thread in threads])
+        self.addCleanup(self.release.set)
+
+    def test_agent_requests_are_shed_while_reads_keep_their_reserve(self):
+        middleware = BulkheadMiddleware(self._blocking_view)
+        # max_in_flight=10 se recorta a WORKER_THREADS - BULKHEAD_READ_RESERVE = 2.
+        self._start_blocked(middleware, self.factory.post(AGENT_PATH), 2)
+
+        response = middleware(self.factory.post(AGENT_PATH))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "7")
+
+        read_middleware = BulkheadMiddleware(lambda request: HttpResponse("chats"))
+        self.assertEqual(read_middleware(self.factory.get("/api/chats/")).status_code, 200)
+        stats = bulkhead_stats()
+        self.assertEqual(stats["agent"], {"in_flight": 2, "max_in_flight": 2, "admitted_total": 2, "rejected_total": 1})
+        self.assertEqual(stats["default"]["admitted_total"], 1)
+
+    def test_slots_are_released_when_the_view_fails(self):
+        def failing_view(request):
+            raise RuntimeError("boom")
+        middleware = BulkheadMiddleware(failing_view)
+        for _ in range(3):
+            with self.assertRaises(RuntimeError):
+                middleware(self.factory.post(AGENT_PATH))
+        self.assertEqual(bulkhead_stats()["agent"]["in_flight"], 0)
+
+    def test_streamed_responses_keep_their_slot_until_the_body_is_sent(self):
+        middleware = BulkheadMiddleware(lambda request: StreamingHttpResponse(iter([b"uno", b"dos"])))
+        response = middleware(self.factory.post(AGENT_PATH))
+        self.assertEqual(bulkhead_stats()["agent"]["in_flight"], 1)
+        self.assertEqual(b"".join(response.streaming_content), b"unodos")
+        self.assertEqual(bulkhead_stats()["agent"]["in_flight"], 0)
+
+    def test_status_endpoint(self):
+        admin = get_user_model().objects.create_superuser(username="admin_bulkhead", email="a@example.com", password="x")
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(reverse("bulkhead-status"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {"agent", "default"})
+
+
+class LoggingHelpersTests(TestCase):
+    def test_redacted_hides_base64_and_truncates(self):
+        payload = {"text_response": "x" * 2000, "image_response": "data:image/png;base64," + "A" * 3_000_000}
+        text = str(Redacted(payload, limit=100))
+        self.assertLess(len(text), 1000)
+        self.assertIn("data:image/png;base64,<", text)
+        self.assertIn("<2000 chars>", text)
+
+    def test_sampling_filter_only_samples_low_levels(self):
+        sampling = SamplingFilter({"apps.chat": 0.0, "apps.chat.views": 1.0})
+        record = lambda name, level: logging.LogRecord(name, level, __file__, 1, "msg", None, None)
+        self.assertFalse(sampling.filter(record("apps.chat.intent", logging.INFO)))
+        self.assertTrue(sampling.filter(record("apps.chat.intent", logging.WARNING)))
+        self.assertTrue(sampling.filter(record("apps.chat.views", logging.DEBUG)))
+        self.assertTrue(sampling.filter(record("django.request", logging.INFO)))
+
+    def test_async_handler_writes_from_the_listener_and_drops_when_full(self):
+        stream = io.StringIO()
+        handler = AsyncQueueHandler(queue_size=1, max_message_chars=20, stream=stream)
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        handler.listener.stop()  # Sin hilo escritor la cola se llena.
+        handler.listener = None
+        logger = logging.getLogger("apps.tests.async_logging")
+        logger.addHandler(handler)
+        logger.propagate = False
+        try:
+            logger.warning("primero %s", "y" * 100)
+            logger.warning("segundo")
+            self.assertEqual(handler.dropped, 1)
+            record = handler.queue.get_nowait()
+            self.assertEqual(record.getMessage(), "primero " + "y" * 12 + "... <108 chars>")
+            handler.target.handle(record)
+            self.assertIn("WARNING primero", stream.getvalue())
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+
+
+class GunicornConfTests(TestCase):
+    def load_conf(self, **environ):
+        import importlib
+        import core.gunicorn_conf
+        with patch.dict("os.environ", environ):
+            return importlib.reload(core.gunicorn_conf)
+
+    def test_threads_follow_worker_threads_and_asgi_switches_workers(self):
+        conf = self.load_conf(WORKER_THREADS="12", SERVER_MAX_REQUESTS="500")
+        self.assertEqual((conf.worker_class, conf.wsgi_app, conf.threads), ("gthread", "core.wsgi:application", 12))
+        self.assertTrue(conf.preload_app)
+        self.assertEqual((conf.max_requests, conf.max_requests_jitter), (500, 50))
+        conf = self.load_conf(SERVER_ASGI="1")
+        self.assertEqual((conf.worker_class, conf.wsgi_app), ("uvicorn.workers.UvicornWorker", "core.asgi:application"))
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+
+    def worker_cache(self):
+        return TieredCache(self.location, {"TIMEOUT": 60, "OPTIONS": {"LOCAL_TIMEOUT": 30}})
+
+    def test_local_tier_in_front_of_the_shared_files(self):
+        first, second = self.worker_cache(), self.worker_cache()
+        first.set("clave", b"cuerpo")
+        self.assertEqual(second.get("clave"), b"cuerpo")  # otro worker lo lee de los ficheros
+        self.assertFalse(second.add("clave", b"otro"))
+        first.shared.delete("clave")
+        self.assertEqual(second.get("clave"), b"cuerpo")  # y lo guardó en su memoria local
+        self.assertEqual(first.get("clave"), b"cuerpo")
+        first.delete("clave")
+        self.assertIsNone(first.get("clave"))
+
+    def test_files_are_culled_at_most_once_per_interval(self):
+        files = SparseCullFileBasedCache(self.location, {"OPTIONS": {"MAX_ENTRIES": 2, "CULL_FREQUENCY": 1}})
+        with patch.object(files, "_list_cache_files", wraps=files._list_cache_files) as listed:
+            for n in range(5):
+                files.set(f"clave{n}", n)
+        self.assertEqual(listed.call_count, 1)  # sólo la primera escritura recorre el directorio
+        versions = SparseCullFileBasedCache(self.location, {"OPTIONS": {"MAX_ENTRIES": 2, "CULL_INTERVAL": None}})
+        with patch.object(versions, "_list_cache_files", wraps=versions._list_cache_files) as listed:
+            for n in range(5):
+                versions.set(f"version{n}", n, timeout=None)
+        listed.assert_not_called()
+        self.assertEqual(versions.get_many([f"version{n}" for n in range(5)]), {f"version{n}": n for n in range(5)})
+
+
+# Sin caché de respuestas: las lecturas repetidas deben llegar a la base de datos para ver qué alias usan.
+@override_settings(DATABASE_REPLICAS=[REPLICA], DATABASE_REPLICA_PIN_SECONDS=60, DATABASE_REPLICA_CHECK_SECONDS=0,
+                   RESPONSE_CACHE_ENABLED=False)
+class ReplicaRoutingTests(APITransactionTestCase):
+    """
+    Two SQLite databases: the test database as primary and a temporary file as its (lagging)
+    replica. The replica is registered after the test framework has checked ``databases``.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.replica_dir = tempfile.mkdtemp()
+        default = connections.settings["default"]
+        connections.settings[REPLICA] = dict(
+            default, ENGINE="django.db.backends.sqlite3", NAME=os.path.join(cls.replica_dir, "replica.sqlite3"),
+            ATOMIC_REQUESTS=False, TEST=dict(default["TEST"], MIRROR=None, NAME=None),
+        )
+        call_command("migrate", database=REPLICA, run_syncdb=True, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        shutil.rmtree(cls.replica_dir, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        call_command("flush", database=REPLICA, interactive=False, verbosity=0)
+        cache.clear()
+        replica_health.reset()
+        self.user = get_user_model().objects.create_user(username="replica_user", email="replica@example.com", password="x")
+        self.user.save(using=REPLICA)
+        Chat.objects.create(registered_by=self.user, title="replicado").save(using=REPLICA)
+        Chat.objects.create(registered_by=self.user, title="pendiente")  # aún no ha llegado a la réplica
+        self.client.force_authenticate(user=self.user)
+
+    def listed_titles(self):
+        response = self.client.get(reverse("chats-list"))
+        self.assertEqual(response.status_code, 200)
+        return sorted(chat["title"] for chat in response.data["results"]["chats"])
+
+    def test_reads_use_the_replica_until_the_user_writes(self):
+        self.assertEqual(self.listed_titles(), ["replicado"])
+        replicated = Chat.objects.using(REPLICA).get()
+        self.assertEqual(self.client.get(reverse("chat-messages", kwargs={"pk": replicated.uid})).status_code, 200)
+
+        self.assertEqual(self.client.post(reverse("chats-list"), {"title": "nuevo"}, format="json").status_code, 201)
+        self.assertEqual(self.listed_titles(), ["nuevo", "pendiente", "replicado"])  # read-your-writes
+        cache.clear()  # fin de la ventana
+        self.assertEqual(self.listed_titles(), ["replicado"])
+
+    def test_reads_fail_over_to_the_primary_when_the_replica_is_down(self):
+        name = connections.settings[REPLICA]["NAME"]
+        connections[REPLICA].close()
+        connections.settings[REPLICA]["NAME"] = os.path.join(self.replica_dir, "missing", "replica.sqlite3")
+        try:
+            self.assertEqual(self.listed_titles(), ["pendiente", "replicado"])
+            self.assertFalse(replica_health.is_healthy(REPLICA))  # en espera de DATABASE_REPLICA_RETRY_SECONDS
+        finally:
+            connections.settings[REPLICA]["NAME"] = name
 
-# Create your tests here.
@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Cancela el turno del asistente si el cliente se desconecta (apps/chat/cancellation.py).
+from apps.chat.cancellation import CancelOnDisconnect  # noqa: E402
+
+application = CancelOnDisconnect(django_application)
+
+# Construye el agente LangChain al arrancar el worker, no en su primera petición.
+from django.conf import settings  # noqa: E402
+
+if getattr(settings, "CHAT_AGENT_WARM_UP", True):
+    from apps.chat.langchain_setup import warm_up  # noqa: E402
+    warm_up()
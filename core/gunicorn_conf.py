@@ -0,0 +1,73 @@
+"""
+Gunicorn configuration: ``gunicorn -c python:core.gunicorn_conf`` (or ``python manage.py serve``).
+
+The API is I/O bound (OpenAI and the MAS), so each worker serves ``WORKER_THREADS`` requests
+with the ``gthread`` worker and there are only a few processes (every one holds its own agent,
+caches and indexes). The app is preloaded and the agent warmed up in the master before
+forking, workers are recycled after ``SERVER_MAX_REQUESTS`` requests (with jitter) to cap
+memory growth, and on SIGTERM in-flight agent calls get ``SERVER_GRACEFUL_TIMEOUT`` seconds
+to finish. ``SERVER_ASGI=1`` runs ``core.asgi`` under uvicorn workers instead.
+"""
+import logging
+import multiprocessing
+import os
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+asgi = os.environ.get("SERVER_ASGI", "0").lower() in ("1", "true", "yes")
+
+bind = os.environ.get("SERVER_BIND", "0.0.0.0:8000")
+wsgi_app = "core.asgi:application" if asgi else "core.wsgi:application"
+worker_class = "uvicorn.workers.UvicornWorker" if asgi else "gthread"
+# Pocos procesos con muchos hilos: las peticiones pasan casi todo el tiempo esperando al LLM.
+workers = _env_int("SERVER_WORKERS", max(2, min(multiprocessing.cpu_count(), 4)))
+# Debe coincidir con WORKER_THREADS (cupos de los bulkheads, apps/utils/middleware.py).
+threads = _env_int("WORKER_THREADS", 8)
+
+preload_app = True
+max_requests = _env_int("SERVER_MAX_REQUESTS", 2000)
+max_requests_jitter = _env_int("SERVER_MAX_REQUESTS_JITTER", max_requests // 10)
+# Un turno del agente puede tardar: cola del limitador + LLM + MAS (60 s).
+graceful_timeout = _env_int("SERVER_GRACEFUL_TIMEOUT", 90)
+timeout = _env_int("SERVER_TIMEOUT", 120)
+keepalive = _env_int("SERVER_KEEPALIVE", 5)
+accesslog = os.environ.get("SERVER_ACCESS_LOG", "-") or None
+
+
+def when_ready(server):
+    # Se llama en el master antes del fork: el URLconf (y con él las vistas) queda compartido por los workers.
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    server.log.info(
+        f"Serving {wsgi_app} with {workers} {worker_class} workers x {threads} threads "
+        f"(max_requests={max_requests}, graceful_timeout={graceful_timeout}s)"
+    )
+
+
+def post_fork(server, worker):
+    # Las conexiones abiertas por el master durante la precarga no se comparten entre procesos.
+    from django.db import connections
+    connections.close_all()
+
+
+def worker_int(worker):
+    _log_in_flight(worker, "interrupted")
+
+
+def worker_exit(server, worker):
+    _log_in_flight(worker, "exiting")
+
+
+def _log_in_flight(worker, event):
+    try:
+        from apps.chat.llm_limiter import llm_limiter
+        stats = llm_limiter.stats()
+    except Exception:  # El worker puede salir antes de haber cargado Django.
+        return
+    if stats["in_flight"] or stats["queue_depth"]:
+        logging.getLogger("apps.server").warning(
+            f"Worker {worker.pid} {event} with {stats['in_flight']} agent calls in flight and {stats['queue_depth']} queued."
+        )
@@ -14,19 +14,23 @@ from datetime import timedelta
 import os
 from pathlib import Path
 import environ
+from corsheaders.defaults import default_headers
 
 env = environ.Env()
 environ.Env.read_env()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
-MAS_API_URL = "http://localhost:8008"  # Reemplaza con la URL real de tu servicio MAS
+MAS_API_URL = env('MAS_API_URL', default="http://localhost:8008")  # Reemplaza con la URL real de tu servicio MAS
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = env('SECRET_KEY', default='strong-key')
 API_KEY_OPEN_AI = env('API_KEY_OPEN_AI', default=None)
+OPENAI_BASE_URL = env('OPENAI_BASE_URL', default=None)  # p. ej. el emulador de `manage.py run_emulators`
+MAS_STREAMING = env.bool('MAS_STREAMING', default=True)  # pide al MAS la respuesta por partes (NDJSON/SSE) si la soporta
+CHAT_STREAM_KEEPALIVE = env.float('CHAT_STREAM_KEEPALIVE', default=15)  # segundos entre líneas vacías de `?stream=1`
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -46,11 +50,26 @@ LOGGING = {
             'style': '{',
         },
     },
+    'filters': {
+        # Fracción de los registros DEBUG/INFO que se conserva por logger (WARNING+ siempre pasa).
+        'sampling': {
+            '()': 'apps.utils.logs.SamplingFilter',
+            'rates': {
+                'apps.chat.views': env.float('LOG_SAMPLE_CHAT_VIEWS', default=1.0),
+                'apps.chat.tools': env.float('LOG_SAMPLE_CHAT_TOOLS', default=1.0),
+                'apps.chat.intent': env.float('LOG_SAMPLE_CHAT_INTENT', default=0.1),
+            },
+        },
+    },
     'handlers': {
+        # Cola acotada + hilo escritor: los hilos de las peticiones nunca esperan a stderr.
         'console': {
-            'level': 'DEBUG', # Muestra DEBUG e INFO en consola
-            'class': 'logging.StreamHandler',
+            'level': 'DEBUG',
+            '()': 'apps.utils.logs.AsyncQueueHandler',
+            'queue_size': env.int('LOG_QUEUE_SIZE', default=10000),
+            'max_message_chars': env.int('LOG_MAX_MESSAGE_CHARS', default=4000),
             'formatter': 'simple',
+            'filters': ['sampling'],
         },
         # Opcional: Handler para escribir a un archivo
         # 'file': {
@@ -72,8 +91,8 @@ LOGGING = {
         },
         'apps': { # Para los loggers de tus apps (ej. logger = logging.getLogger(__name__))
             'handlers': ['console'],
-            'level': 'DEBUG', # Muestra tus logs DEBUG de apps.chat, etc.
-            'propagate': True,
+            'level': env('APPS_LOG_LEVEL', default='INFO'), # DEBUG para ver el detalle de apps.chat, etc.
+            'propagate': False, # root usa el mismo handler: propagar encolaría (y muestrearía) cada registro dos veces
         },
         'pandasai': { # Para ver logs de PandasAI
             'handlers': ['console'],
@@ -112,9 +131,11 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'apps.utils.middleware.BulkheadMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'apps.utils.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -147,6 +168,15 @@ DATABASES = {
     "default": env.db("DATABASE_URL", default="postgres:///chat_bot_db")
 }
 DATABASES["default"]["ATOMIC_REQUESTS"] = True
+# Réplicas de lectura (apps/utils/db_router.py): listados y lecturas del historial; quien escribió lee del primario.
+DATABASE_REPLICAS = []
+for index, url in enumerate(env.list('DATABASE_REPLICA_URLS', default=[])):
+    DATABASES[f"replica_{index}"] = dict(env.db_url_config(url), TEST={"MIRROR": "default"})
+    DATABASE_REPLICAS.append(f"replica_{index}")
+DATABASE_ROUTERS = ['apps.utils.db_router.PrimaryReplicaRouter']
+DATABASE_REPLICA_PIN_SECONDS = env.int('DATABASE_REPLICA_PIN_SECONDS', default=5)  # ventana de read-your-writes
+DATABASE_REPLICA_CHECK_SECONDS = env.int('DATABASE_REPLICA_CHECK_SECONDS', default=10)
+DATABASE_REPLICA_RETRY_SECONDS = env.int('DATABASE_REPLICA_RETRY_SECONDS', default=30)  # réplica caída: se usa el primario
 
 
 # Password validation
@@ -190,6 +220,89 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles_collected') # <--- AÑADE ESTA
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media") # Asegúrate que esta esté correcta también
 MAS_IMAGE_UPLOAD_SUBDIR = "chat_images"
+
+# Búsqueda de texto completo (apps/chat/search.py): configuración de PostgreSQL para to_tsvector.
+CHAT_SEARCH_CONFIG = env('CHAT_SEARCH_CONFIG', default='simple')
+# Búsqueda semántica local (apps/chat/semantic.py): un shard de vectores por usuario.
+CHAT_SEMANTIC_INDEX_DIR = env('CHAT_SEMANTIC_INDEX_DIR', default=os.path.join(BASE_DIR, 'var', 'semantic_index'))
+# Caché de respuestas del agente (apps/chat/answer_cache.py): LRU + TTL (segundos) + umbral de similitud.
+CHAT_ANSWER_CACHE_ENABLED = env.bool('CHAT_ANSWER_CACHE_ENABLED', default=True)
+CHAT_ANSWER_CACHE_SIZE = env.int('CHAT_ANSWER_CACHE_SIZE', default=2048)
+CHAT_ANSWER_CACHE_TTL = env.int('CHAT_ANSWER_CACHE_TTL', default=6 * 60 * 60)
+CHAT_ANSWER_CACHE_THRESHOLD = env.float('CHAT_ANSWER_CACHE_THRESHOLD', default=0.9)
+# Clasificador de intención local (apps/chat/intent.py); se reentrena con `manage.py train_intent_model`.
+CHAT_INTENT_ROUTING_ENABLED = env.bool('CHAT_INTENT_ROUTING_ENABLED', default=True)
+CHAT_INTENT_MIN_MARGIN = env.float('CHAT_INTENT_MIN_MARGIN', default=0.15)
+CHAT_INTENT_MODEL_PATH = env('CHAT_INTENT_MODEL_PATH', default=os.path.join(BASE_DIR, 'var', 'intent_model.npz'))
+# El agente se construye de forma perezosa; los workers WSGI/ASGI lo precalientan al arrancar.
+CHAT_AGENT_WARM_UP = env.bool('CHAT_AGENT_WARM_UP', default=True)
+CHAT_AGENT_VERBOSE = env.bool('CHAT_AGENT_VERBOSE', default=False)  # AgentExecutor(verbose=...): imprime cada paso en stdout
+# Herramientas del agente (apps/chat/executor.py): las llamadas de un mismo paso corren en paralelo.
+CHAT_TOOL_TIMEOUT = env.float('CHAT_TOOL_TIMEOUT', default=75)  # segundos por llamada (el MAS tiene 60 s de timeout)
+CHAT_TOOL_MAX_WORKERS = env.int('CHAT_TOOL_MAX_WORKERS', default=16)  # hilos del pool compartido por el proceso
+# Lotes de preguntas (POST /api/chats/<uid>/messages/batch/): tamaño máximo y preguntas respondidas a la vez.
+CHAT_BATCH_MAX_QUESTIONS = env.int('CHAT_BATCH_MAX_QUESTIONS', default=20)
+CHAT_BATCH_MAX_PARALLEL = env.int('CHAT_BATCH_MAX_PARALLEL', default=4)
+# Cachés: `default` (limitador, réplicas) y `responses`, la caché de respuestas GET (apps/chat/response_cache.py).
+# `responses` es memoria local del proceso delante de ficheros compartidos por los workers (apps/utils/cache.py);
+# RESPONSE_CACHE_URL la sustituye por otro backend compartido (p. ej. redis://).
+# Las versiones de esas respuestas van aparte (`response_versions`): un directorio pequeño que nunca se purga,
+# para que la purga de las entradas no las borre. El directorio de entradas se purga como mucho cada CULL_INTERVAL s.
+RESPONSE_CACHE_DIR = env('RESPONSE_CACHE_DIR', default=os.path.join(BASE_DIR, 'var', 'response_cache'))
+CACHES = {
+    'default': env.cache_url('CACHE_URL', default='locmemcache://'),
+    'responses': env.cache_url('RESPONSE_CACHE_URL') if env('RESPONSE_CACHE_URL', default='') else {
+        'BACKEND': 'apps.utils.cache.TieredCache',
+        'LOCATION': RESPONSE_CACHE_DIR,
+        'OPTIONS': {'MAX_ENTRIES': 20000, 'CULL_INTERVAL': 60, 'LOCAL_MAX_ENTRIES': 1000, 'LOCAL_TIMEOUT': 60},
+    },
+    'response_versions': env.cache_url('RESPONSE_CACHE_URL') if env('RESPONSE_CACHE_URL', default='') else {
+        'BACKEND': 'apps.utils.cache.SparseCullFileBasedCache',
+        'LOCATION': os.path.join(RESPONSE_CACHE_DIR, 'versions'),
+        'OPTIONS': {'CULL_INTERVAL': None},
+    },
+}
+RESPONSE_CACHE_ENABLED = env.bool('RESPONSE_CACHE_ENABLED', default=True)
+RESPONSE_CACHE_ALIAS = 'responses'
+RESPONSE_CACHE_VERSIONS_ALIAS = 'response_versions'
+RESPONSE_CACHE_TIMEOUT = env.int('RESPONSE_CACHE_TIMEOUT', default=300)
+# Envíos idempotentes (apps/chat/idempotency.py): cabecera Idempotency-Key y supresión de envíos repetidos.
+# Usan la caché `default`, que debe ser compartida entre workers (CACHE_URL) para cubrirlos a todos.
+CHAT_IDEMPOTENCY_TTL = env.int('CHAT_IDEMPOTENCY_TTL', default=86400)  # respuestas guardadas por clave
+CHAT_IDEMPOTENCY_IN_FLIGHT_TTL = env.int('CHAT_IDEMPOTENCY_IN_FLIGHT_TTL', default=300)  # reclamo de un turno en curso
+CHAT_IDEMPOTENCY_WAIT = env.int('CHAT_IDEMPOTENCY_WAIT', default=120)  # espera máxima de un reintento
+CHAT_DUPLICATE_WINDOW = env.int('CHAT_DUPLICATE_WINDOW', default=10)  # mismo texto en el mismo chat; 0 lo desactiva
+# Transcripción desnormalizada por chat (apps/chat/transcripts.py): el historial se lee de una fila.
+# Se compacta al llegar a CHAT_TRANSCRIPT_COMPACT_SEGMENTS segmentos; `manage.py rebuild_transcripts --check` detecta desvíos.
+CHAT_TRANSCRIPT_ENABLED = env.bool('CHAT_TRANSCRIPT_ENABLED', default=True)
+CHAT_TRANSCRIPT_COMPACT_SEGMENTS = env.int('CHAT_TRANSCRIPT_COMPACT_SEGMENTS', default=64)
+# Limitador de llamadas salientes al LLM (apps/chat/llm_limiter.py): concurrencia, cola acotada y token bucket.
+CHAT_LLM_MAX_CONCURRENCY = env.int('CHAT_LLM_MAX_CONCURRENCY', default=8)
+CHAT_LLM_MAX_QUEUE = env.int('CHAT_LLM_MAX_QUEUE', default=32)
+CHAT_LLM_MAX_WAIT = env.float('CHAT_LLM_MAX_WAIT', default=20)  # segundos en cola antes de responder 429
+CHAT_LLM_RATE = env.float('CHAT_LLM_RATE', default=2.0)  # llamadas por segundo (0 = sin límite)
+CHAT_LLM_BURST = env.int('CHAT_LLM_BURST', default=10)
+CHAT_LLM_SHARED_RATE = env.bool('CHAT_LLM_SHARED_RATE', default=False)  # requiere una caché compartida (CACHES)
+CHAT_LLM_MAX_RETRIES = env.int('CHAT_LLM_MAX_RETRIES', default=1)  # reintentos internos del SDK de OpenAI
+# Bulkheads (apps/utils/middleware.py): cupos de peticiones concurrentes por clase en cada worker.
+# WORKER_THREADS debe coincidir con los hilos del worker (gunicorn --threads).
+WORKER_THREADS = env.int('WORKER_THREADS', default=8)
+BULKHEAD_READ_RESERVE = env.int('BULKHEAD_READ_RESERVE', default=2)  # hilos que el agente nunca puede ocupar
+BULKHEADS = {
+    'agent': {
+        'max_in_flight': env.int('BULKHEAD_AGENT_MAX_IN_FLIGHT', default=6),
+        'retry_after': 10,
+        'routes': [('POST', r'^/api/chats/[0-9a-f-]+/messages/(batch/)?$')],
+    },
+}
+# Métricas Prometheus en /api/metrics/ (apps/chat/metrics.py): superusuario o `Authorization: Bearer <METRICS_TOKEN>`.
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+# Trazas de los turnos (apps/chat/tracing.py), en JSON lines; `manage.py trace_report <trace_id>` muestra el desglose.
+CHAT_TRACING_ENABLED = env.bool('CHAT_TRACING_ENABLED', default=False)
+CHAT_TRACE_SAMPLE_RATE = env.float('CHAT_TRACE_SAMPLE_RATE', default=1.0)  # fracción de turnos trazados sin `traceparent`
+CHAT_TRACE_FILE = env('CHAT_TRACE_FILE', default=os.path.join(BASE_DIR, 'var', 'traces.jsonl'))
+CHAT_TRACE_MAX_BYTES = env.int('CHAT_TRACE_MAX_BYTES', default=50 * 1024 * 1024)  # se rota una vez a .1
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -253,4 +366,8 @@ CORS_ORIGIN_WHITELIST = [
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
-AUTH_USER_MODEL = 'utils.CustomUser'
\ No newline at end of file
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'traceparent')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed', 'X-Trace-Id', 'Retry-After']
+AUTH_USER_MODEL = 'utils.CustomUser'
+# `manage.py test` no escribe en var/: índices y cachés en disco van a un directorio temporal.
+TEST_RUNNER = 'apps.utils.test_runner.IsolatedStorageTestRunner'
\ No newline at end of file
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+# Construye el agente LangChain al arrancar el worker, no en su primera petición.
+from django.conf import settings  # noqa: E402
+
+if getattr(settings, "CHAT_AGENT_WARM_UP", True):
+    from apps.chat.langchain_setup import warm_up  # noqa: E402
+    warm_up()
@@ -1,8 +1,10 @@
 # locustfile.py
 from locust import HttpUser, task, between, events
+import json
 import random
 import time
 import os
+import requests
 from dotenv import load_dotenv # Para cargar variables de entorno si usas .env
 
 load_dotenv() # Carga variables de .env si existe
@@ -177,4 +179,163 @@ class ChatUser(AuthenticatedUser):
                 response.failure(f"Fallo al borrar chat {chat_to_delete_uid}: {response.status_code}")
 
     def on_stop(self):
-        print(f"Usuario {self.user_credentials['username']} finalizando.")
\ No newline at end of file
+        print(f"Usuario {self.user_credentials['username']} finalizando.")
+
+
+# --- Escenarios contra los emuladores (`python manage.py run_emulators`) ---
+# Arranca la API con OPENAI_BASE_URL/MAS_API_URL apuntando a los emuladores y ejecuta UN escenario:
+#   locust -f locustfile.py --headless -u 20 -r 5 -t 5m LongHistoryUser
+# Al terminar se imprimen p50/p95/p99 por endpoint y se comparan con LOCUST_BASELINE
+# (LOCUST_SAVE_BASELINE=1 guarda la ejecución como nueva referencia).
+EMULATOR_MAS_URL = os.getenv("EMULATOR_MAS_URL", "http://127.0.0.1:8011")
+LOCUST_BASELINE = os.getenv("LOCUST_BASELINE", "locust_baseline.json")
+BASELINE_TOLERANCE = float(os.getenv("LOCUST_BASELINE_TOLERANCE", "0.2"))
+PORTS = ["La Habana", "Cádiz", "Veracruz", "Cartagena", "Matanzas", "Santiago de Cuba", "Nueva Orleans", "Liverpool"]
+
+
+def data_question():
+    # El número de consulta evita los aciertos de la caché de respuestas (los números deben coincidir).
+    return f"¿Qué barcos llegaron a {random.choice(PORTS)} en {random.randint(1800, 1899)}? (consulta {random.randint(1, 10**6)})"
+
+
+def set_mas_emulator(**changes):
+    response = requests.post(f"{EMULATOR_MAS_URL}/_control", json=changes, timeout=5)
+    response.raise_for_status()
+    return response.json()
+
+
+class ScenarioUser(AuthenticatedUser):
+    abstract = True
+    wait_time = between(0.5, 2)
+
+    def create_chat(self, name="/api/chats/ (POST)"):
+        response = self.client.post("/api/chats/", json={"title": f"Locust {self.__class__.__name__}"}, name=name)
+        return response.json().get("uid") if response.status_code == 201 else None
+
+    def post_question(self, chat_uid, text, name):
+        with self.client.post(f"/api/chats/{chat_uid}/messages/", json={"text_message": text}, name=name,
+                              catch_response=True) as response:
+            if response.status_code == 201:
+                response.success()
+            elif response.status_code in (429, 503):
+                response.failure(f"Rechazada por saturación ({response.status_code}, Retry-After {response.headers.get('Retry-After')})")
+            else:
+                response.failure(f"{response.status_code} - {response.text[:200]}")
+
+
+class LongHistoryUser(ScenarioUser):
+    """ Turns on chats with a long history (LOCUST_HISTORY_MESSAGES messages imported up front). """
+    history_messages = int(os.getenv("LOCUST_HISTORY_MESSAGES", "200"))
+
+    def on_start(self):
+        super().on_start()
+        messages = []
+        for index in range(self.history_messages // 2):
+            messages.append({"rol": "user", "text_message": f"Pregunta {index}: {data_question()}"})
+            messages.append({"rol": "assistant", "text_message": f"Respuesta {index}: " + "registro histórico " * 20})
+        chat = {"title": "Locust historial largo", "messages": messages}
+        response = self.client.post("/api/chats/import/", data=json.dumps(chat) + "\n", name="/api/chats/import/ (setup)",
+                                    headers={"Content-Type": "application/x-ndjson"})
+        response.raise_for_status()
+        self.chat_uid = response.json()["chat_uids"][0]
+
+    @task(3)
+    def ask_with_long_history(self):
+        self.post_question(self.chat_uid, data_question(), name="[long-history] POST messages")
+
+    @task(1)
+    def read_long_history(self):
+        self.client.get(f"/api/chats/{self.chat_uid}/messages/", name="[long-history] GET messages")
+
+
+class ImageHeavyUser(ScenarioUser):
+    """ Every MAS answer carries a LOCUST_IMAGE_BYTES image (decode + save on the API side). """
+
+    def on_start(self):
+        super().on_start()
+        set_mas_emulator(image_ratio=1.0, image_bytes=int(os.getenv("LOCUST_IMAGE_BYTES", "2000000")))
+        self.chat_uid = self.create_chat()
+
+    @task
+    def ask_for_a_chart(self):
+        self.post_question(self.chat_uid, f"Muestrame un grafico de {data_question()}", name="[image-heavy] POST messages")
+
+
+class MasSlowdownUser(ScenarioUser):
+    """
+    The MAS alternates between its normal latency and LOCUST_SLOW_MAS_SECONDS every
+    LOCUST_SLOWDOWN_PERIOD seconds; cheap reads must keep their latency meanwhile.
+    """
+    controller_started = False
+
+    def on_start(self):
+        super().on_start()
+        self.chat_uid = self.create_chat()
+        if not MasSlowdownUser.controller_started:
+            MasSlowdownUser.controller_started = True
+            import gevent
+            gevent.spawn(self.toggle_mas_latency)
+
+    @staticmethod
+    def toggle_mas_latency():
+        import gevent
+        normal = set_mas_emulator()["latency"]
+        slow = f"fixed:{os.getenv('LOCUST_SLOW_MAS_SECONDS', '15')}"
+        period = float(os.getenv("LOCUST_SLOWDOWN_PERIOD", "60"))
+        is_slow = False
+        while True:
+            gevent.sleep(period)
+            is_slow = not is_slow
+            set_mas_emulator(latency=slow if is_slow else normal)
+
+    @task(2)
+    def ask_the_mas(self):
+        self.post_question(self.chat_uid, data_question(), name="[mas-slowdown] POST messages")
+
+    @task(3)
+    def cheap_read(self):
+        self.client.get("/api/chats/", name="[mas-slowdown] GET chats")
+
+
+@events.quitting.add_listener
+def report_percentiles(environment, **kwargs):
+    """ p50/p95/p99 per endpoint compared with the stored baseline of the same scenario. """
+    scenario = os.getenv("LOCUST_SCENARIO") or ",".join(sorted(cls.__name__ for cls in environment.user_classes))
+    current = {}
+    for entry in environment.stats.entries.values():
+        if entry.num_requests:
+            current[f"{entry.method} {entry.name}"] = {
+                "requests": entry.num_requests,
+                "failures": entry.num_failures,
+                "p50": entry.get_response_time_percentile(0.50),
+                "p95": entry.get_response_time_percentile(0.95),
+                "p99": entry.get_response_time_percentile(0.99),
+            }
+    try:
+        with open(LOCUST_BASELINE) as handle:
+            baselines = json.load(handle)
+    except (FileNotFoundError, ValueError):
+        baselines = {}
+    baseline = baselines.get(scenario, {})
+
+    print(f"\nEscenario {scenario} (ms; entre paréntesis la referencia):")
+    regressions = []
+    for name, stats in sorted(current.items()):
+        reference = baseline.get(name, {})
+        cells = []
+        for key in ("p50", "p95", "p99"):
+            cells.append(f"{key} {stats[key]:>7.0f}" + (f" ({reference[key]:.0f})" if key in reference else ""))
+            if key in reference and reference[key] and stats[key] > reference[key] * (1 + BASELINE_TOLERANCE):
+                regressions.append(f"{name} {key}: {stats[key]:.0f} ms > {reference[key]:.0f} ms")
+        print(f"  {name:<45} " + "  ".join(cells) + f"  fallos {stats['failures']}/{stats['requests']}")
+    for regression in regressions:
+        print(f"  REGRESIÓN {regression}")
+    if regressions:
+        environment.process_exit_code = 1
+
+    if os.getenv("LOCUST_SAVE_BASELINE") == "1":
+        baselines[scenario] = current
+        with open(LOCUST_BASELINE, "w") as handle:
+            json.dump(baselines, handle, indent=2, sort_keys=True)
+        print(f"  Referencia guardada en {LOCUST_BASELINE}.")
+